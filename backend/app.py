@@ -1,4 +1,4 @@
-from flask import Flask
+from flask import Flask, request, g
 from flask_cors import CORS
 from routes.map_routes import map_bp
 from routes.tool_routes import tool_bp
@@ -6,11 +6,29 @@ from routes.layer_routes import layer_bp
 from routes.search_routes import search_bp
 from routes.upload_routes import upload_bp
 from routes.ai_routes import ai_bp
+from routes.metrics_routes import metrics_bp
+from routes.job_routes import job_bp
+from services.inference_worker import preload_inference
+from services.workspace import WORKSPACE_HEADER, activate_workspace, release_workspace, start_snapshots
+from services.ee_retry import start_retry_budget, end_retry_budget
 from setting import init_earth_engine
+import os
 
 app = Flask(__name__)
 CORS(app)
 
+# 每个请求绑定到客户端的工作区（X-Workspace-Id 请求头），未提供时使用默认工作区
+@app.before_request
+def bind_workspace():
+    g.workspace_token = activate_workspace(request.headers.get(WORKSPACE_HEADER))
+    # 本请求内所有 Earth Engine 调用共享的重试次数
+    g.retry_budget_token = start_retry_budget()
+
+@app.teardown_request
+def unbind_workspace(exc=None):
+    end_retry_budget(g.pop('retry_budget_token', None))
+    release_workspace(g.pop('workspace_token', None))
+
 def init_app():
     """Initialize the application"""
     # Initialize Earth Engine
@@ -23,6 +41,26 @@ def init_app():
     app.register_blueprint(search_bp, url_prefix='/search')
     app.register_blueprint(upload_bp, url_prefix='/upload')
     app.register_blueprint(ai_bp, url_prefix='/ai')
+    app.register_blueprint(metrics_bp)
+    app.register_blueprint(job_bp)
+
+    # 定期保存工作区快照，重启后客户端首次访问时恢复
+    start_snapshots()
+
+    # 可选：启动时在后台预加载 AI 推理栈（VGEE_PRELOAD_AI）或连同模型权重一起加载（VGEE_PRELOAD_MODELS）
+    # 默认在首次 AI 请求时才导入 torch 和 samgeo
+    if os.environ.get('VGEE_PRELOAD_MODELS') == '1':
+        preload_inference(models=True)
+    elif os.environ.get('VGEE_PRELOAD_AI') == '1':
+        preload_inference()
+
+def create_app():
+    '''
+    多进程部署入口，例如：
+    VGEE_LAYER_BACKEND=sqlite gunicorn -w 4 -b 0.0.0.0:5000 "app:create_app()"
+    '''
+    init_app()
+    return app
 
 if __name__ == '__main__':
     init_app()
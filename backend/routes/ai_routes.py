@@ -1,12 +1,23 @@
 from flask import Blueprint, jsonify, request
-from services.map_service import get_all_datasets
+from services.map_service import get_all_datasets, pin_layers
 from services.ai_service import text_single_layer, point_single_layer
 from concurrent.futures import ThreadPoolExecutor, as_completed
 from services.sample_service import get_all_samples
+from services.inference_scheduler import QueueFullError
+from services.inference_worker import get_inference_status
 from tools.parallel_processor import ParallelProcessor
 
 ai_bp = Blueprint('ai', __name__)
-maxthread_num = 4
+
+@ai_bp.route('/status', methods=['GET'])
+def status():
+    '''
+    AI 推理栈就绪状态：torch / samgeo 是否已导入、模型是否已加载
+    '''
+    return jsonify({
+        'success': True,
+        **get_inference_status()
+    }), 200
 
 @ai_bp.route('/text_segment', methods=['POST'])
 def text_segment():
@@ -24,16 +35,19 @@ def text_segment():
             
         datasets, datasetsNames = get_all_datasets()
         
-        # 使用通用的并行处理函数
-        results = ParallelProcessor.process_layers(
-            layer_ids=layer_ids,
-            process_func=text_single_layer,
-            max_workers=maxthread_num,
-            datasets=datasets,
-            datasetsNames=datasetsNames,
-            params=params,
-            vis_params=vis_params
-        )
+        # 使用通用的并行处理函数，处理期间固定输入图层；每个图层推理时才获取 LangSAM 执行名额
+        with pin_layers(layer_ids):
+            results = ParallelProcessor.process_layers(
+                layer_ids=layer_ids,
+                process_func=text_single_layer,
+                lane='cpu',
+                datasets=datasets,
+                datasetsNames=datasetsNames,
+                params=params,
+                vis_params=vis_params
+            )
+        # 多提示模式下每个图层返回多个类别图层
+        results = [layer for layers in results for layer in layers]
 
         if not results:
             raise ValueError("No successful segmentation results")
@@ -44,6 +58,13 @@ def text_segment():
             'results': results
         }), 200
 
+    except QueueFullError as e:
+        print(f"Error in segment_image: {str(e)}")
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 503, {'Retry-After': str(e.retry_after)}
+
     except Exception as e:
         print(f"Error in segment_image: {str(e)}")
         return jsonify({
@@ -61,6 +82,7 @@ def point_segment():
         data = request.json
         layer_ids = data.get('layer_ids', [])
         vis_params = data.get('visParams', {})
+        params = data.get('params', {})
         samples = get_all_samples()
         
         if not layer_ids:
@@ -68,16 +90,18 @@ def point_segment():
             
         datasets, datasetsNames = get_all_datasets()
         
-        # 使用通用的并行处理函数
-        results = ParallelProcessor.process_layers(
-            layer_ids=layer_ids,
-            process_func=point_single_layer,
-            max_workers=maxthread_num,
-            datasets=datasets,
-            datasetsNames=datasetsNames,
-            samples=samples,
-            vis_params=vis_params
-        )
+        # 使用通用的并行处理函数，处理期间固定输入图层；每个图层推理时才获取 SAM 执行名额
+        with pin_layers(layer_ids):
+            results = ParallelProcessor.process_layers(
+                layer_ids=layer_ids,
+                process_func=point_single_layer,
+                lane='cpu',
+                datasets=datasets,
+                datasetsNames=datasetsNames,
+                samples=samples,
+                vis_params=vis_params,
+                params=params
+            )
 
         if not results:
             raise ValueError("No successful segmentation results")
@@ -88,6 +112,13 @@ def point_segment():
             'results': results
         }), 200
 
+    except QueueFullError as e:
+        print(f"Error in point_segment: {str(e)}")
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 503, {'Retry-After': str(e.retry_after)}
+
     except Exception as e:
         print(f"Error in point_segment: {str(e)}")
         return jsonify({
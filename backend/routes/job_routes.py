@@ -0,0 +1,82 @@
+import json
+from flask import Blueprint, jsonify, Response
+from services.workspace import current_workspace
+from services.job_service import job_manager
+
+job_bp = Blueprint('jobs', __name__)
+
+# 任务事件流没有状态变化时发送心跳的间隔（秒），防止代理断开空闲连接
+EVENT_HEARTBEAT = 15
+
+
+def _job_not_found(job_id):
+    return jsonify({
+        'success': False,
+        'message': f'Job {job_id} not found or expired'
+    }), 404
+
+
+@job_bp.route('/jobs', methods=['GET'])
+def list_jobs():
+    '''
+    列出当前工作区的后台任务（不含结果）
+    '''
+    jobs = job_manager.list(current_workspace().id)
+    return jsonify({
+        'success': True,
+        'jobs': [job.to_dict(include_result=False) for job in jobs]
+    })
+
+
+@job_bp.route('/jobs/<job_id>', methods=['GET'])
+def get_job(job_id):
+    '''
+    查询后台任务的状态、进度和结果
+    '''
+    job = job_manager.get(job_id, current_workspace().id)
+    if job is None:
+        return _job_not_found(job_id)
+    return jsonify({'success': True, **job.to_dict()})
+
+
+@job_bp.route('/jobs/<job_id>/cancel', methods=['POST'])
+@job_bp.route('/jobs/<job_id>', methods=['DELETE'])
+def cancel_job(job_id):
+    '''
+    取消后台任务，已结束的任务不受影响
+    '''
+    job = job_manager.get(job_id, current_workspace().id)
+    if job is None:
+        return _job_not_found(job_id)
+    if not job.is_finished():
+        job.cancel()
+    return jsonify({'success': True, **job.to_dict(include_result=False)})
+
+
+@job_bp.route('/jobs/<job_id>/events', methods=['GET'])
+def job_events(job_id):
+    '''
+    以 Server-Sent Events 推送任务状态和进度，任务结束时推送结果并关闭连接
+    '''
+    job = job_manager.get(job_id, current_workspace().id)
+    if job is None:
+        return _job_not_found(job_id)
+
+    def stream():
+        version = -1
+        while True:
+            current = job.wait_for_change(version, EVENT_HEARTBEAT)
+            if current == version:
+                yield ': keep-alive\n\n'
+                continue
+            version = current
+            finished = job.is_finished()
+            data = json.dumps(job.to_dict(include_result=finished))
+            yield f"event: {'done' if finished else 'status'}\ndata: {data}\n\n"
+            if finished:
+                break
+
+    return Response(stream(), mimetype='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no'
+    })
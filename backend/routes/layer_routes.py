@@ -1,10 +1,14 @@
 from flask import Blueprint, jsonify, request
 from services.layer_service import get_layer_info_service, update_vis_params_service
-from services.map_service import get_dataset  # 导入函数而不是变量
+from services.map_service import get_dataset, get_band_names  # 导入函数而不是变量
+from services.common import evaluate_batch
+from services.eval_cache import cached_get_info
+from services.coalescing import coalesce_requests
 
 layer_bp = Blueprint('layer', __name__)
 
 @layer_bp.route('/layer-info', methods=['GET'])
+@coalesce_requests
 def get_layer_info():
     try:
         layer_id = request.args.get('id', '0')
@@ -12,7 +16,7 @@ def get_layer_info():
         satellite = request.args.get('satellite', 'LANDSAT')
         print(f"Layer_routes.py - get_layer_info - satellite: {satellite}")
         current_dataset = get_dataset(layer_id)
-        result = get_layer_info_service(current_dataset, satellite)
+        result = get_layer_info_service(current_dataset, satellite, get_band_names(layer_id))
         print(f"Layer_routes.py - get_layer_info - result: {result}")
         return jsonify(result)
     except Exception as e:
@@ -51,21 +55,17 @@ def get_layer_properties():
             raise ValueError(f"No dataset found for layer {layer_id}")
             
         # 获取所有属性名
-        property_names = dataset.propertyNames().getInfo()
+        property_names = cached_get_info(dataset.propertyNames(), 'metadata')
         print(f"Layer_routes.py - get_layer_properties - property_names: {property_names}")
         
         # 构建属性对象
         properties = {
-            'bands': dataset.bandNames().getInfo()
+            'bands': get_band_names(layer_id)
         }
         
-        # 获取所有属性值
-        for prop in property_names:
-            try:
-                properties[prop] = dataset.get(prop).getInfo()
-            except:
-                properties[prop] = None
-                
+        # 所有属性值一次求值，单个属性出错时为 None
+        properties.update(evaluate_batch({prop: dataset.get(prop) for prop in property_names}, errors={}))
+
             
         return jsonify({
             'success': True,
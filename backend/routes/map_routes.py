@@ -4,15 +4,18 @@ from config.satellite_config import SATELLITE_CONFIGS
 import ee
 from services import sample_service
 from flask_cors import CORS
-from scripts.fetch_satellite_dates import fetch_dataset_details
+from services.workspace import current_workspace, QuotaExceededError
+from services.common import evaluate_batch
+from services.eval_cache import cached_get_info
+from services.reduce_cache import evaluate_reductions
+from services.coalescing import coalesce_requests
 
 map_bp = Blueprint('map', __name__)
 CORS(map_bp)
 
-# 存储研究区域列表
-study_areas = []
+# 研究区域列表保存在当前请求的工作区中，返回副本；修改使用 current_workspace().edit_study_areas()
 def get_study_areas():
-    return study_areas
+    return current_workspace().study_areas
 
 
 @map_bp.route('/map-data', methods=['GET'])
@@ -31,6 +34,7 @@ def get_map_data():
               f"endDate: {end_date}, cloudCover: {cloud_cover}, layerName:{layerName}, type:{type}")
         
         # 如果有多个研究区域，将它们合并成一个多边形
+        study_areas = get_study_areas()
         merged_area = None
         if study_areas:
             # 将所有多边形合并成一个，只使用坐标部分
@@ -55,7 +59,6 @@ def get_map_data():
 @map_bp.route('/filter-by-geometry', methods=['POST'])
 def filter_by_geometry():
     try:
-        global study_areas
         data = request.json
         print(f"Map_routes.py - Received data: {data}")
         
@@ -86,30 +89,34 @@ def filter_by_geometry():
                 })
             
             # 将处理后的几何信息提取到列表
-            processed_features = vector_asset.map(extract_geometry).getInfo()
-            
-            # 添加到 study_areas 列表
-            for feature in processed_features['features']:
-                study_areas.append({
-                    'asset_id': feature['properties']['asset_id'],
-                    'coordinates': feature['properties']['coordinates']
-                })
-            
-            print(f"Map_routes.py - Added vector asset as study area. Total areas: {len(study_areas)}")
+            processed_features = cached_get_info(vector_asset.map(extract_geometry))
+            new_areas = [{
+                'asset_id': feature['properties']['asset_id'],
+                'coordinates': feature['properties']['coordinates']
+            } for feature in processed_features['features']]
         
         else:
             # 处理手动绘制的几何图形
             geometry = data['geometry']
-            study_areas.append({
+            new_areas = [{
                 'asset_id': 'manual',
                 'coordinates': [geometry['coordinates'][0]]
-            })
-            
+            }]
+        
+        # 添加到 study_areas 列表：检查配额和保存在同一次修改中完成，并发请求不会互相覆盖
+        workspace = current_workspace()
+        with workspace.edit_study_areas() as study_areas:
+            workspace.check_quota('study_areas', len(study_areas) + len(new_areas))
+            study_areas.extend(new_areas)
+        
+        print(f"Map_routes.py - Added {len(new_areas)} study areas. Total areas: {len(study_areas)}")
         return jsonify({
             'success': True,
             'message': f'Study area added successfully. Total areas: {len(study_areas)}'
         })
 
+    except QuotaExceededError as e:
+        return jsonify({'success': False, 'message': str(e)}), 429
     except Exception as e:
         print(f"Map_routes.py - Error in filter_by_geometry: {str(e)}")
         return jsonify({'error': str(e)}), 500
@@ -118,31 +125,31 @@ def filter_by_geometry():
 @map_bp.route('/remove-geometry', methods=['POST'])
 def remove_geometry():
     try:
-        global study_areas
         data = request.json
         print(f"Map_routes.py - Received data: {data}")
         
-        if data.get('type') == 'vector':
-            # 处理矢量资产
-            asset_id = data.get('asset_id')
-            # 获取移除前的数量
-            before_count = len(study_areas)
-            
-            # 直接根据资产ID过滤
-            study_areas = [area for area in study_areas if area['asset_id'] != asset_id]
-            
-            # 获取移除后的数量
-            after_count = len(study_areas)
-            print(f"Map_routes.py - Removed {before_count - after_count} areas for asset {asset_id}")
-            
-        else:
-            # 处理手动绘制的几何图形
-            deleted_coordinates = data['geometry']['coordinates']
-            # 将要删除的坐标转换为字符串进行比较
-            deleted_str = [str(coords) for coords in deleted_coordinates]
-            # 过滤掉被删除的坐标
-            study_areas = [area for area in study_areas 
-                          if str(area['coordinates'][0]) not in deleted_str]
+        with current_workspace().edit_study_areas() as study_areas:
+            if data.get('type') == 'vector':
+                # 处理矢量资产
+                asset_id = data.get('asset_id')
+                # 获取移除前的数量
+                before_count = len(study_areas)
+                
+                # 直接根据资产ID过滤
+                study_areas[:] = [area for area in study_areas if area['asset_id'] != asset_id]
+                
+                # 获取移除后的数量
+                after_count = len(study_areas)
+                print(f"Map_routes.py - Removed {before_count - after_count} areas for asset {asset_id}")
+                
+            else:
+                # 处理手动绘制的几何图形
+                deleted_coordinates = data['geometry']['coordinates']
+                # 将要删除的坐标转换为字符串进行比较
+                deleted_str = [str(coords) for coords in deleted_coordinates]
+                # 过滤掉被删除的坐标
+                study_areas[:] = [area for area in study_areas 
+                              if str(area['coordinates'][0]) not in deleted_str]
         
         print(f"Map_routes.py - Removed geometries. Remaining areas: {len(study_areas)}")
         
@@ -184,6 +191,7 @@ def remove_layer():
         }), 500
 
 @map_bp.route('/compute-stats', methods=['POST'])
+@coalesce_requests
 def compute_band_stats():
     try:
         data = request.get_json()
@@ -210,7 +218,7 @@ def compute_band_stats():
         stats = map_service.compute_image_stats(dataset, bands, dataset.geometry())
         
         if stats:
-            stats_dict = stats.getInfo()
+            stats_dict = evaluate_reductions({'stats': stats}, layer_id)['stats']
             print(f"Map_routes.py - Final stats: min={stats_dict.get('global_min')}, max={stats_dict.get('global_max')}")
             return jsonify({
                 'success': True,
@@ -237,7 +245,7 @@ def get_satellite_config():
         satellite_options = []
         
         for collection_id in SATELLITE_CONFIGS:
-            dataset_info = fetch_dataset_details(collection_id)
+            dataset_info = map_service.get_dataset_details(collection_id)
             if dataset_info:
                 series = dataset_info['id'].split('/')[0] + '系列'
                 satellite_options.append({
@@ -280,6 +288,8 @@ def add_sample():
             layer_type=data.get('type')
         )
         return jsonify(result)
+    except QuotaExceededError as e:
+        return jsonify({'success': False, 'message': str(e)}), 429
     except Exception as e:
         print(f"Map_routes.py - Error in add_sample: {str(e)}")
         return jsonify({
@@ -330,7 +340,7 @@ def rename_layer():
             }), 400
             
         # 更新图层名称
-        map_service.save_dataset(layer_id, map_service.get_dataset(layer_id), new_name)
+        map_service.rename_dataset(layer_id, new_name)
             
         return jsonify({
             'success': True,
@@ -546,6 +556,7 @@ def export_layer_to_asset():
         }), 500
 
 @map_bp.route('/get-pixel-value', methods=['POST'])
+@coalesce_requests
 def get_pixel_value():
     try:
         data = request.get_json()
@@ -557,22 +568,25 @@ def get_pixel_value():
         point = ee.Geometry.Point([lng, lat])
         pixel_values = {}  # 创建一个字典来存储结果
 
-        # 遍历所有影像并获取像素值
+        # 所有栅格图层在该点的像素值一次求值；矢量图层没有像素值，加入批量求值会使整批失败
+        samples = {}
         for layer_id, image in dataset.items():
+            if map_service.is_vector_layer(layer_id):
+                continue
             try:
-                # 获取该点的像素值
-                pixel_value = ee.Image(image).sample(
-                    region=point, 
-                    scale=60
-                ).first().getInfo()
-                
-                if pixel_value and 'properties' in pixel_value:
-                    # 使用图层名称作为键
-                    layer_name = datasetsNames.get(layer_id, layer_id)
-                    pixel_values[layer_name] = pixel_value['properties']
+                samples[layer_id] = ee.Image(image).sample(region=point, scale=60).first()
             except Exception as e:
                 print(f"Error getting pixel value for layer {layer_id}: {str(e)}")
-                continue
+        errors = {}
+        values = evaluate_batch(samples, errors)
+        for layer_id, e in errors.items():
+            print(f"Error getting pixel value for layer {layer_id}: {str(e)}")
+
+        for layer_id, pixel_value in values.items():
+            if pixel_value and 'properties' in pixel_value:
+                # 使用图层名称作为键
+                layer_name = datasetsNames.get(layer_id, layer_id)
+                pixel_values[layer_name] = pixel_value['properties']
         
         return jsonify({
             'success': True,
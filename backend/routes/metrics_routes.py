@@ -0,0 +1,21 @@
+from flask import Blueprint, jsonify
+from services.metrics import collect_metrics
+
+metrics_bp = Blueprint('metrics', __name__)
+
+@metrics_bp.route('/metrics', methods=['GET'])
+def get_metrics():
+    '''
+    获取运行时指标（模型池、缓存等）
+    '''
+    try:
+        return jsonify({
+            'success': True,
+            'metrics': collect_metrics()
+        })
+    except Exception as e:
+        print(f"Error getting metrics: {str(e)}")
+        return jsonify({
+            'success': False,
+            'message': str(e)
+        }), 500
@@ -1,6 +1,12 @@
 from flask import Blueprint, jsonify, request
-from services.map_service import save_dataset, get_all_datasets, get_dataset
+from services.map_service import save_dataset, get_all_datasets, get_dataset, new_layer_id, get_layer_metadata, get_band_names
+from services.layer_metadata import describe, derive_metadata, metadata_expression, normalize_metadata
+from services.common import evaluate_batch
+from services.eval_cache import cached_get_map_id
+from services.reduce_cache import evaluate_reductions
 from services.sample_service import get_all_samples
+from services.job_service import JOB_TIMEOUT, job_route, current_job, cancel_checker, progress_reporter
+from services.ee_concurrency import ee_call
 from tools.preprocessing import PreprocessingTool
 from tools.classification import ClassificationTool 
 from tools.calculateIndex import IndexTool
@@ -8,26 +14,65 @@ from tools.parallel_processor import ParallelProcessor
 from tools.rasterOperator import RasterOperatorTool
 from tools.terrainOperator import TerrainOperationTool
 import ee
+import os
 import geemap
-import time
 
 tool_bp = Blueprint('tool', __name__)
 
-datasets = None
-datasetsNames = None
-maxthread_num = 4
+# 图层注册表的只读视图，始终反映当前图层
+datasets, datasetsNames = get_all_datasets()
 
+# 多图层工具的超时（秒）：单个图层、整个请求
+LAYER_TIMEOUT = float(os.environ.get('VGEE_LAYER_TIMEOUT', 120))
+TOOL_TIMEOUT = float(os.environ.get('VGEE_TOOL_TIMEOUT', 300))
 
-def return_origin_layer(layer_ids, results, vis_params, message):
+
+def map_layers(layer_ids, process_func, **kwargs):
+    '''
+    并行处理各图层，按输入顺序返回 (成功的图层ID列表, 结果列表, 失败列表)
+    出错、超时的图层被跳过并记入失败列表 [{layer_id, error}]，其余图层照常返回；
+    客户端断开或后台任务被取消时取消剩余任务
+    超时或取消后任务仍可能在后台运行结束，process_func 中不要保存图层，由调用方在返回后保存
+    在后台任务中执行时不使用请求级的超时，只受 JOB_TIMEOUT 和任务取消限制
+    '''
+    if current_job() is not None:
+        timeout, item_timeout = JOB_TIMEOUT or None, None
+    else:
+        timeout, item_timeout = TOOL_TIMEOUT, LAYER_TIMEOUT
+    outcomes = ParallelProcessor.map(
+        layer_ids, process_func,
+        timeout=timeout,
+        item_timeout=item_timeout,
+        is_cancelled=cancel_checker(),
+        on_progress=progress_reporter(),
+        **kwargs
+    )
+    failed = [{'layer_id': outcome.item, 'error': str(outcome.error) or type(outcome.error).__name__}
+              for outcome in outcomes if not outcome.ok]
+    layer_ids, results = ParallelProcessor.successful(outcomes)
+    return layer_ids, results, failed
+
+
+def return_origin_layer(layer_ids, results, vis_params, message, added_bands=None, failed=None):
     '''
     返回原始图层
+    added_bands: 工具追加的波段名称（可选），已知时由原图层元数据在本地推导新的波段信息
+    failed: map_layers 返回的失败列表（可选），随结果一起返回
     '''
     layer_results = []
     for i, layer_id in enumerate(layer_ids):
         result = ee.Image(results.get(i))
         # 获取波段信息
         try:
-            bandNames = result.bandNames().getInfo()
+            meta = None
+            if added_bands:
+                source_meta = get_layer_metadata(layer_id) or {}
+                source_bands = source_meta.get('bands') or []
+                if not set(added_bands) & set(source_bands):
+                    meta = derive_metadata(source_meta, source_bands + list(added_bands))
+            if meta is None:
+                meta = describe(result)
+            bandNames = meta['bands']
         except Exception as e:
             print(f"Error getting band names: {str(e)}")
             return jsonify({
@@ -37,7 +82,7 @@ def return_origin_layer(layer_ids, results, vis_params, message):
         
         print(f"Tool_routes.py - return_origin_layer - bandNames for {layer_id}:", bandNames)
 
-        datasets[layer_id] = result        
+        save_dataset(layer_id, result, datasetsNames.get(layer_id, layer_id), meta)
         layer_vis = next((v for v in vis_params if v['id'] == layer_ids[i]), None)
         params = layer_vis['visParams'] if layer_vis else {
             'bands': ['B4', 'B3', 'B2'],
@@ -46,7 +91,7 @@ def return_origin_layer(layer_ids, results, vis_params, message):
             'gamma': 1.4
         }
         
-        map_id = result.getMapId(params)
+        map_id = cached_get_map_id(result, params)
         print('Tool_routes.py - common_process-map_id:',params)
         
         layer_results.append({
@@ -64,10 +109,11 @@ def return_origin_layer(layer_ids, results, vis_params, message):
     return jsonify({
         'success': True,
         'message': message,
-        'results': layer_results
+        'results': layer_results,
+        'failed': failed or []
     })
     
-def return_new_layer(layer_ids, results, original_names, message, result_type=''):
+def return_new_layer(layer_ids, results, original_names, message, result_type='', failed=None):
     '''
     返回新的图层处理函数
     参数:
@@ -76,24 +122,32 @@ def return_new_layer(layer_ids, results, original_names, message, result_type=''
         original_names: 原始图层名称字典
         message: 返回给前端的消息
         result_type: 结果类型标识(可选)，用于生成新图层名称前缀
+        failed: map_layers 返回的失败列表(可选)，保存失败的图层也会加入其中
     '''
     layer_results = []
+    failed = list(failed or [])
     
     for i, result in enumerate(results):
         try:
             # 生成新的图层ID和名称
-            timestamp = int(time.time())
-            new_id = f"{result_type}_{timestamp}" if result_type else f"new_{timestamp}"
+            new_id = new_layer_id(result_type or 'new')
             original_name = original_names.get(layer_ids[i], f'Layer_{layer_ids[i]}')
             new_name = f"{original_name} ({result_type} result)" if result_type else f"{original_name} (result)"
             
-            # 获取波段信息
-            bandNames = result.bandNames().getInfo()
+            # 一次求值获取波段信息等元数据和处理函数设置的可视化参数
+            errors = {}
+            values = evaluate_batch({
+                'meta': metadata_expression(result),
+                'vis_params': result.get('vis_params')
+            }, errors)
+            if 'meta' in errors:
+                raise errors['meta']
+            meta = normalize_metadata(values['meta'])
+            bandNames = meta['bands']
             
             # 获取处理函数设置的可视化参数，如果没有则使用默认参数
-            try:
-                vis_params = result.get('vis_params').getInfo()
-            except:
+            vis_params = values['vis_params']
+            if 'vis_params' in errors:
                 default_bands = bandNames[:3] if len(bandNames) >= 3 else bandNames
                 vis_params = {
                     'bands': default_bands,
@@ -103,7 +157,7 @@ def return_new_layer(layer_ids, results, original_names, message, result_type=''
                 }
             
             # 获取地图瓦片URL
-            map_id = result.getMapId(vis_params)
+            map_id = cached_get_map_id(result, vis_params)
             
             # 构建图层结果对象
             layer_result = {
@@ -116,12 +170,13 @@ def return_new_layer(layer_ids, results, original_names, message, result_type=''
             }
             
             # 保存新的数据集
-            save_dataset(new_id, result, new_name)
+            save_dataset(new_id, result, new_name, meta)
             
             layer_results.append(layer_result)
             
         except Exception as e:
             print(f"处理图层 {layer_ids[i]} 时出错: {str(e)}")
+            failed.append({'layer_id': layer_ids[i], 'error': str(e)})
             continue
     
     if not layer_results:
@@ -130,23 +185,28 @@ def return_new_layer(layer_ids, results, original_names, message, result_type=''
     return jsonify({
         'success': True,
         'message': message,
-        'results': layer_results
+        'results': layer_results,
+        'failed': failed
     })
 
 
-def get_vis_params(result):
-    """动态计算可视化参数"""
+def get_vis_params(result, band_names=None):
+    """动态计算可视化参数
+    band_names: 结果的波段名称（可选），已知时不再向服务器查询
+    """
     try:
-        # 计算结果的统计信息
+        # 计算结果的统计信息，波段名称未知时一并求值
         stats = result.reduceRegion(
             reducer=ee.Reducer.minMax(),
             geometry=result.geometry(),
             scale=50,
             maxPixels=1e13
-        ).getInfo()
+        )
+        values = evaluate_reductions({'stats': stats, 'bands': band_names or result.bandNames()})
+        stats = values['stats']
         
         # 获取第一个波段的名称
-        first_band = result.bandNames().getInfo()[0]
+        first_band = values['bands'][0]
         print('Tool_routes.py - get_vis_params-first_band:', first_band)
         
         # 获取最小最大值
@@ -200,45 +260,23 @@ def calculate_index():
         vis_params = data.get('vis_params', [])
         
         IndexTool.validate_inputs(layer_ids, datasets)
-        selected_images = IndexTool.get_image_collection(layer_ids, datasets)
-        images_list = selected_images.toList(len(layer_ids))
-        
-        # 创建一个有序字典来存储结果
-        results_dict = {}
-        
-        def process_layer(layer_id, images_list=None, index_type=None):
-            try:
-                i = layer_ids.index(layer_id)
-                print('Tool_routes.py - calculate_index-layer_id:', layer_id)
-                image = ee.Image(images_list.get(i))
-                result = IndexTool.calculate_index(image, index_type)
-                # 存储结果时使用原始索引
-                results_dict[i] = result
-                return result
-            except Exception as e:
-                print(f"Error processing layer {layer_id}: {str(e)}")
-                return None
 
-        # 使用通用的并行处理函数
-        ParallelProcessor.process_layers(
-            layer_ids=layer_ids,
-            process_func=process_layer,
-            max_workers=maxthread_num,
-            images_list=images_list,
-            index_type=index_type
-        )
+        def process_layer(layer_id, index_type=None):
+            print('Tool_routes.py - calculate_index-layer_id:', layer_id)
+            return IndexTool.calculate_index(ee.Image(datasets[layer_id]), index_type)
+
+        # 使用通用的并行处理函数，结果按原始顺序排列，失败的图层被跳过
+        layer_ids, results, failed = map_layers(layer_ids, process_layer, index_type=index_type)
 
-        if not results_dict:
+        if not results:
             raise ValueError("No successful index calculation results")
             
-        # 按原始顺序重建结果列表
-        ordered_results = [results_dict[i] for i in range(len(layer_ids))]
-        
         # 转换结果为 ee.List
-        results = ee.List(ordered_results)
+        results = ee.List(results)
         
         # 使用原有的 common_process 处理结果
-        return return_origin_layer(layer_ids, results, vis_params, f'Added {index_type.upper()} band')
+        return return_origin_layer(layer_ids, results, vis_params, f'Added {index_type.upper()} band',
+                                   added_bands=[index_type.upper()], failed=failed)
         
     except Exception as e:
         print(f"Error in calculate_index: {str(e)}")
@@ -270,7 +308,7 @@ def image_filling():
         )
         
         #防止填补失败时出错
-        print('Tool_routes.py - image_filling-results:',results.size().getInfo())
+        print('Tool_routes.py - image_filling-results:', ee_call('aggregation', results.size().getInfo))
         # 使用 common_process 处理结果
         return return_origin_layer(layer_ids, results, vis_params, 'Image filling completed')
         
@@ -284,8 +322,6 @@ def image_filling():
 @tool_bp.route('/get-layers', methods=['GET'])
 def get_layers():
     try:
-        global datasets, datasetsNames
-        datasets, datasetsNames = get_all_datasets()
         landsat_layers = {}
         
         for layer_id, dataset in datasets.items():
@@ -322,43 +358,22 @@ def kmeans_clustering():
         cluster_counts = data.get('cluster_counts', {})
         
         ClassificationTool.validate_inputs(layer_ids, datasets)
-        selected_images = ClassificationTool.get_image_collection(layer_ids, datasets)
-        images_list = selected_images.toList(len(layer_ids))
-        
-        # 创建一个有序字典来存储结果
-        results_dict = {}
-        def process_layer(layer_id, images_list=None, cluster_counts=None):
-            try:
-                i = layer_ids.index(layer_id)
-                num_clusters = cluster_counts.get(layer_id, 5)
-                result = ClassificationTool.kmeans_clustering(
-                    ee.Image(images_list.get(i)), 
-                    num_clusters
-                )
-                # 设置聚类结果的可视化参数
-                result = result.set('vis_params', {
-                    'bands': ['cluster'],
-                    'min': 0,
-                    'max': num_clusters - 1
-                })
-                results_dict[i] = result
-                return result
-            except Exception as e:
-                print(f"Error processing layer {layer_id}: {str(e)}")
-                return None
-
-        # 使用通用的并行处理函数
-        ParallelProcessor.process_layers(
-            layer_ids=layer_ids,
-            process_func=process_layer,
-            max_workers=maxthread_num,
-            images_list=images_list,
-            cluster_counts=cluster_counts
-        )
 
-         # 按原始顺序重建结果列表
-        results = [results_dict[i] for i in range(len(layer_ids))]
+        def process_layer(layer_id, cluster_counts=None):
+            num_clusters = cluster_counts.get(layer_id, 5)
+            result = ClassificationTool.kmeans_clustering(
+                ee.Image(datasets[layer_id]), 
+                num_clusters
+            )
+            # 设置聚类结果的可视化参数
+            return result.set('vis_params', {
+                'bands': ['cluster'],
+                'min': 0,
+                'max': num_clusters - 1
+            })
 
+        # 使用通用的并行处理函数，结果按原始顺序排列，失败的图层被跳过
+        layer_ids, results, failed = map_layers(layer_ids, process_layer, cluster_counts=cluster_counts)
 
         if not results:
             raise ValueError("No successful classification results")
@@ -368,7 +383,8 @@ def kmeans_clustering():
             results=results,
             original_names=datasetsNames,
             message='K-means clustering completed',
-            result_type='kmeans'
+            result_type='kmeans',
+            failed=failed
         )
         
     except Exception as e:
@@ -386,10 +402,22 @@ def histogram_equalization():
         vis_params = data.get('vis_params', [])
         
         PreprocessingTool.validate_inputs(layer_ids, datasets)
-        selected_images = PreprocessingTool.get_image_collection(layer_ids, datasets)
-        results = selected_images.map(PreprocessingTool.histogram_equalization).toList(selected_images.size())
+        images = {layer_id: ee.Image(datasets[layer_id]) for layer_id in layer_ids}
+
+        # 所有图层的直方图和波段名称一次求值，结果缓存到磁盘；已知的波段名称优先使用图层元数据
+        values = evaluate_reductions(
+            {layer_id: PreprocessingTool.histogram_expression(image) for layer_id, image in images.items()},
+            layer_id={layer_id: layer_id for layer_id in layer_ids}
+        )
+        results = ee.List([
+            PreprocessingTool.histogram_equalization(
+                images[layer_id],
+                get_band_names(layer_id) or values[layer_id]['bands'],
+                values[layer_id]['histograms']
+            )
+            for layer_id in layer_ids
+        ])
 
-        
         return return_origin_layer(layer_ids, results, vis_params, 'Histogram equalization completed')
         
     except Exception as e:
@@ -401,6 +429,7 @@ def histogram_equalization():
 
 
 @tool_bp.route('/random-forest', methods=['POST'])
+@job_route('random-forest')
 def random_forest():
     try:
         data = request.json
@@ -411,60 +440,39 @@ def random_forest():
         if not samples:
             raise ValueError('No training samples available')
             
-        selected_images = PreprocessingTool.get_image_collection(layer_ids, datasets)
-        images_list = selected_images.toList(len(layer_ids))
-
-        # 创建一个有序字典来存储结果
-        results_dict = {}
-        
-        def process_layer(layer_id, images_list=None, rf_params=None, samples=None):
-            try:
-                i = layer_ids.index(layer_id)
-                layer_params = rf_params.get(layer_id, {})
-                num_trees = layer_params.get('numberOfTrees', 50)
-                train_ratio = layer_params.get('trainRatio', 0.7)
-                
-                image = ee.Image(images_list.get(i))
-                result = ClassificationTool.random_forest_classification(
-                    image, samples,
-                    num_trees=num_trees,
-                    train_ratio=train_ratio
-                )
-                # 设置分类结果的可视化参数
-                result = result.set('vis_params', {
-                    'bands': ['classification'],
-                    'min': 0,
-                    'max': len(samples) - 1
-                })
-                results_dict[i] = result
-                return result
-            except Exception as e:
-                print(f"Error processing layer {layer_id}: {str(e)}")
-                return None
-
-        ParallelProcessor.process_layers(
-            layer_ids=layer_ids,
-            process_func=process_layer,
-            max_workers=maxthread_num,
-            images_list=images_list,
-            rf_params=rf_params,
-            samples=samples
-        )
+        PreprocessingTool.validate_inputs(layer_ids, datasets)
 
-        # 按原始顺序重建结果列表
-        ordered_results = [results_dict[i] for i in range(len(layer_ids))]
-        print('Tool_routes.py - random_forest-ordered_results:', ordered_results)
+        def process_layer(layer_id, rf_params=None, samples=None):
+            layer_params = rf_params.get(layer_id, {})
+            num_trees = layer_params.get('numberOfTrees', 50)
+            train_ratio = layer_params.get('trainRatio', 0.7)
+            
+            image = ee.Image(datasets[layer_id])
+            result = ClassificationTool.random_forest_classification(
+                image, samples,
+                num_trees=num_trees,
+                train_ratio=train_ratio
+            )
+            # 设置分类结果的可视化参数
+            return result.set('vis_params', {
+                'bands': ['classification'],
+                'min': 0,
+                'max': len(samples) - 1
+            })
+
+        # 使用通用的并行处理函数，结果按原始顺序排列，失败的图层被跳过
+        layer_ids, ordered_results, failed = map_layers(layer_ids, process_layer, rf_params=rf_params, samples=samples)
         
-        # 直接使用 ordered_results，不需要转换为 ee.List
         if not ordered_results:
             raise ValueError("No successful classification results")
 
         return return_new_layer(
             layer_ids=layer_ids,
-            results=ordered_results,  # 直接使用 ordered_results
+            results=ordered_results,
             original_names=datasetsNames,
             message='Random forest classification completed',
-            result_type='rf'
+            result_type='rf',
+            failed=failed
         )
 
     except Exception as e:
@@ -504,94 +512,67 @@ def raster_calculator():
             selected_bands = eval(expression)
             print('Tool_routes.py - raster_calculator-selected_bands:', selected_bands)
             
-            results_dict = {}
             def process_layer(layer_id, selected_bands=None):
-                try:
-                    if layer_id not in datasets:
-                        return None
-                    i = layer_ids.index(layer_id)
-                    image = ee.Image(datasets[layer_id])
-                    result = RasterOperatorTool.raster_calculator_all_bands(
-                        image, 
-                        expression,
-                        selected_bands
-                    )
-                    # 设置计算结果的可视化参数
-                    vis_params = get_vis_params(result)
-                    result = result.set('vis_params', vis_params)
-                    results_dict[i] = result
-                    return result
-                except Exception as e:
-                    print(f"Error processing layer {layer_id}: {str(e)}")
+                if layer_id not in datasets:
                     return None
+                image = ee.Image(datasets[layer_id])
+                result = RasterOperatorTool.raster_calculator_all_bands(
+                    image, 
+                    expression,
+                    selected_bands
+                )
+                # 设置计算结果的可视化参数
+                vis_params = get_vis_params(result)
+                return result.set('vis_params', vis_params)
 
-            ParallelProcessor.process_layers(
-                layer_ids=layer_ids,
-                process_func=process_layer,
-                max_workers=maxthread_num,
-                selected_bands=selected_bands
-            )
-
-            # 按原始顺序重建结果列表
-            results = [results_dict[i] for i in range(len(layer_ids))]
-            
+            # 结果按原始顺序排列，失败的图层被跳过
+            layer_ids, results, failed = map_layers(layer_ids, process_layer, selected_bands=selected_bands)
 
             return return_new_layer(
                 layer_ids=layer_ids,
                 results=results,
                 original_names=datasetsNames,
                 message='All bands calculation completed',
-                result_type='calc_all'
+                result_type='calc_all',
+                failed=failed
             )
 
         else:
-            # 创建一个有序字典来存储结果
-            results_dict = {}
             # 单波段模式
             def process_layer(layer_id, expression=None):
-                try:
-                    if layer_id not in datasets:
-                        return None
-                    i = layer_ids.index(layer_id)
-                    image = ee.Image(datasets[layer_id])
-                    result = RasterOperatorTool.raster_calculator_single(image, expression)
-                    if resultMode == 'append':
-                        newBandName = data.get('newBandName', '')
-                        result = image.addBands(result.rename(newBandName))
-                    # 设置计算结果的可视化参数
-                    vis_params = get_vis_params(result)
-                    result = result.set('vis_params', vis_params)
-                    results_dict[i] = result
-                    return result
-                except Exception as e:
-                    print(f"Error processing layer {layer_id}: {str(e)}")
-                    return None                  
-            
-            ParallelProcessor.process_layers(
-                layer_ids=layer_ids,
-                process_func=process_layer,
-                max_workers=maxthread_num,
-                expression=expression
-            )
-
-            # 按原始顺序重建结果列表
-            results = [results_dict[i] for i in range(len(layer_ids))]
-            
+                if layer_id not in datasets:
+                    return None
+                image = ee.Image(datasets[layer_id])
+                band_names = get_band_names(layer_id)
+                result = RasterOperatorTool.raster_calculator_single(image, expression, band_names)
+                result_bands = None
+                if resultMode == 'append':
+                    newBandName = data.get('newBandName', '')
+                    result = image.addBands(result.rename(newBandName))
+                    if band_names and newBandName not in band_names:
+                        result_bands = band_names + [newBandName]
+                # 设置计算结果的可视化参数
+                vis_params = get_vis_params(result, result_bands)
+                return result.set('vis_params', vis_params)
             
+            # 结果按原始顺序排列，失败的图层被跳过
+            layer_ids, results, failed = map_layers(layer_ids, process_layer, expression=expression)
 
             if resultMode == 'append':
                 # 转换结果为 ee.List
                 results = ee.List(results)
                 vis_params = data.get('vis_params', [])
                 print('Tool_routes.py - raster_calculator-vis_params:', vis_params)
-                return return_origin_layer(layer_ids, results, vis_params, 'Single band calculation completed')
+                return return_origin_layer(layer_ids, results, vis_params, 'Single band calculation completed',
+                                           failed=failed)
 
             return return_new_layer(
                 layer_ids=layer_ids,
                 results=results,
                 original_names=datasetsNames,
                 message='Single band calculation completed',
-                result_type='calc'
+                result_type='calc',
+                failed=failed
             )
 
     except Exception as e:
@@ -638,6 +619,7 @@ def rename_bands():
         }), 500
 
 @tool_bp.route('/svm', methods=['POST'])
+@job_route('svm')
 def svm_classification():
     try:
         data = request.json
@@ -648,46 +630,28 @@ def svm_classification():
         if not samples:
             raise ValueError('No training samples available')
             
-        selected_images = PreprocessingTool.get_image_collection(layer_ids, datasets)
-        images_list = selected_images.toList(len(layer_ids))
-        
-        # 创建一个有序字典来存储结果
-        results_dict = {}
-        def process_layer(layer_id, images_list=None, svm_params=None, samples=None):
-            try:
-                i = layer_ids.index(layer_id)
-                layer_params = svm_params.get(layer_id, {})
-                kernel = layer_params.get('kernel', 'RBF')
-                train_ratio = layer_params.get('trainRatio', 0.7)
-                
-                image = ee.Image(images_list.get(i))
-                result = ClassificationTool.svm_classification(
-                    image, samples,
-                    kernel=kernel,
-                    train_ratio=train_ratio
-                )
-                # 设置分类结果的可视化参数
-                result = result.set('vis_params', {
-                    'bands': ['classification'],
-                    'min': 0,
-                    'max': len(samples) - 1
-                })
-                results_dict[i] = result
-                return result
-            except Exception as e:
-                print(f"Error processing layer {layer_id}: {str(e)}")
-                return None
+        PreprocessingTool.validate_inputs(layer_ids, datasets)
 
-        ParallelProcessor.process_layers(
-            layer_ids=layer_ids,
-            process_func=process_layer,
-            max_workers=maxthread_num,
-            images_list=images_list,
-            svm_params=svm_params,
-            samples=samples
-        )
-         # 按原始顺序重建结果列表
-        results = [results_dict[i] for i in range(len(layer_ids))]
+        def process_layer(layer_id, svm_params=None, samples=None):
+            layer_params = svm_params.get(layer_id, {})
+            kernel = layer_params.get('kernel', 'RBF')
+            train_ratio = layer_params.get('trainRatio', 0.7)
+            
+            image = ee.Image(datasets[layer_id])
+            result = ClassificationTool.svm_classification(
+                image, samples,
+                kernel=kernel,
+                train_ratio=train_ratio
+            )
+            # 设置分类结果的可视化参数
+            return result.set('vis_params', {
+                'bands': ['classification'],
+                'min': 0,
+                'max': len(samples) - 1
+            })
+
+        # 使用通用的并行处理函数，结果按原始顺序排列，失败的图层被跳过
+        layer_ids, results, failed = map_layers(layer_ids, process_layer, svm_params=svm_params, samples=samples)
 
         if not results:
             raise ValueError("No successful classification results")
@@ -697,7 +661,8 @@ def svm_classification():
             results=results,
             original_names=datasetsNames,
             message='SVM classification completed',
-            result_type='svm'
+            result_type='svm',
+            failed=failed
         )
         
     except Exception as e:
@@ -746,42 +711,25 @@ def clip():
         geometry = data.get('geometry',{})
         print('Tool_routes.py - clip-data:', data)
         
-         # 创建一个有序字典来存储结果
-        results_dict = {}
         def process_layer(layer_id, geometry=None):
-            try:
-                if layer_id not in datasets:
-                    return None
-                i = layer_ids.index(layer_id)
-                image = ee.Image(datasets[layer_id])
-                type = geometry.get('type')
-                if type == 'Raster':
-                    mask = ee.Image(datasets[geometry.get('id')])
-                    result = image.updateMask(mask)
-                elif type == 'vector':
-                    mask = ee.FeatureCollection(datasets[geometry.get('id')])
-                    result = image.clip(mask.geometry())
-                else:
-                    result = RasterOperatorTool.img_clip(image, geometry)
-                # 设置裁剪结果的可视化参数
-                vis_params = get_vis_params(result)
-                result = result.set('vis_params', vis_params)
-                results_dict[i] = result
-                return result
-            except Exception as e:
-                print(f"Error processing layer {layer_id}: {str(e)}")
+            if layer_id not in datasets:
                 return None
-
-        # 使用通用的并行处理函数
-        ParallelProcessor.process_layers(
-            layer_ids=layer_ids,
-            process_func=process_layer,
-            max_workers=maxthread_num,
-            geometry=geometry
-        )
-
-         # 按原始顺序重建结果列表
-        results = [results_dict[i] for i in range(len(layer_ids))]
+            image = ee.Image(datasets[layer_id])
+            type = geometry.get('type')
+            if type == 'Raster':
+                mask = ee.Image(datasets[geometry.get('id')])
+                result = image.updateMask(mask)
+            elif type == 'vector':
+                mask = ee.FeatureCollection(datasets[geometry.get('id')])
+                result = image.clip(mask.geometry())
+            else:
+                result = RasterOperatorTool.img_clip(image, geometry)
+            # 设置裁剪结果的可视化参数（裁剪不改变波段）
+            vis_params = get_vis_params(result, get_band_names(layer_id))
+            return result.set('vis_params', vis_params)
+
+        # 使用通用的并行处理函数，结果按原始顺序排列，失败的图层被跳过
+        layer_ids, results, failed = map_layers(layer_ids, process_layer, geometry=geometry)
         
         if not results:
             raise ValueError("No successful clip results")
@@ -791,7 +739,8 @@ def clip():
             results=results,
             original_names=datasetsNames,
             message='Image clipping completed',
-            result_type='clip'
+            result_type='clip',
+            failed=failed
         )
 
     except Exception as e:
@@ -808,37 +757,18 @@ def terrain():
         layer_ids = data.get('layer_ids')
 
         PreprocessingTool.validate_inputs(layer_ids, datasets)
-        selected_images = PreprocessingTool.get_image_collection(layer_ids, datasets)
 
-         # 创建一个有序字典来存储结果
-        results_dict = {}
         def process_layer(layer_id):
-            try:
-                if layer_id not in datasets:
-                    return None
-                i = layer_ids.index(layer_id)
-                image = ee.Image(datasets[layer_id])
-                    
-                # 执行地形分析
-                result = TerrainOperationTool.terrain(image)
+            image = ee.Image(datasets[layer_id])
                 
-                # 保持原始图像的边界范围
-                result = result.clip(image.geometry())
-                results_dict[i] = result
-                return result   
-            except Exception as e:
-                print(f"Error processing layer {layer_id}: {str(e)}")
-                return None
-
-        ParallelProcessor.process_layers(
-            layer_ids=layer_ids,
-            process_func=process_layer,
-            max_workers=maxthread_num
-        )
+            # 执行地形分析
+            result = TerrainOperationTool.terrain(image)
+            
+            # 保持原始图像的边界范围
+            return result.clip(image.geometry())
 
-         # 按原始顺序重建结果列表
-        results = [results_dict[i] for i in range(len(layer_ids))]
-        
+        # 结果按原始顺序排列，失败的图层被跳过
+        layer_ids, results, failed = map_layers(layer_ids, process_layer)
 
         if not results:
             raise ValueError("No successful terrain analysis results")
@@ -848,7 +778,8 @@ def terrain():
             results=results,
             original_names=datasetsNames,
             message='Terrain analysis completed',
-            result_type='terrain'
+            result_type='terrain',
+            failed=failed
         )
 
     except Exception as e:
@@ -859,6 +790,7 @@ def terrain():
         }), 500
 
 @tool_bp.route('/statistics', methods=['POST'])
+@job_route('statistics')
 def statistics():
     try:
         data = request.json
@@ -868,90 +800,85 @@ def statistics():
         print('Tool_routes.py - statistics-data:', data)
 
         def process_layer(layer_id, params=None):
-            try:
-                if layer_id not in datasets:
-                    return None
-                    
-                image = ee.Image(datasets[layer_id])
-
-                # 获取当前图层的参数
-                layer_params = params.get('params', {}).get(layer_id, {})
-                resolution = params.get('resolution', 30)
-                band = layer_params.get('band')
-                value = layer_params.get('value')
-                
-                if not band or value is None:
-                    return None
-                
-                band_image = image.select([band])
-                
-                # 创建掩膜
-                mask = band_image.eq(value)
-                
-                # 计算面积（平方公里）
-                area = mask.multiply(ee.Image.pixelArea()).divide(1e6).reduceRegion(
-                    reducer=ee.Reducer.sum(),
-                    geometry=image.geometry(),
-                    scale=resolution,
-                    maxPixels=1e13
-                ).getInfo()
-
-                count = mask.reduceRegion(
-                    reducer=ee.Reducer.count(),
-                    geometry=image.geometry(),
-                    scale=resolution,
-                    maxPixels=1e13
-                ).getInfo()
+            if layer_id not in datasets:
+                return None
                 
-                # 计算其他统计指标
-                stats = band_image.reduceRegion(
-                    reducer=ee.Reducer.mean()
-                        .combine(ee.Reducer.median(), '', True)
-                        .combine(ee.Reducer.minMax(), '', True)
-                        .combine(ee.Reducer.stdDev(), '', True)  # 标准差
-                        .combine(ee.Reducer.variance(), '', True)  # 方差
-                        .combine(ee.Reducer.sum(), '', True)  # 总和
-                        .combine(ee.Reducer.mode(), '', True)  # 众数
-                        .combine(ee.Reducer.percentile([25, 75]), '', True),  # 四分位数
-                    geometry=image.geometry(),
-                    scale=resolution,
-                    maxPixels=1e13
-                ).getInfo()
-
-                print('Tool_routes.py - statistics-area:', area)
-                print('Tool_routes.py - statistics-stats:', stats)
-                print('Tool_routes.py - statistics-count:', count)
+            image = ee.Image(datasets[layer_id])
 
-                result = {
-                    'layerId': layer_id,
-                    'totalArea': area.get(band),
-                    'band': band,
-                    'value': value,
-                    'mean': stats.get(f'{band}_mean'),
-                    'median': stats.get(f'{band}_median'),
-                    'min': stats.get(f'{band}_min'),
-                    'max': stats.get(f'{band}_max'),
-                    'stdDev': stats.get(f'{band}_stdDev'),
-                    'variance': stats.get(f'{band}_variance'),
-                    'sum': stats.get(f'{band}_sum'),
-                    'mode': stats.get(f'{band}_mode'),
-                    'q1': stats.get(f'{band}_p25'),  # 第一四分位数
-                    'q3': stats.get(f'{band}_p75'),  # 第三四分位数
-                    'count': count.get(band)
-                }
-                
-                return result
-                
-            except Exception as e:
-                print(f"Error processing layer {layer_id}: {str(e)}")
+            # 获取当前图层的参数
+            layer_params = params.get('params', {}).get(layer_id, {})
+            resolution = params.get('resolution', 30)
+            band = layer_params.get('band')
+            value = layer_params.get('value')
+            
+            if not band or value is None:
                 return None
+            
+            band_image = image.select([band])
+            
+            # 创建掩膜
+            mask = band_image.eq(value)
+            
+            # 计算面积（平方公里）
+            area = mask.multiply(ee.Image.pixelArea()).divide(1e6).reduceRegion(
+                reducer=ee.Reducer.sum(),
+                geometry=image.geometry(),
+                scale=resolution,
+                maxPixels=1e13
+            )
 
-        results = ParallelProcessor.process_layers(
-            layer_ids=layer_ids,
-            process_func=process_layer,
-            max_workers=maxthread_num,
-            params=params
-        )
+            count = mask.reduceRegion(
+                reducer=ee.Reducer.count(),
+                geometry=image.geometry(),
+                scale=resolution,
+                maxPixels=1e13
+            )
+            
+            # 计算其他统计指标
+            stats = band_image.reduceRegion(
+                reducer=ee.Reducer.mean()
+                    .combine(ee.Reducer.median(), '', True)
+                    .combine(ee.Reducer.minMax(), '', True)
+                    .combine(ee.Reducer.stdDev(), '', True)  # 标准差
+                    .combine(ee.Reducer.variance(), '', True)  # 方差
+                    .combine(ee.Reducer.sum(), '', True)  # 总和
+                    .combine(ee.Reducer.mode(), '', True)  # 众数
+                    .combine(ee.Reducer.percentile([25, 75]), '', True),  # 四分位数
+                geometry=image.geometry(),
+                scale=resolution,
+                maxPixels=1e13
+            )
+
+            # 三项统计一次求值，结果缓存到磁盘
+            values = evaluate_reductions({'area': area, 'count': count, 'stats': stats}, layer_id)
+            area, count, stats = values['area'], values['count'], values['stats']
+
+            print('Tool_routes.py - statistics-area:', area)
+            print('Tool_routes.py - statistics-stats:', stats)
+            print('Tool_routes.py - statistics-count:', count)
+
+            result = {
+                'layerId': layer_id,
+                'totalArea': area.get(band),
+                'band': band,
+                'value': value,
+                'mean': stats.get(f'{band}_mean'),
+                'median': stats.get(f'{band}_median'),
+                'min': stats.get(f'{band}_min'),
+                'max': stats.get(f'{band}_max'),
+                'stdDev': stats.get(f'{band}_stdDev'),
+                'variance': stats.get(f'{band}_variance'),
+                'sum': stats.get(f'{band}_sum'),
+                'mode': stats.get(f'{band}_mode'),
+                'q1': stats.get(f'{band}_p25'),  # 第一四分位数
+                'q3': stats.get(f'{band}_p75'),  # 第三四分位数
+                'count': count.get(band)
+            }
+            
+            return result
+
+        # 结果按原始顺序排列，失败的图层被跳过并在 failed 中返回
+        _, results, failed = map_layers(layer_ids, process_layer, params=params)
 
         if not results:
             raise ValueError("No successful statistics results")
@@ -959,6 +886,7 @@ def statistics():
         return jsonify({
             'success': True,
             'results': results,
+            'failed': failed,
             'message': 'Statistics completed'
         })
 
@@ -978,71 +906,58 @@ def otsu():
         vis_params = data.get('vis_params', [])
         print('Tool_routes.py - otsu-data:', data)
 
-        # 创建一个有序字典来存储结果
-        results_dict = {}
         def process_layer(layer_id):
-            try:
-                if layer_id not in datasets:
-                    return None
-                    
-                i = layer_ids.index(layer_id)
-                layer_params = params.get(layer_id, {})
-                band = layer_params.get('band')
-                scale = layer_params.get('scale')
-                maxArray = layer_params.get('maxArray')
-                minDis = layer_params.get('minDis')
-                
-                if not all([band, scale, maxArray, minDis]):
-                    raise ValueError(f"Missing required parameters for layer {layer_id}")
-                
-                image = ee.Image(datasets[layer_id]).select(band)
-                
-                # 计算阈值
-                threshold = RasterOperatorTool.Otsu(
-                    image=image,
-                    scale=scale,
-                    maxArray=maxArray,
-                    minDis=minDis
-                )
-                
-                # 修改这里：使用 where 操作来保留原始值
-                result = image.where(image.gt(threshold), image).where(image.lte(threshold), 0)
-                
-                # 设置可视化参数
-                vis_params = {
-                    'min': 0,
-                    'max': 1,
-                    'palette': ['black', 'white']
-                }
-                result = result.set('vis_params', vis_params)
-                
-                results_dict[i] = result
-                return result
-                
-            except Exception as e:
-                print(f"Error processing layer {layer_id}: {str(e)}")
+            if layer_id not in datasets:
                 return None
+                
+            layer_params = params.get(layer_id, {})
+            band = layer_params.get('band')
+            scale = layer_params.get('scale')
+            maxArray = layer_params.get('maxArray')
+            minDis = layer_params.get('minDis')
+            
+            if not all([band, scale, maxArray, minDis]):
+                raise ValueError(f"Missing required parameters for layer {layer_id}")
+            
+            image = ee.Image(datasets[layer_id]).select(band)
+            
+            # 计算阈值
+            threshold = RasterOperatorTool.Otsu(
+                image=image,
+                scale=scale,
+                maxArray=maxArray,
+                minDis=minDis
+            )
+            # 阈值求值为常数（结果缓存到磁盘），瓦片渲染时不再重复计算直方图
+            threshold = evaluate_reductions({'threshold': threshold}, layer_id)['threshold']
+            
+            # 修改这里：使用 where 操作来保留原始值
+            result = image.where(image.gt(threshold), image).where(image.lte(threshold), 0)
+            
+            # 设置可视化参数
+            vis_params = {
+                'min': 0,
+                'max': 1,
+                'palette': ['black', 'white']
+            }
+            result = result.set('vis_params', vis_params)
+            
+            return result
 
-        # 使用通用的并行处理函数
-        ParallelProcessor.process_layers(
-            layer_ids=layer_ids,
-            process_func=process_layer,
-            max_workers=maxthread_num
-        )
+        # 使用通用的并行处理函数，结果按原始顺序排列，失败的图层被跳过
+        layer_ids, results, failed = map_layers(layer_ids, process_layer)
 
         # 检查是否有成功的结果
-        if not results_dict:
+        if not results:
             raise ValueError("No successful OTSU results")
 
-        # 按原始顺序重建结果列表
-        results = [results_dict[i] for i in range(len(layer_ids))]
-
         return return_new_layer(
             layer_ids=layer_ids,
             results=results,
             original_names=datasetsNames,
             message='OTSU segmentation completed',
-            result_type='otsu'
+            result_type='otsu',
+            failed=failed
         )
 
     except Exception as e:
@@ -1061,84 +976,67 @@ def randomPoints():
         vis_params = data.get('vis_params', [])
         print('Tool_routes.py - randomPoints-data:', data)
 
-        # 创建一个有序字典来存储结果
-        results_dict = {}
-        
         def process_layer(layer_id):
-            try:
-                if layer_id not in datasets:
-                    return None
-                    
-                i = layer_ids.index(layer_id)
-                image = ee.Image(datasets[layer_id])
-                # 从参数中获取值，如果没有则使用默认值
-                numPixels = params.get('numPixels', 2000)
-                scale = params.get('scale', 30)
-                seed = params.get('seed', 0)
-                
-                # 对图像进行采样
-                print('test',image.geometry().getInfo())
-                points = image.selfMask().sample(
-                    region=image.geometry(),
-                    scale=scale,
-                    numPixels=numPixels,
-                    seed=seed,
-                    geometries=True
-                )
-                print('test',points.size().getInfo())
-                # 设置点的样式
-                ee_style_params = {
-                    'color': '4a80f5',
-                    'pointSize': 3,
-                    'pointShape': 'circle'
-                }
-                
-                # 获取瓦片 URL
-                map_id = points.getMapId(ee_style_params)
-
-                id = f'random_points_{layer_id}_{int(time.time())}'
-                name = f'{datasetsNames.get(layer_id, "Layer")} (random points)'
-                
-                save_dataset(id, points, name)
-                
-                # 构建结果对象
-                result = {
-                    'layer_id': id,
-                    'name': name,
-                    'type': 'vector',
-                    'tileUrl': map_id['tile_fetcher'].url_format,
-                    'visParams': {
-                        'color': '#4a80f5',
-                        'weight': 2,
-                        'opacity': 1
-                    }
-                }
-                
-                results_dict[i] = result
-                return result
-                
-            except Exception as e:
-                print(f"Error processing layer {layer_id}: {str(e)}")
+            if layer_id not in datasets:
                 return None
+                
+            image = ee.Image(datasets[layer_id])
+            # 从参数中获取值，如果没有则使用默认值
+            numPixels = params.get('numPixels', 2000)
+            scale = params.get('scale', 30)
+            seed = params.get('seed', 0)
+            
+            # 对图像进行采样
+            points = image.selfMask().sample(
+                region=image.geometry(),
+                scale=scale,
+                numPixels=numPixels,
+                seed=seed,
+                geometries=True
+            )
+            # 设置点的样式
+            ee_style_params = {
+                'color': '4a80f5',
+                'pointSize': 3,
+                'pointShape': 'circle'
+            }
+            
+            # 获取瓦片 URL
+            map_id = cached_get_map_id(points, ee_style_params)
+            return points, map_id['tile_fetcher'].url_format
 
-        # 使用通用的并行处理函数
-        ParallelProcessor.process_layers(
-            layer_ids=layer_ids,
-            process_func=process_layer,
-            max_workers=maxthread_num
-        )
+        # 使用通用的并行处理函数，结果按原始顺序排列，失败的图层被跳过
+        layer_ids, outputs, failed = map_layers(layer_ids, process_layer)
 
         # 检查是否有成功的结果
-        if not results_dict:
+        if not outputs:
             raise ValueError("No successful random points generation results")
 
-        # 按原始顺序重建结果列表
-        results = [results_dict[i] for i in range(len(layer_ids))]
+        # 在请求线程中保存图层：超时或取消的图层仍可能在后台执行完，不会保存客户端收不到的图层
+        results = []
+        for layer_id, (points, tile_url) in zip(layer_ids, outputs):
+            id = new_layer_id(f'random_points_{layer_id}')
+            name = f'{datasetsNames.get(layer_id, "Layer")} (random points)'
+            save_dataset(id, points, name)
+
+            # 构建结果对象
+            results.append({
+                'layer_id': id,
+                'name': name,
+                'type': 'vector',
+                'tileUrl': tile_url,
+                'visParams': {
+                    'color': '#4a80f5',
+                    'weight': 2,
+                    'opacity': 1
+                }
+            })
 
         return jsonify({
             'success': True,
             'message': 'Random points generation completed',
-            'results': results
+            'results': results,
+            'failed': failed
         })
 
     except Exception as e:
@@ -1230,62 +1128,47 @@ def canny_edge_detection():
         vis_params = data.get('vis_params', [])
         print('Tool_routes.py - canny-data:', data)
 
-        # 创建一个有序字典来存储结果
-        results_dict = {}
         def process_layer(layer_id):
-            try:
-                if layer_id not in datasets:
-                    return None
-                    
-                i = layer_ids.index(layer_id)
-                layer_params = params.get(layer_id, {})
-                threshold = layer_params.get('threshold', 0.5)
-                sigma = layer_params.get('sigma', 1.0)
-                
-                image = ee.Image(datasets[layer_id])
-                
-                # 应用 Canny 边缘检测
-                result = ee.Algorithms.CannyEdgeDetector(
-                    image=image,
-                    threshold=threshold,
-                    sigma=sigma
-                ).toUint8()
-                
-                # 设置可视化参数
-                vis_params = {
-                    'min': 0,
-                    'max': 1,
-                    'palette': ['black', 'white']
-                }
-                result = result.set('vis_params', vis_params)
-                
-                results_dict[i] = result
-                return result
-                
-            except Exception as e:
-                print(f"Error processing layer {layer_id}: {str(e)}")
+            if layer_id not in datasets:
                 return None
+                
+            layer_params = params.get(layer_id, {})
+            threshold = layer_params.get('threshold', 0.5)
+            sigma = layer_params.get('sigma', 1.0)
+            
+            image = ee.Image(datasets[layer_id])
+            
+            # 应用 Canny 边缘检测
+            result = ee.Algorithms.CannyEdgeDetector(
+                image=image,
+                threshold=threshold,
+                sigma=sigma
+            ).toUint8()
+            
+            # 设置可视化参数
+            vis_params = {
+                'min': 0,
+                'max': 1,
+                'palette': ['black', 'white']
+            }
+            result = result.set('vis_params', vis_params)
+            
+            return result
 
-        # 使用通用的并行处理函数
-        ParallelProcessor.process_layers(
-            layer_ids=layer_ids,
-            process_func=process_layer,
-            max_workers=maxthread_num
-        )
+        # 使用通用的并行处理函数，结果按原始顺序排列，失败的图层被跳过
+        layer_ids, results, failed = map_layers(layer_ids, process_layer)
 
         # 检查是否有成功的结果
-        if not results_dict:
+        if not results:
             raise ValueError("No successful Canny edge detection results")
 
-        # 按原始顺序重建结果列表
-        results = [results_dict[i] for i in range(len(layer_ids))]
-
         return return_new_layer(
             layer_ids=layer_ids,
             results=results,
             original_names=datasetsNames,
             message='Canny edge detection completed',
-            result_type='canny'
+            result_type='canny',
+            failed=failed
         )
 
     except Exception as e:
@@ -1297,6 +1180,7 @@ def canny_edge_detection():
 
 
 @tool_bp.route('/tif2vector', methods=['POST'])
+@job_route('tif2vector')
 def tif2vector():
     try:
         data = request.get_json()
@@ -1304,89 +1188,75 @@ def tif2vector():
         params = data.get('params', {})
         print('Tool_routes.py - tif2vector-data:', data)
 
-        # 创建一个有序字典来存储结果
-        results_dict = {}
-
         def process_layer(layer_id):
-            try:
-                if layer_id not in datasets:
-                    return None
-
-                i = layer_ids.index(layer_id)
-                image = ee.Image(datasets[layer_id])
-                img_params = params.get(layer_id, {})
-                
-                # 获取参数，如果没有则使用默认值
-                scale = img_params.get('scale', 10)  # 默认30米分辨率
-                geometry_type = img_params.get('geometryType', 'polygon')  # 默认多边形
-                max_pixels = img_params.get('maxPixels', 1e8)  # 默认1亿像素
-                print('Tool_routes.py - tif2vector-max_pixels:', max_pixels)
-
-                # 使用reduceToVectors将栅格转换为矢量
-                vectors = image.toInt().selfMask().reduceToVectors(
-                    geometryType=geometry_type,
-                    geometry=image.geometry(),
-                    reducer=ee.Reducer.countEvery(),  # 计数像素数量
-                    scale=scale,
-                    maxPixels=max_pixels,
-                    eightConnected=params.get('eightConnected', True)  # 默认使用8连通
-                )
-                print('Tool_routes.py - tif2vector-vectors:', vectors.size().getInfo())
-                 # 设置矢量样式
-                ee_style_params = {
-                    'color': '4a80f5',  # 蓝色
-                    'fillColor': '4a80f580',  # 半透明蓝色
-                    'width': 2  # 边框宽度
-                }
-                # 生成唯一的图层ID
-                id = f'vector_{layer_id}_{int(time.time())}'
-                
-                name = f'{datasetsNames.get(layer_id, "Layer")} (vectorized)'
-                # 获取矢量瓦片URL
-                map_id = vectors.getMapId(ee_style_params)
-               
-
-                # 保存数据集以供后续使用
-                save_dataset(id, vectors, name)
-                # 构建结果对象
-                result = {
-                    'layer_id': id,
-                    'type': 'vector',
-                    'name': name,
-                    'tileUrl': map_id['tile_fetcher'].url_format,
-                    'visParams': {
-                        'color': '#4a80f5',
-                        'weight': 2,
-                        'opacity': 1
-                    }
-                }
-                print('Tool_routes.py - tif2vector-result:', result)
-                results_dict[i] = result
-                return result
-
-            except Exception as e:
-                print(f"Error processing layer {layer_id}: {str(e)}")
+            if layer_id not in datasets:
                 return None
 
+            image = ee.Image(datasets[layer_id])
+            img_params = params.get(layer_id, {})
+            
+            # 获取参数，如果没有则使用默认值
+            scale = img_params.get('scale', 10)  # 默认30米分辨率
+            geometry_type = img_params.get('geometryType', 'polygon')  # 默认多边形
+            max_pixels = img_params.get('maxPixels', 1e8)  # 默认1亿像素
+            print('Tool_routes.py - tif2vector-max_pixels:', max_pixels)
+
+            # 使用reduceToVectors将栅格转换为矢量
+            vectors = image.toInt().selfMask().reduceToVectors(
+                geometryType=geometry_type,
+                geometry=image.geometry(),
+                reducer=ee.Reducer.countEvery(),  # 计数像素数量
+                scale=scale,
+                maxPixels=max_pixels,
+                eightConnected=params.get('eightConnected', True)  # 默认使用8连通
+            )
+             # 设置矢量样式
+            ee_style_params = {
+                'color': '4a80f5',  # 蓝色
+                'fillColor': '4a80f580',  # 半透明蓝色
+                'width': 2  # 边框宽度
+            }
+            # 获取矢量瓦片URL
+            map_id = cached_get_map_id(vectors, ee_style_params)
+            return vectors, map_id['tile_fetcher'].url_format
 
-        # 使用通用的并行处理函数
-        ParallelProcessor.process_layers(
-            layer_ids=layer_ids,
-            process_func=process_layer,
-            max_workers=maxthread_num
-        )
+        # 使用通用的并行处理函数，结果按原始顺序排列，失败的图层被跳过
+        layer_ids, outputs, failed = map_layers(layer_ids, process_layer)
 
         # 检查是否有成功的结果
-        if not results_dict:
+        if not outputs:
             raise ValueError("No successful tif2vector results")
-        # 按原始顺序重建结果列表
-        results = [results_dict[i] for i in range(len(layer_ids))]
+
+        # 在请求线程中保存图层：超时或取消的图层仍可能在后台执行完，不会保存客户端收不到的图层
+        results = []
+        for layer_id, (vectors, tile_url) in zip(layer_ids, outputs):
+            # 生成唯一的图层ID
+            id = new_layer_id(f'vector_{layer_id}')
+            name = f'{datasetsNames.get(layer_id, "Layer")} (vectorized)'
+
+            # 保存数据集以供后续使用
+            save_dataset(id, vectors, name)
+            # 构建结果对象
+            result = {
+                'layer_id': id,
+                'type': 'vector',
+                'name': name,
+                'tileUrl': tile_url,
+                'visParams': {
+                    'color': '#4a80f5',
+                    'weight': 2,
+                    'opacity': 1
+                }
+            }
+            print('Tool_routes.py - tif2vector-result:', result)
+            results.append(result)
 
         # 返回结果
         return jsonify({
             'success': True,
             'results': results,
-            'names': datasetsNames,
+            'failed': failed,
+            'names': dict(datasetsNames.items()),
             'message': 'Vector conversion completed successfully'
         })
 
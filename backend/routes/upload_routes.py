@@ -1,14 +1,33 @@
 from flask import Blueprint, jsonify, request
-from services.map_service import save_dataset,get_dataset
+from services.map_service import save_dataset,get_dataset,new_layer_id,get_layer_metadata
+from services.layer_metadata import describe
 from routes.map_routes import get_study_areas
 import ee
-import time
 import datetime
 from tools.parallel_processor import ParallelProcessor
-from services.common import date_sequence
+from services.common import date_sequence, evaluate_batch
+from services.eval_cache import cached_get_map_id
+from services.job_service import job_route, cancel_checker, progress_reporter
 
 upload_bp = Blueprint('upload', __name__)
 
+
+def save_timeseries_layers(outcomes):
+    '''
+    在请求线程中保存时间序列各期影像，返回 (结果列表, 失败列表 [{date, error}])
+    处理函数返回 (影像, 图层ID前缀, 保存名称, 结果对象)；超时或取消的日期仍可能在后台执行完，
+    图层只在这里保存，客户端收不到的影像不会进入工作区
+    '''
+    _, outputs = ParallelProcessor.successful(outcomes)
+    entries = []
+    for image, id_prefix, save_name, entry in outputs:
+        entry['id'] = new_layer_id(id_prefix)
+        save_dataset(entry['id'], image, save_name)
+        entries.append(entry)
+    failed = [{'date': outcome.item, 'error': str(outcome.error) or type(outcome.error).__name__}
+              for outcome in outcomes if not outcome.ok]
+    return entries, failed
+
 @upload_bp.route('/get-assets', methods=['GET'])
 def get_assets():
     try:
@@ -117,15 +136,15 @@ def add_vector_asset():
         }
         
         # 使用传入的样式参数获取瓦片 URL
-        map_id = vector_asset.getMapId(ee_style_params)
+        map_id = cached_get_map_id(vector_asset, ee_style_params)
         
-        # 获取边界信息
-        bounds = vector_asset.geometry().bounds().getInfo()
+        # 获取边界信息（来自图层元数据）
+        bounds = get_layer_metadata(asset_id)['bounds']
         
         return jsonify({
             'success': True,
             'tileUrl': map_id['tile_fetcher'].url_format,
-            'bounds': bounds['coordinates'][0],
+            'bounds': bounds,
             'visParams': style_params  # 返回原始样式参数
         })
         
@@ -147,7 +166,9 @@ def add_image_asset():
         # 获取影像数据
         image_asset = ee.Image(asset_id)
         
-        bandNames = image_asset.bandNames().getInfo()
+        # 一次查询获取波段、范围、投影等元数据
+        meta = describe(image_asset)
+        bandNames = meta['bands']
         print('Tool_routes.py - add_image_asset-bandNames:',bandNames)
         # 获取可视化参数
         vis_params = {
@@ -158,12 +179,9 @@ def add_image_asset():
         }
         
         # 获取瓦片URL
-        map_id = image_asset.getMapId(vis_params)
-        id = f'{asset_id}_{int(time.time())}'
-        save_dataset(id, image_asset, layerName)
-
-        # 获取边界信息
-        bounds = image_asset.geometry().bounds().getInfo()
+        map_id = cached_get_map_id(image_asset, vis_params)
+        id = new_layer_id(asset_id)
+        save_dataset(id, image_asset, layerName, meta)
         
         return jsonify({
             'success': True,
@@ -172,7 +190,7 @@ def add_image_asset():
             'bandInfo': bandNames,
             'visParams': vis_params,
             'type':'Raster',
-            'bounds': bounds['coordinates'][0]
+            'bounds': meta['bounds']
         })
         
     except Exception as e:
@@ -183,6 +201,7 @@ def add_image_asset():
         }), 500
 
 @upload_bp.route('/add-landsat-timeseries', methods=['POST'])
+@job_route('landsat-timeseries')
 def add_landsat_timeseries():
     # Make a dummy image for missing years.
     bands = ['BLUE', 'GREEN', 'RED', 'NIR', 'SWIR1', 'SWIR2', 'QA_PIXEL']
@@ -381,8 +400,13 @@ def add_landsat_timeseries():
         # 创建影像集合
         collection = ee.ImageCollection.fromImages(composites)
         
-        # 获取集合大小
-        collection_size = collection.size().getInfo()
+        # 集合大小、研究区域范围和日期列表一次求值
+        values = evaluate_batch({
+            'size': collection.size(),
+            'bounds': roi,
+            'dates': years if frequency == "year" else months
+        })
+        collection_size = values['size']
         print('Tool_routes.py - add_landsat_timeseries-collection_size:',collection_size)
 
         if collection_size == 0:
@@ -397,7 +421,7 @@ def add_landsat_timeseries():
         }
 
         # 获取边界信息
-        bounds = roi.getInfo()
+        bounds = values['bounds']
         print('Tool_routes.py - add_landsat_timeseries-bounds:',bounds)
 
         def process_year(date_str, **kwargs):
@@ -412,27 +436,24 @@ def add_landsat_timeseries():
                     year = int(date_str)
                     images_collection = collection.filter(ee.Filter.eq('year', year))
                     name = f"Landsat {year}"
-                    collection_id = f"landsat_{year}_{int(time.time())}"
+                    id_prefix = f"landsat_{year}"
                     save_name = f"Landsat_{year}"
                 else:  # month
                     # 过滤特定日期的影像
                     images_collection = collection.filter(ee.Filter.eq('system:date', date_str))
                     name = f"Landsat {date_str}"
-                    collection_id = f"landsat_{date_str}_{int(time.time())}"
+                    id_prefix = f"landsat_{date_str}"
                     save_name = f"Landsat_{date_str}"
 
                 filtered_image = images_collection.median().clip(roi).set('date', date_str)
                 
                 # 获取地图ID
-                map_id = filtered_image.getMapId(vis_params)
-                
-                # 保存数据集
-                save_dataset(collection_id, filtered_image, save_name)
+                map_id = cached_get_map_id(filtered_image, vis_params)
                 
-                return {
+                # 图层由请求线程保存，这里只返回影像
+                return filtered_image, id_prefix, save_name, {
                     'date': date_str,
                     'tileUrl': map_id['tile_fetcher'].url_format,
-                    'id': collection_id,
                     'name': name,
                     'bandInfo': bands,
                     'visParams': vis_params,
@@ -440,25 +461,21 @@ def add_landsat_timeseries():
                 }
             except Exception as e:
                 print(f"Error processing date {date_str}: {str(e)}")
-                return None
+                raise
 
         # 使用并行处理器处理影像
-        if frequency == "year":
-            dates = years.getInfo()  # 年份列表
-        else:  # month
-            dates = months.getInfo()  # 月份日期列表
-
-        annual_images = ParallelProcessor.process_layers(
-            layer_ids=dates,
-            process_func=process_year,
-            max_workers=4,
+        dates = values['dates']  # 年份列表或月份日期列表
+
+        # 结果按日期顺序排列，失败的日期被跳过；客户端断开或后台任务被取消时取消剩余任务
+        outcomes = ParallelProcessor.map(
+            dates, process_year,
+            is_cancelled=cancel_checker(),
+            on_progress=progress_reporter(),
             collection=collection,
             roi=roi,
             vis_params=vis_params
         )
-
-        # 过滤掉 None 值
-        annual_images = [img for img in annual_images if img is not None]
+        annual_images, failed = save_timeseries_layers(outcomes)
 
         if not annual_images:
             raise ValueError("No images found")
@@ -469,6 +486,7 @@ def add_landsat_timeseries():
             'bounds': bounds['coordinates'][0],
             'collectionSize': len(annual_images),
             'images': annual_images,
+            'failed': failed,
             'type': 'Raster'
         })
 
@@ -480,6 +498,7 @@ def add_landsat_timeseries():
         }), 500
 
 @upload_bp.route('/add-sentinel-timeseries', methods=['POST'])
+@job_route('sentinel-timeseries')
 def add_sentinel_timeseries():
      # Make a dummy image for missing years.
     bands = ['BLUE', 'GREEN', 'RED', 'RED_EDGE1', 'NIR', 'SWIR1', 'SWIR2', 'QA60']
@@ -630,8 +649,13 @@ def add_sentinel_timeseries():
         # 创建影像集合
         collection = ee.ImageCollection.fromImages(composites)
         
-        # 获取集合大小
-        collection_size = collection.size().getInfo()
+        # 集合大小、研究区域范围和日期列表一次求值
+        values = evaluate_batch({
+            'size': collection.size(),
+            'bounds': roi,
+            'dates': years if frequency == "year" else months
+        })
+        collection_size = values['size']
         print('Tool_routes.py - add_landsat_timeseries-collection_size:',collection_size)
 
         if collection_size == 0:
@@ -646,7 +670,7 @@ def add_sentinel_timeseries():
         }
 
         # 获取边界信息
-        bounds = roi.getInfo()
+        bounds = values['bounds']
         print('Tool_routes.py - add_landsat_timeseries-bounds:',bounds)
 
         def process_year(date_str, **kwargs):
@@ -661,27 +685,24 @@ def add_sentinel_timeseries():
                     year = int(date_str)
                     images_collection = collection.filter(ee.Filter.eq('year', year))
                     name = f"Sentinel2 {year}"
-                    collection_id = f"sentinel2_{year}_{int(time.time())}"
+                    id_prefix = f"sentinel2_{year}"
                     save_name = f"Sentinel2_{year}"
                 else:  # month
                     # 过滤特定日期的影像
                     images_collection = collection.filter(ee.Filter.eq('system:date', date_str))
                     name = f"Sentinel2 {date_str}"
-                    collection_id = f"sentinel2_{date_str}_{int(time.time())}"
+                    id_prefix = f"sentinel2_{date_str}"
                     save_name = f"Sentinel2_{date_str}"
 
                 filtered_image = images_collection.median().clip(roi).set('date', date_str)
                 
                 # 获取地图ID
-                map_id = filtered_image.getMapId(vis_params)
-                
-                # 保存数据集
-                save_dataset(collection_id, filtered_image, save_name)
+                map_id = cached_get_map_id(filtered_image, vis_params)
                 
-                return {
+                # 图层由请求线程保存，这里只返回影像
+                return filtered_image, id_prefix, save_name, {
                     'date': date_str,
                     'tileUrl': map_id['tile_fetcher'].url_format,
-                    'id': collection_id,
                     'name': name,
                     'bandInfo': bands,
                     'visParams': vis_params,
@@ -689,25 +710,21 @@ def add_sentinel_timeseries():
                 }
             except Exception as e:
                 print(f"Error processing date {date_str}: {str(e)}")
-                return None
+                raise
 
         # 使用并行处理器处理影像
-        if frequency == "year":
-            dates = years.getInfo()  # 年份列表
-        else:  # month
-            dates = months.getInfo()  # 月份日期列表
-
-        annual_images = ParallelProcessor.process_layers(
-            layer_ids=dates,
-            process_func=process_year,
-            max_workers=4,
+        dates = values['dates']  # 年份列表或月份日期列表
+
+        # 结果按日期顺序排列，失败的日期被跳过；客户端断开或后台任务被取消时取消剩余任务
+        outcomes = ParallelProcessor.map(
+            dates, process_year,
+            is_cancelled=cancel_checker(),
+            on_progress=progress_reporter(),
             collection=collection,
             roi=roi,
             vis_params=vis_params
         )
-
-        # 过滤掉 None 值
-        annual_images = [img for img in annual_images if img is not None]
+        annual_images, failed = save_timeseries_layers(outcomes)
 
         if not annual_images:
             raise ValueError("No images found")
@@ -718,6 +735,7 @@ def add_sentinel_timeseries():
             'bounds': bounds['coordinates'][0],
             'collectionSize': len(annual_images),
             'images': annual_images,
+            'failed': failed,
             'type': 'Raster'
         })
 
@@ -729,6 +747,7 @@ def add_sentinel_timeseries():
         }), 500
 
 @upload_bp.route('/add-modis-timeseries', methods=['POST'])
+@job_route('modis-timeseries')
 def add_modis_timeseries():
     try:
         data = request.json
@@ -816,7 +835,13 @@ def add_modis_timeseries():
             composites = months.map(getMonthlyComp)
 
         collection = ee.ImageCollection.fromImages(composites)
-        collection_size = collection.size().getInfo()
+        # 集合大小、研究区域范围和日期列表一次求值
+        values = evaluate_batch({
+            'size': collection.size(),
+            'bounds': roi,
+            'dates': years if frequency == "year" else months
+        })
+        collection_size = values['size']
 
         if collection_size == 0:
             raise ValueError("No MODIS images found.")
@@ -828,7 +853,7 @@ def add_modis_timeseries():
             'gamma': 1.2
         }
 
-        bounds = roi.getInfo()
+        bounds = values['bounds']
 
         def process_layer(date_str, **kwargs):
             try:
@@ -840,23 +865,21 @@ def add_modis_timeseries():
                     year = int(date_str)
                     images = collection.filter(ee.Filter.eq('year', year))
                     name = f"MODIS {year}"
-                    collection_id = f"modis_{year}_{int(time.time())}"
+                    id_prefix = f"modis_{year}"
                     save_name = f"MODIS_{year}"
                 else:
                     images = collection.filter(ee.Filter.eq('system:date', date_str))
                     name = f"MODIS {date_str}"
-                    collection_id = f"modis_{date_str}_{int(time.time())}"
+                    id_prefix = f"modis_{date_str}"
                     save_name = f"MODIS_{date_str}"
 
                 image = images.median().clip(roi).set('date', date_str)
-                map_id = image.getMapId(vis_params)
+                map_id = cached_get_map_id(image, vis_params)
 
-                save_dataset(collection_id, image, save_name)
-
-                return {
+                # 图层由请求线程保存，这里只返回影像
+                return image, id_prefix, save_name, {
                     'date': date_str,
                     'tileUrl': map_id['tile_fetcher'].url_format,
-                    'id': collection_id,
                     'name': name,
                     'bandInfo': renamed_bands,
                     'visParams': vis_params,
@@ -864,20 +887,20 @@ def add_modis_timeseries():
                 }
             except Exception as e:
                 print(f"MODIS processing error: {str(e)}")
-                return None
+                raise
 
-        dates = years.getInfo() if frequency == "year" else months.getInfo()
+        dates = values['dates']
 
-        modis_images = ParallelProcessor.process_layers(
-            layer_ids=dates,
-            process_func=process_layer,
-            max_workers=4,
+        # 结果按日期顺序排列，失败的日期被跳过；客户端断开或后台任务被取消时取消剩余任务
+        outcomes = ParallelProcessor.map(
+            dates, process_layer,
+            is_cancelled=cancel_checker(),
+            on_progress=progress_reporter(),
             collection=collection,
             roi=roi,
             vis_params=vis_params
         )
-
-        modis_images = [img for img in modis_images if img is not None]
+        modis_images, failed = save_timeseries_layers(outcomes)
 
         if not modis_images:
             raise ValueError("All MODIS image processing failed.")
@@ -888,6 +911,7 @@ def add_modis_timeseries():
             'bounds': bounds['coordinates'][0],
             'collectionSize': len(modis_images),
             'images': modis_images,
+            'failed': failed,
             'type': 'Raster'
         })
 
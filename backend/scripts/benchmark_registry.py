@@ -0,0 +1,88 @@
+"""
+图层注册表基准：比较进程内注册表与 SQLite 注册表的保存和查找延迟
+SQLite 分别测量进程内缓存命中（只查版本号）和未命中（反序列化表达式）两种情况
+
+需要可用的 Earth Engine 凭证（PROJECT 环境变量），只构建表达式，不会向服务器发起计算
+
+用法:
+    python scripts/benchmark_registry.py --layers 100 --lookups 2000
+"""
+import os
+import sys
+import time
+import random
+import argparse
+import tempfile
+import statistics
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import ee
+from setting import init_earth_engine
+from services.layer_registry import LayerRegistry
+from services.layer_store import SqliteLayerRegistry
+
+
+def build_layer(index, steps):
+    '''
+    构建一个与实际图层复杂度相近的影像表达式
+    '''
+    image = (ee.ImageCollection('LANDSAT/LC08/C02/T1_TOA')
+             .filterDate('2023-01-01', '2023-12-31')
+             .filter(ee.Filter.lt('CLOUD_COVER', 20 + index % 10))
+             .median())
+    for step in range(steps):
+        image = image.addBands(image.normalizedDifference(['B5', 'B4']).rename(f'nd_{step}'), overwrite=True)
+    return image
+
+
+def measure(func, args_list):
+    '''
+    逐个调用并返回每次调用的耗时（毫秒）
+    '''
+    times = []
+    for args in args_list:
+        start = time.perf_counter()
+        func(*args)
+        times.append((time.perf_counter() - start) * 1000)
+    return times
+
+
+def report(label, times):
+    times = sorted(times)
+    p99 = times[min(len(times) - 1, int(len(times) * 0.99))]
+    print(f"{label:<30}{statistics.median(times):>10.3f}{statistics.mean(times):>10.3f}{p99:>10.3f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark layer registry backends')
+    parser.add_argument('--layers', type=int, default=100)
+    parser.add_argument('--lookups', type=int, default=2000)
+    parser.add_argument('--steps', type=int, default=5, help='每个图层表达式追加的运算步数')
+    args = parser.parse_args()
+
+    init_earth_engine()
+    layers = [(f'layer-{i}', build_layer(i, args.steps), f'Layer {i}') for i in range(args.layers)]
+    lookups = [(random.choice(layers)[0],) for _ in range(args.lookups)]
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'layers.db')
+        backends = [
+            ('memory', LayerRegistry()),
+            ('sqlite', SqliteLayerRegistry(path, 'bench', cache_size=args.layers)),
+        ]
+        # 缓存为 0 时每次查找都反序列化，相当于其他进程首次读取
+        cold = SqliteLayerRegistry(path, 'bench', cache_size=0)
+
+        print(f"{'operation (ms)':<30}{'p50':>10}{'avg':>10}{'p99':>10}")
+        for name, registry in backends:
+            report(f'{name} save', measure(registry.save, layers))
+        for name, registry in backends:
+            report(f'{name} get', measure(registry.get, lookups))
+        report('sqlite get (cache miss)', measure(cold.get, lookups))
+        for name, registry in backends:
+            report(f'{name} keys', measure(registry.keys, [()] * 200))
+
+
+if __name__ == '__main__':
+    main()
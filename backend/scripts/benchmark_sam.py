@@ -0,0 +1,116 @@
+"""
+SAM CPU 推理基准：在固定的合成图像上比较不同编码器尺寸 / 量化配置的延迟，
+并以基准配置的掩膜为参照给出 IoU，用于选择延迟与质量的折中
+
+用法:
+    python scripts/benchmark_sam.py --models vit_b,vit_l,vit_h --quantize both --runs 5 --threads 4
+"""
+import os
+import sys
+import time
+import argparse
+import statistics
+# 添加 backend 目录到 Python 路径
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import cv2
+import numpy as np
+import torch
+from services.inference import configure_torch_threads, load_sam
+
+MODEL_TYPES = ['vit_b', 'vit_l', 'vit_h']
+
+
+def synthetic_image(size=1024, seed=0):
+    '''
+    生成固定的合成图像：噪声背景上叠加若干矩形和圆形，保证每次运行输入一致
+    '''
+    rng = np.random.default_rng(seed)
+    image = rng.integers(60, 120, (size, size, 3), dtype=np.uint8)
+    for _ in range(12):
+        x, y = rng.integers(0, size - 160, 2)
+        w, h = rng.integers(40, 160, 2)
+        color = tuple(int(c) for c in rng.integers(0, 255, 3))
+        cv2.rectangle(image, (int(x), int(y)), (int(x + w), int(y + h)), color, -1)
+    for _ in range(6):
+        x, y = rng.integers(80, size - 80, 2)
+        color = tuple(int(c) for c in rng.integers(0, 255, 3))
+        cv2.circle(image, (int(x), int(y)), int(rng.integers(20, 80)), color, -1)
+    return image
+
+
+def benchmark(model_type, quantize, image, point_coords, point_labels, runs):
+    '''
+    测量单个配置的加载时间、图像编码延迟和掩码解码延迟
+    '''
+    start = time.perf_counter()
+    sam = load_sam(model_type, quantize)
+    load_time = time.perf_counter() - start
+
+    encode_times, decode_times = [], []
+    mask = None
+    with torch.inference_mode():
+        # 第一次运行作为预热，不计入统计
+        for i in range(runs + 1):
+            start = time.perf_counter()
+            sam.set_image(image)
+            encoded = time.perf_counter()
+            masks, scores, _ = sam.predictor.predict(point_coords=point_coords, point_labels=point_labels)
+            decoded = time.perf_counter()
+            if i > 0:
+                encode_times.append(encoded - start)
+                decode_times.append(decoded - encoded)
+            mask = masks[np.argmax(scores)]
+
+    return {
+        'load': load_time,
+        'encode_median': statistics.median(encode_times),
+        'encode_mean': statistics.mean(encode_times),
+        'decode_median': statistics.median(decode_times),
+        'mask': mask
+    }
+
+
+def iou(a, b):
+    union = np.logical_or(a, b).sum()
+    return float(np.logical_and(a, b).sum() / union) if union else 1.0
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark SAM CPU inference configurations')
+    parser.add_argument('--models', default='vit_b,vit_l,vit_h', help='逗号分隔的编码器类型')
+    parser.add_argument('--quantize', choices=['off', 'on', 'both'], default='both')
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--threads', type=int, default=0, help='torch 线程数，0 表示按 VGEE_TORCH_THREADS 自动计算')
+    parser.add_argument('--size', type=int, default=1024, help='合成图像边长')
+    args = parser.parse_args()
+
+    configure_torch_threads(args.threads or None)
+    image = synthetic_image(args.size)
+    point_coords = np.array([[args.size // 2, args.size // 2]])
+    point_labels = np.ones(1, dtype=int)
+
+    quantize_options = {'off': [False], 'on': [True], 'both': [False, True]}[args.quantize]
+    configs = [(m.strip(), q) for m in args.models.split(',') if m.strip() for q in quantize_options]
+
+    results = []
+    for model_type, quantize in configs:
+        print(f"Benchmarking {model_type} (quantize={quantize}) ...")
+        results.append((model_type, quantize, benchmark(
+            model_type, quantize, image, point_coords, point_labels, args.runs
+        )))
+
+    # 以最大的未量化编码器作为质量参照
+    reference = max(results, key=lambda r: (not r[1], MODEL_TYPES.index(r[0]) if r[0] in MODEL_TYPES else -1))
+    print()
+    print(f"threads={torch.get_num_threads()} runs={args.runs} image={args.size}x{args.size} "
+          f"reference={reference[0]}{'+int8' if reference[1] else ''}")
+    print(f"{'config':<14}{'load(s)':>10}{'encode p50(s)':>15}{'encode avg(s)':>15}{'decode p50(s)':>15}{'IoU':>8}")
+    for model_type, quantize, r in results:
+        name = f"{model_type}{'+int8' if quantize else ''}"
+        print(f"{name:<14}{r['load']:>10.2f}{r['encode_median']:>15.3f}{r['encode_mean']:>15.3f}"
+              f"{r['decode_median']:>15.4f}{iou(r['mask'], reference[2]['mask']):>8.3f}")
+
+
+if __name__ == '__main__':
+    main()
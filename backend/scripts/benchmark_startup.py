@@ -0,0 +1,79 @@
+"""
+冷启动基准：在独立的解释器中分别导入每个蓝图模块，报告导入耗时和常驻内存峰值，
+用于确认 torch / samgeo 等重依赖没有在启动时被导入
+
+用法:
+    python scripts/benchmark_startup.py --runs 3
+"""
+import os
+import re
+import sys
+import json
+import argparse
+import statistics
+import subprocess
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# 子进程中执行：导入目标模块，输出耗时、内存峰值以及是否导入了重依赖
+PROBE = '''
+import sys, time, json, resource
+start = time.perf_counter()
+__import__({module!r})
+elapsed = time.perf_counter() - start
+rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+print(json.dumps({{
+    'time': elapsed,
+    'rss_mb': rss / 1024 if sys.platform != 'darwin' else rss / 1024 / 1024,
+    'heavy': [name for name in ('torch', 'samgeo', 'cv2') if name in sys.modules]
+}}))
+'''
+
+HEAVY_MODULE = 'services.inference'
+
+
+def blueprint_modules():
+    '''
+    从 app.py 中解析注册的蓝图模块
+    '''
+    with open(os.path.join(BACKEND_DIR, 'app.py'), encoding='utf-8') as f:
+        return re.findall(r'^from (routes\.\w+) import \w+_bp', f.read(), re.MULTILINE)
+
+
+def probe(module):
+    '''
+    在新的解释器中导入模块并返回测量结果
+    '''
+    output = subprocess.run(
+        [sys.executable, '-c', PROBE.format(module=module)],
+        cwd=BACKEND_DIR, capture_output=True, text=True, check=True
+    ).stdout
+    # 模块导入时可能打印日志，测量结果位于最后一行
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Measure cold import time per blueprint')
+    parser.add_argument('--runs', type=int, default=3)
+    parser.add_argument('--skip-ai-stack', action='store_true', help='不测量延迟加载的推理栈')
+    args = parser.parse_args()
+
+    modules = blueprint_modules() + ['app']
+    if not args.skip_ai_stack:
+        modules.append(HEAVY_MODULE)
+
+    print(f"{'module':<28}{'import p50(s)':>15}{'import max(s)':>15}{'rss(MB)':>10}  heavy modules")
+    for module in modules:
+        try:
+            results = [probe(module) for _ in range(args.runs)]
+        except subprocess.CalledProcessError as e:
+            last_line = (e.stderr.strip().splitlines() or ['failed'])[-1]
+            print(f"{module:<28}  error: {last_line}")
+            continue
+        times = [r['time'] for r in results]
+        print(f"{module:<28}{statistics.median(times):>15.3f}{max(times):>15.3f}"
+              f"{max(r['rss_mb'] for r in results):>10.0f}  {', '.join(results[-1]['heavy']) or '-'}")
+
+
+if __name__ == '__main__':
+    main()
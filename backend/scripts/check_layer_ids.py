@@ -0,0 +1,79 @@
+"""
+图层ID并发检查：多个进程（模拟多个工作进程）中的多个线程同时创建图层并保存到注册表，
+确认所有进程生成的ID不重复、每个ID都能拆分出进程ID和序号、没有图层被覆盖
+
+不需要 Earth Engine 凭证，保存的是占位对象
+
+用法:
+    python scripts/check_layer_ids.py --layers 5000 --workers 32 --processes 4
+"""
+import os
+import sys
+import argparse
+import multiprocessing
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from services.map_service import new_layer_id
+from services.layer_registry import LayerRegistry
+from tools.parallel_processor import ParallelProcessor
+
+
+def create_layers(layers, workers):
+    '''
+    在当前进程中并行创建图层，返回 (图层ID列表, 注册表中的图层数)
+    '''
+    registry = LayerRegistry()
+
+    # 与工具路由相同的模式：每个任务生成一个新图层ID并保存结果
+    def create_layer(index, prefix):
+        layer_id = new_layer_id(prefix)
+        registry.save(layer_id, object(), f'Layer {index}')
+        return layer_id
+
+    ids = ParallelProcessor.process_layers(
+        list(range(layers)), create_layer, max_workers=workers, prefix='check'
+    )
+    return ids, len(registry)
+
+
+def parse_suffix(layer_id):
+    '''
+    拆分ID末尾的 {进程ID}-{序号}，格式不符时返回 None
+    '''
+    pid, sep, counter = layer_id.rsplit('_', 1)[-1].partition('-')
+    if not sep:
+        return None
+    try:
+        return int(pid, 16), int(counter, 16)
+    except ValueError:
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Create layers from parallel processes and threads and check for collisions')
+    parser.add_argument('--layers', type=int, default=5000, help='layers per process')
+    parser.add_argument('--workers', type=int, default=32)
+    parser.add_argument('--processes', type=int, default=4)
+    args = parser.parse_args()
+
+    # 使用 fork（可用时）：与 gunicorn --preload 相同，子进程继承已导入的模块
+    methods = multiprocessing.get_all_start_methods()
+    context = multiprocessing.get_context('fork' if 'fork' in methods else None)
+    with context.Pool(args.processes) as pool:
+        runs = pool.starmap(create_layers, [(args.layers, args.workers)] * args.processes)
+
+    ids = [layer_id for run_ids, _ in runs for layer_id in run_ids]
+    duplicates = len(ids) - len(set(ids))
+    malformed = [layer_id for layer_id in ids if parse_suffix(layer_id) is None]
+    pids = {parse_suffix(layer_id)[0] for layer_id in ids if parse_suffix(layer_id) is not None}
+    overwritten = sum(args.layers - count for _, count in runs)
+    print(f"created {len(ids)} ids in {args.processes} processes x {args.workers} threads: "
+          f"{duplicates} duplicates, {len(malformed)} malformed, {len(pids)} distinct pids, "
+          f"{overwritten} overwritten layers")
+    if duplicates or malformed or overwritten or len(pids) != args.processes:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
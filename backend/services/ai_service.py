@@ -1,101 +1,563 @@
-from samgeo import SamGeo
-from samgeo.text_sam import LangSAM
-from .map_service import save_dataset,get_dataset
-import time
+from .map_service import save_dataset,get_dataset,register_layer_listener,new_layer_id,get_layer_metadata
+from .layer_metadata import describe, bounds_to_bbox
+from .eval_cache import cached_get_map_id, cached_get_info
+from .inference_worker import submit_inference, invalidate_layer
+from .inference_scheduler import QueueFullError
+from .thumbnail import load_thumbnail
+from tools.parallel_processor import get_executor
+import math
+import re
+from itertools import islice
+from collections import deque
 import os
+import contextvars
 import numpy as np
-import cv2
-import requests
-import tempfile
 import traceback
 import ee
-import torch
 # os.environ['CUDA_VISIBLE_DEVICES'] = '-1'  # 禁用所有 GPU
 
-def cleanup_temp_files():
-    """清理临时文件"""
-    current_dir = os.path.dirname(os.path.dirname(__file__))
-    for filename in os.listdir(current_dir):
-        if len(filename) > 16 and '.' not in filename:
+# 图层变更时失效各进程中的 SAM 嵌入缓存
+register_layer_listener(invalidate_layer)
+
+def layer_bbox(layer_id, image):
+    '''
+    获取图层范围 [min_x, min_y, max_x, max_y]，优先使用注册表中缓存的图层元数据
+    '''
+    meta = get_layer_metadata(layer_id) or describe(image)
+    return bounds_to_bbox(meta['bounds'])
+
+def parse_dimensions(dimensions):
+    '''
+    从 dimensions 字符串（如 '1024x1024'）提取图像宽高
+    '''
+    try:
+        img_width, img_height = map(int, dimensions.split('x'))
+    except ValueError:
+        img_width, img_height = 1024, 1024  # 默认值
+    return img_width, img_height
+
+# 矢量化配置：简化容差（像素）、最小多边形面积（像素²）、坐标保留小数位数
+SIMPLIFY_TOLERANCE = float(os.environ.get('VGEE_SIMPLIFY_TOLERANCE', 1.0))
+MIN_POLYGON_AREA = float(os.environ.get('VGEE_MIN_POLYGON_AREA', 16))
+COORD_PRECISION = 7
+
+def masks_to_polygons(masks, image_bounds, img_width, img_height, tolerance=None, min_area=None):
+    '''
+    将掩膜转换为地理坐标多边形环列表（文本和点提示分割共用）
+    Args:
+        masks: 掩膜数组列表
+        image_bounds: [min_x, min_y, max_x, max_y]
+        tolerance: 多边形简化容差（像素），0 表示不简化
+        min_area: 小于该面积（像素²）的碎片多边形被丢弃
+    Returns:
+        list: [[[x, y], ...], ...] 闭合的坐标环
+    '''
+    import cv2
+
+    tolerance = SIMPLIFY_TOLERANCE if tolerance is None else float(tolerance)
+    min_area = MIN_POLYGON_AREA if min_area is None else float(min_area)
+
+    contours = []
+    for mask in masks:
+        found, _ = cv2.findContours(
+            mask.astype(np.uint8),
+            cv2.RETR_EXTERNAL,
+            cv2.CHAIN_APPROX_SIMPLE
+        )
+        for contour in found:
+            # 丢弃碎片多边形
+            if cv2.contourArea(contour) < min_area:
+                continue
+            if tolerance > 0:
+                contour = cv2.approxPolyDP(contour, tolerance, True)
+            if len(contour) >= 3:
+                contours.append(contour.reshape(-1, 2))
+
+    if not contours:
+        return []
+
+    # 所有轮廓点拼接后一次完成像素坐标到地理坐标的仿射变换
+    min_x, min_y, max_x, max_y = image_bounds
+    scale = np.array([(max_x - min_x) / img_width, -(max_y - min_y) / img_height])
+    offset = np.array([min_x, max_y])
+    geo_points = np.round(np.concatenate(contours) * scale + offset, COORD_PRECISION)
+
+    polygons = []
+    for ring in np.split(geo_points, np.cumsum([len(c) for c in contours])[:-1]):
+        # 确保多边形闭合
+        polygons.append(np.vstack([ring, ring[:1]]).tolist())
+    return polygons
+
+def polygons_to_geojson(polygons, properties=None):
+    '''
+    将坐标环列表组装为一个 GeoJSON FeatureCollection，可直接传给 ee.FeatureCollection
+    '''
+    return {
+        'type': 'FeatureCollection',
+        'features': [{
+            'type': 'Feature',
+            'geometry': {'type': 'Polygon', 'coordinates': [coords]},
+            'properties': dict(properties or {})
+        } for coords in polygons if len(coords) >= 4]
+    }
+
+def collect_sample_points(samples):
+    '''
+    收集所有样本点的地理坐标 [[lon, lat], ...]
+    '''
+    points = []
+    # 检查samples是否为ee.FeatureCollection
+    # 获取FeatureCollection的坐标
+    for layer_name, layer_data in samples.items():
+        dataset = get_dataset(layer_name)
+        if isinstance(dataset, ee.FeatureCollection):
+            features = cached_get_info(dataset)['features']
+            for feature in features:
+                points.append(feature['geometry']['coordinates'][:2])
+        # 原有的处理逻辑
+        else:
+            for feature in layer_data['features']:
+                points.append(feature['coordinates'][:2])
+    return points
+
+def points_to_pixels(points, image_bounds, img_width, img_height):
+    '''
+    将地理坐标转换为图像坐标
+    '''
+    min_x, min_y, max_x, max_y = image_bounds
+    return np.array([
+        [int((lon - min_x) / (max_x - min_x) * img_width),
+         int((max_y - lat) / (max_y - min_y) * img_height)]
+        for lon, lat in points
+    ])
+
+def segment_points(items, load_images, affinity=None):
+    '''
+    点提示分割一批图像：先只发送提示点，依赖嵌入缓存；未命中的项再获取图像重试
+    Args:
+        items: [{'point_coords', 'point_labels', 'cache_key'}, ...]
+        load_images: load_images(indices) 返回对应项的 RGB 数组列表，获取失败的项为 None
+        affinity: 亲和键（图层ID），使同一图层的任务落到持有其嵌入缓存的推理进程
+    Returns:
+        list: 每项得分最高的掩膜，无结果时为 None
+    '''
+    params = {'items': items}
+    results = submit_inference('point', [None] * len(items), params, affinity)
+
+    missed = [i for i, result in enumerate(results) if result.get('miss')]
+    if missed:
+        images = load_images(missed)
+        retry = [(i, image) for i, image in zip(missed, images) if image is not None]
+        if retry:
+            retried = submit_inference(
+                'point',
+                [image for _, image in retry],
+                {'items': [items[i] for i, _ in retry]},
+                affinity
+            )
+            for (i, _), result in zip(retry, retried):
+                results[i] = result
+
+    return [result.get('mask') for result in results]
+
+# 分块分割配置
+TILE_SIZE = int(os.environ.get('VGEE_TILE_SIZE', 1024))             # 每块缩略图边长（像素）
+TILE_OVERLAP = int(os.environ.get('VGEE_TILE_OVERLAP', 128))        # 相邻块重叠像素
+TILE_PREFETCH = int(os.environ.get('VGEE_TILE_PREFETCH', 4))        # 同时下载的块数
+TILE_BATCH_SIZE = int(os.environ.get('VGEE_TILE_BATCH_SIZE', 4))    # 每次租借模型连续处理的块数
+MAX_TILES = int(os.environ.get('VGEE_MAX_TILES', 256))
+MAX_STITCH_PIXELS = 8192 * 8192                                      # 合并跨块多边形时栅格的最大像素数
+METERS_PER_DEGREE = 111320.0
+
+def _axis_tiles(start, end, step, span):
+    '''
+    沿一个坐标轴切分，返回 [(块起点, 块终点, 核心起点, 核心终点), ...]
+    核心区域以相邻块重叠带的中线为界，用于跨块去重
+    '''
+    if end - start <= span:
+        return [(start, end, start, end)]
+
+    count = math.ceil((end - start - span) / step) + 1
+    # 最后一块向回对齐到边界，避免超出图层范围
+    starts = [min(start + i * step, end - span) for i in range(count)]
+    axis = []
+    for i, tile_start in enumerate(starts):
+        tile_end = tile_start + span
+        core_start = start if i == 0 else (tile_start + starts[i - 1] + span) / 2
+        core_end = end if i == count - 1 else (tile_end + starts[i + 1]) / 2
+        axis.append((tile_start, tile_end, core_start, core_end))
+    return axis
+
+def split_tiles(image_bounds, resolution, tile_size=TILE_SIZE, overlap=TILE_OVERLAP):
+    '''
+    按目标地面分辨率（米/像素）将图层范围切分为相互重叠的块
+    Returns:
+        list: [{'bounds': [min_x, min_y, max_x, max_y], 'core': [...], 'dimensions': 'WxH'}, ...]
+    '''
+    min_x, min_y, max_x, max_y = image_bounds
+    mid_lat = math.radians((min_y + max_y) / 2)
+    deg_y = resolution / METERS_PER_DEGREE
+    deg_x = resolution / (METERS_PER_DEGREE * max(math.cos(mid_lat), 0.01))
+
+    cols = _axis_tiles(min_x, max_x, (tile_size - overlap) * deg_x, tile_size * deg_x)
+    rows = _axis_tiles(min_y, max_y, (tile_size - overlap) * deg_y, tile_size * deg_y)
+    if len(cols) * len(rows) > MAX_TILES:
+        raise ValueError(f"Too many tiles ({len(cols) * len(rows)}), please increase tileResolution")
+
+    tiles = []
+    for y0, y1, core_y0, core_y1 in reversed(rows):
+        for x0, x1, core_x0, core_x1 in cols:
+            width = max(1, round((x1 - x0) / deg_x))
+            height = max(1, round((y1 - y0) / deg_y))
+            tiles.append({
+                'bounds': [x0, y0, x1, y1],
+                'core': [core_x0, core_y0, core_x1, core_y1],
+                'dimensions': f'{width}x{height}'
+            })
+    return tiles
+
+def _in_box(x, y, box):
+    return box[0] <= x <= box[2] and box[1] <= y <= box[3]
+
+def _seam_state(bbox, core):
+    '''
+    多边形（外包框）相对块核心区域的位置：'inside'、'outside' 或跨越核心边界的 'crossing'
+    '''
+    if bbox[0] >= core[0] and bbox[1] >= core[1] and bbox[2] <= core[2] and bbox[3] <= core[3]:
+        return 'inside'
+    if bbox[2] < core[0] or bbox[0] > core[2] or bbox[3] < core[1] or bbox[1] > core[3]:
+        return 'outside'
+    return 'crossing'
+
+def _tile_pieces(polygons, tile, tile_index):
+    '''
+    为拼接准备块内多边形：完全位于核心区域外的多边形由相邻块负责，直接丢弃
+    Returns:
+        list: [(块序号, 坐标环, 外包框, 是否跨越核心边界), ...]
+    '''
+    pieces = []
+    for coords in polygons:
+        ring = np.asarray(coords)
+        bbox = (*ring.min(axis=0), *ring.max(axis=0))
+        state = _seam_state(bbox, tile['core'])
+        if state != 'outside':
+            pieces.append((tile_index, coords, bbox, state == 'crossing'))
+    return pieces
+
+def _union_rings(rings, pixel_size, tolerance=None, min_area=None):
+    '''
+    合并一组相交的多边形：按块的像素分辨率在其外包范围内栅格化，再重新提取轮廓
+    '''
+    import cv2
+
+    px, py = pixel_size
+    points = np.concatenate([np.asarray(ring) for ring in rings])
+    # 四周各留一个像素，避免轮廓贴边
+    min_x, min_y = points.min(axis=0) - (px, py)
+    max_x, max_y = points.max(axis=0) + (px, py)
+    width = int(math.ceil((max_x - min_x) / px))
+    height = int(math.ceil((max_y - min_y) / py))
+    if width * height > MAX_STITCH_PIXELS:
+        print(f"ai_service.py-_union_rings: seam group too large ({width}x{height}), left unmerged")
+        return [list(ring) for ring in rings]
+
+    canvas = np.zeros((height, width), dtype=np.uint8)
+    for ring in rings:
+        ring = np.asarray(ring)
+        pixels = np.column_stack([(ring[:, 0] - min_x) / px, (max_y - ring[:, 1]) / py])
+        cv2.fillPoly(canvas, [np.round(pixels).astype(np.int32)], 1)
+
+    bounds = [min_x, max_y - height * py, min_x + width * px, max_y]
+    return masks_to_polygons([canvas], bounds, width, height, tolerance, min_area)
+
+def stitch_tile_polygons(pieces, tiles, tolerance=None, min_area=None):
+    '''
+    拼接并去重跨块多边形
+    完全位于本块核心区域内的多边形直接保留；跨越核心边界的多边形（被块边界截断或在重叠带中重复）
+    与相邻块中外包框相交的多边形合并为一个
+    Args:
+        pieces: _tile_pieces 的结果（所有块）
+        tiles: split_tiles 的结果，用于取像素分辨率
+    Returns:
+        list: 坐标环列表
+    '''
+    if not pieces:
+        return []
+
+    bboxes = np.array([bbox for _, _, bbox, _ in pieces])
+    tile_ids = np.array([tile_index for tile_index, _, _, _ in pieces])
+    parent = list(range(len(pieces)))
+
+    def find(i):
+        while parent[i] != i:
+            parent[i] = parent[parent[i]]
+            i = parent[i]
+        return i
+
+    # 跨越核心边界的多边形与其他块中外包框相交的多边形归为一组
+    for i, (tile_index, _, bbox, crossing) in enumerate(pieces):
+        if not crossing:
+            continue
+        hits = np.nonzero(
+            (tile_ids != tile_index) &
+            (bboxes[:, 0] <= bbox[2]) & (bboxes[:, 2] >= bbox[0]) &
+            (bboxes[:, 1] <= bbox[3]) & (bboxes[:, 3] >= bbox[1])
+        )[0]
+        for j in hits:
+            parent[find(j)] = find(i)
+
+    groups = {}
+    for i in range(len(pieces)):
+        groups.setdefault(find(i), []).append(i)
+
+    polygons = []
+    for members in groups.values():
+        if len(members) == 1:
+            polygons.append(pieces[members[0]][1])
+            continue
+        tile = tiles[pieces[members[0]][0]]
+        x0, y0, x1, y1 = tile['bounds']
+        width, height = parse_dimensions(tile['dimensions'])
+        polygons.extend(_union_rings([pieces[i][1] for i in members],
+                                     ((x1 - x0) / width, (y1 - y0) / height), tolerance, min_area))
+    return polygons
+
+def fetch_tile_image(image, tile, layer_id, layer_min, layer_max):
+    '''
+    获取单个块的缩略图数组
+    '''
+    return load_thumbnail(image, {
+        'region': ee.Geometry.Rectangle(tile['bounds'], 'EPSG:4326', False),
+        'crs': 'EPSG:4326',
+        'min': layer_min,
+        'max': layer_max,
+        'dimensions': tile['dimensions'],
+        'format': 'png'
+    }, (layer_id, layer_min, layer_max, tile['dimensions'], tuple(tile['bounds'])))
+
+def iter_tile_images(image, tiles, layer_id, layer_min, layer_max):
+    '''
+    并发下载块缩略图并按顺序逐块产出 (tile, image_array)
+    下载任务提交到共享的 io 线程池，同时下载（在内存中）的块数不超过 TILE_PREFETCH，下载失败的块被跳过
+    '''
+    executor = get_executor('io')
+    # 已在 io 线程池的任务中：依次下载，避免等待同一线程池而死锁
+    if executor.in_worker():
+        for tile in tiles:
             try:
-                os.remove(os.path.join(current_dir, filename))
+                yield tile, executor.run_inline(fetch_tile_image, image, tile, layer_id, layer_min, layer_max)
             except Exception as e:
-                print(f"Error removing temp file {filename}: {str(e)}")
+                print(f"Error fetching tile {tile['bounds']}: {str(e)}")
+        return
+
+    def submit(tile):
+        # 在调用方上下文的副本中下载，保留当前请求的工作区和重试预算
+        return executor.submit(contextvars.copy_context().run,
+                               fetch_tile_image, image, tile, layer_id, layer_min, layer_max)
+
+    tiles = iter(tiles)
+    pending = deque((tile, submit(tile)) for tile in islice(tiles, TILE_PREFETCH))
+    try:
+        while pending:
+            tile, future = pending.popleft()
+            next_tile = next(tiles, None)
+            if next_tile is not None:
+                pending.append((next_tile, submit(next_tile)))
+            try:
+                yield tile, future.result()
+            except Exception as e:
+                print(f"Error fetching tile {tile['bounds']}: {str(e)}")
+    finally:
+        # 调用方提前停止迭代时取消尚未开始的下载
+        for _, future in pending:
+            future.cancel()
+
+def _batched(iterable, size):
+    iterator = iter(iterable)
+    while True:
+        batch = list(islice(iterator, size))
+        if not batch:
+            return
+        yield batch
+
+def text_segment_tiled(image, image_bounds, params, layer_id, layer_min, layer_max, resolution):
+    '''
+    分块语义分割：按目标分辨率切块，流式下载并分批推理，拼接并去重跨块多边形
+    Returns:
+        list: 每个提示一个多边形列表
+    '''
+    prompts = params.get('textPrompts', ['house'])
+    threshold = params.get('threshold', 0.24)
+    tiles = split_tiles(image_bounds, resolution)
+    print(f"ai_service.py-text_segment_tiled-tiles: {len(tiles)}, resolution: {resolution}m")
+    tile_images = iter_tile_images(image, [dict(tile, index=i) for i, tile in enumerate(tiles)],
+                                   layer_id, layer_min, layer_max)
 
-def text_segment_img(url, image_bounds, params, dimensions='1024x1024'):
+    class_pieces = [[] for _ in prompts]
+    for batch in _batched(tile_images, TILE_BATCH_SIZE):
+        # 每批块作为一个推理任务提交，只租借一次模型
+        results = submit_inference(
+            'text',
+            [tile_image for _, tile_image in batch],
+            {'prompts': prompts, 'threshold': threshold}
+        )
+
+        for (tile, _), result in zip(batch, results):
+            img_width, img_height = parse_dimensions(tile['dimensions'])
+            for index, masks in enumerate(masks_by_class(result, len(prompts))):
+                polygons = masks_to_polygons(masks, tile['bounds'], img_width, img_height,
+                                             params.get('simplifyTolerance'), params.get('minArea'))
+                class_pieces[index].extend(_tile_pieces(polygons, tile, tile['index']))
+
+    return [stitch_tile_polygons(pieces, tiles, params.get('simplifyTolerance'), params.get('minArea'))
+            for pieces in class_pieces]
+
+def point_segment_tiled(image, image_bounds, samples, layer_id, layer_min, layer_max, resolution,
+                        vector_params=None):
+    '''
+    分块点提示分割：每个提示点归属于其核心区域所在的块，只处理包含提示点的块
+    '''
+    tiles = split_tiles(image_bounds, resolution)
+    points = collect_sample_points(samples)
+
+    prompted_tiles = []
+    for tile in tiles:
+        tile_points = [p for p in points if _in_box(p[0], p[1], tile['core'])]
+        if tile_points:
+            cache_key = (layer_id, layer_min, layer_max, tile['dimensions'], tuple(tile['bounds']))
+            prompted_tiles.append(dict(tile, points=tile_points, cache_key=cache_key))
+    print(f"ai_service.py-point_segment_tiled-tiles: {len(prompted_tiles)}/{len(tiles)}")
+
+    coordinates = []
+    vector_params = vector_params or {}
+    for batch in _batched(prompted_tiles, TILE_BATCH_SIZE):
+        items = []
+        for tile in batch:
+            img_width, img_height = parse_dimensions(tile['dimensions'])
+            point_coords = points_to_pixels(tile['points'], tile['bounds'], img_width, img_height)
+            items.append({
+                'point_coords': point_coords,
+                'point_labels': np.ones(len(point_coords), dtype=int),  # 1 表示前景点
+                'cache_key': tile['cache_key']
+            })
+
+        def load_images(indices, batch=batch):
+            # 只下载未命中嵌入缓存的块
+            tile_images = iter_tile_images(
+                image, [dict(batch[i], index=i) for i in indices], layer_id, layer_min, layer_max
+            )
+            fetched = {tile['index']: tile_image for tile, tile_image in tile_images}
+            return [fetched.get(i) for i in indices]
+
+        masks = segment_points(items, load_images, affinity=layer_id)
+        for tile, mask in zip(batch, masks):
+            if mask is not None:
+                img_width, img_height = parse_dimensions(tile['dimensions'])
+                coordinates.extend(masks_to_polygons(
+                    [mask], tile['bounds'], img_width, img_height,
+                    vector_params.get('simplifyTolerance'), vector_params.get('minArea')
+                ))
+
+    return coordinates
+
+def parse_text_prompts(layer_params):
+    '''
+    读取文本提示：textPrompts 列表，或以逗号 / 分号分隔的 textPrompt（多提示模式）
+    '''
+    prompts = layer_params.get('textPrompts') or re.split(r'[,;，；]', layer_params.get('textPrompt', 'house'))
+    prompts = [p.strip() for p in prompts if p and p.strip()]
+    # 去重并保持顺序
+    return list(dict.fromkeys(prompts)) or ['house']
+
+def masks_by_class(result, class_count):
+    '''
+    按提示序号拆分文本分割结果中的掩膜
+    '''
+    groups = [[] for _ in range(class_count)]
+    for index, mask in zip(result['classes'], result['masks']):
+        groups[int(index)].append(mask)
+    return groups
+
+def text_segment_img(image, image_bounds, params, dimensions='1024x1024'):
     '''
     语义分割图像
+    image: 缩略图 RGB 数组
+    Returns:
+        list: 每个提示一个多边形列表
     '''
     try:
-        # 初始化 LangSAM 模型
-        sam = LangSAM()
-        print('ai_service.py-text_segment_img-sam', sam.device)
-
         # 从参数中获取文本提示和阈值
-        text_prompt = params.get('textPrompt', "house")
+        prompts = params.get('textPrompts', ['house'])
         threshold = params.get('threshold', 0.24)
-        print(f"text_prompt: {text_prompt}, threshold: {threshold}")
-        
-        # 从 dimensions 提取图像宽高
-        try:
-            img_width, img_height = map(int, dimensions.split('x'))
-        except ValueError:
-            img_width, img_height = 1024, 1024  # 默认值
-
-        # 执行分割
-        sam.predict(
-            image=url,
-            text_prompt=text_prompt,
-            box_threshold=threshold,
-            text_threshold=threshold,
-            return_results=True
-        )
-        
-        # 存储所有掩膜结果
-        all_masks = []
-        
-        if sam.masks is not None:
-            min_x, min_y, max_x, max_y = image_bounds
-            
-            # 遍历每个掩膜
-            for mask in sam.masks:
-                mask = mask.cpu().numpy()
-                
-                # 处理掩膜轮廓
-                contours, _ = cv2.findContours(
-                    mask.astype(np.uint8), 
-                    cv2.RETR_EXTERNAL, 
-                    cv2.CHAIN_APPROX_SIMPLE
-                )
-                
-                # 转换每个轮廓为地理坐标
-                for contour in contours:
-                    geo_coords = []
-                    for point in contour:
-                        x, y = point[0]
-                        geo_x = float(min_x + (x / img_width) * (max_x - min_x))
-                        geo_y = float(max_y - (y / img_height) * (max_y - min_y))
-                        geo_coords.append([geo_x, geo_y])
-                    
-                    # 确保多边形闭合
-                    if geo_coords[0] != geo_coords[-1]:
-                        geo_coords.append(geo_coords[0])
-                        
-                    all_masks.append(geo_coords)
-        
-        # 清理临时文件
-        cleanup_temp_files()
-        
-        return all_masks
-        
+        print(f"text_prompts: {prompts}, threshold: {threshold}")
+
+        img_width, img_height = parse_dimensions(dimensions)
+
+        # 提交推理任务：所有提示共用一次缩略图下载和一次图像编码
+        result = submit_inference('text', [image], {
+            'prompts': prompts,
+            'threshold': threshold
+        })[0]
+
+        # 按提示分别矢量化
+        return [
+            masks_to_polygons(masks, image_bounds, img_width, img_height,
+                              params.get('simplifyTolerance'), params.get('minArea'))
+            for masks in masks_by_class(result, len(prompts))
+        ]
+
+    except QueueFullError:
+        raise
     except Exception as e:
-        cleanup_temp_files()
         print(f"Error in segment_img: {str(e)}")
         traceback.print_exc()
         return None
 
+# 多提示模式下各类别图层的颜色，第一个类别沿用单提示的红色
+CLASS_COLORS = ['ff0000', '0080ff', 'ffa500', '00c060', 'a040ff', 'ff40a0', '00c0c0', '806000']
+
+def mask_layer(layer_id, image_name, polygons, prompt=None, color='ff0000'):
+    '''
+    将一个类别的多边形保存为矢量图层，返回前端图层描述
+    prompt 为 None 时为单提示模式，沿用原有的图层ID和名称
+    '''
+    geojson = polygons_to_geojson(polygons, {'class': prompt} if prompt else None)
+
+    # 确保至少有一个有效的多边形
+    if not geojson['features']:
+        return None
+
+    feature_collection = ee.FeatureCollection(geojson)
+    if prompt:
+        slug = re.sub(r'\W+', '_', prompt).strip('_') or 'class'
+        id = new_layer_id(f'{layer_id}_{slug}_mask')
+        name = f'{image_name}_{prompt}_mask'
+    else:
+        id = new_layer_id(f'{layer_id}_mask')
+        name = f'{image_name}_mask'
+    save_dataset(id,feature_collection,name)
+
+    # 获取瓦片URL
+    map_id = cached_get_map_id(feature_collection, {
+        'color': color,
+        'fillColor': f'{color}88'
+    })
+
+    return {
+        'layer_id': id,
+        'name': name,
+        'type': 'vector',
+        'tileUrl': map_id['tile_fetcher'].url_format,
+        'visParams': {
+            'color': f'#{color}',
+            'weight': 2,
+            'opacity': 1,
+            'fillOpacity': 0.3
+        }
+    }
+
 def text_single_layer(layer_id, datasets, datasetsNames, params, vis_params):
-    """处理单个语义识别的函数"""
+    """处理单个语义识别的函数，多提示模式下每个提示生成一个带类别属性的矢量图层"""
     try:
         image = datasets[layer_id]
         image_name = datasetsNames[layer_id]
@@ -103,198 +565,104 @@ def text_single_layer(layer_id, datasets, datasetsNames, params, vis_params):
         
         # 获取该图层的特定参数
         layer_params = params.get(layer_id, {})
-        text_prompt = layer_params.get('textPrompt', 'house')
+        prompts = parse_text_prompts(layer_params)
         threshold = layer_params.get('threshold', 0.24)
+        segment_params = {
+            'textPrompts': prompts,
+            'threshold': threshold,
+            'simplifyTolerance': layer_params.get('simplifyTolerance'),
+            'minArea': layer_params.get('minArea')
+        }
         
         # 获取该图层的显示参数
         layer_vis = vis_params.get(layer_id, {})
         layer_min = layer_vis.get('min', 0)
         layer_max = layer_vis.get('max', 255)
         
-        # 获取图像边界
-        bounds = image.geometry().bounds().getInfo()['coordinates'][0]
-        print('ai_routes-segment_image-bounds', bounds)
-
-        image_bounds = [
-            bounds[0][0],  # min_x
-            bounds[0][1],  # min_y
-            bounds[2][0],  # max_x
-            bounds[2][1]   # max_y
-        ]
+        # 获取图像边界（来自图层元数据）
+        image_bounds = layer_bbox(layer_id, image)
+        print('ai_routes-segment_image-bounds', image_bounds)
 
-        # 获取缩略图URL
-        dimensions = '1024x1024'
-        url = image.getThumbURL({
-            'region': image.geometry(),
-            'min': layer_min,
-            'max': layer_max,
-            'dimensions': dimensions
-        })
-
-        print(f"Generated URL for layer {layer_id}: {url}")
-        mask_coords = text_segment_img(url, image_bounds, {
-            'textPrompt': text_prompt,
-            'threshold': threshold
-        }, dimensions)
+        if layer_params.get('tiled'):
+            # 分块模式：按目标地面分辨率切块分割
+            class_polygons = text_segment_tiled(image, image_bounds, segment_params, layer_id, layer_min, layer_max,
+                                                float(layer_params.get('tileResolution', 10)))
+        else:
+            # 获取缩略图并直接解码为数组
+            dimensions = '1024x1024'
+            image_array = load_thumbnail(image, {
+                'region': image.geometry(),
+                'min': layer_min,
+                'max': layer_max,
+                'dimensions': dimensions
+            }, (layer_id, layer_min, layer_max, dimensions))
+
+            class_polygons = text_segment_img(image_array, image_bounds, segment_params, dimensions)
         
-        if mask_coords is None or len(mask_coords) == 0:
+        if class_polygons is None:
             return None
 
-        # 将掩膜坐标转换为 FeatureCollection，添加验证
-        features = []
-        for coords in mask_coords:
-            # 验证坐标点数量
-            if len(coords) >= 4:  # 确保至少有4个点
-                try:
-                    feature = ee.Feature(ee.Geometry.Polygon([coords]))
-                    features.append(feature)
-                except Exception as e:
-                    print(f"Error creating polygon: {str(e)}")
-                    continue
-        
-        # 确保至少有一个有效的多边形
-        if not features:
+        layers = []
+        multi = len(prompts) > 1
+        for index, (prompt, polygons) in enumerate(zip(prompts, class_polygons)):
+            layer = mask_layer(layer_id, image_name, polygons,
+                               prompt if multi else None,
+                               CLASS_COLORS[index % len(CLASS_COLORS)])
+            if layer is not None:
+                layers.append(layer)
+
+        if not layers:
             print("No valid polygons found")
             return None
-            
-        feature_collection = ee.FeatureCollection(features)
-        id = f'{layer_id}_mask_{int(time.time())}'
-        name = f'{image_name}_mask'
-        save_dataset(id,feature_collection,name)
-        
-        # 设置样式参数
-        ee_style_params = {
-            'color': 'ff0000',
-            'fillColor': 'ff000088'
-        }
-        
-        # 获取瓦片URL
-        map_id = feature_collection.getMapId(ee_style_params)
-        
-        # 创建掩膜图层
-        mask_layer = {
-            'layer_id':id ,
-            'name':name ,
-            'type': 'vector',
-            'tileUrl': map_id['tile_fetcher'].url_format,
-            'visParams': {
-                'color': '#ff0000',
-                'weight': 2,
-                'opacity': 1,
-                'fillOpacity': 0.3
-            }
-        }
-
-        return mask_layer
+        return layers
+    except QueueFullError:
+        # 推理队列已满时交给路由返回 503
+        raise
     except Exception as e:
         print(f"Error processing layer {layer_id}: {str(e)}")
         traceback.print_exc()
         return None
 
-def point_segment_img(url, image_bounds, samples, dimensions='1024x1024'):
+def point_segment_img(load_image, image_bounds, samples, dimensions='1024x1024', cache_key=None, vector_params=None):
     '''
     点提示分割图像
+    load_image: 无参函数，返回缩略图 RGB 数组
+    cache_key: 嵌入缓存键，命中时跳过缩略图下载和图像编码
+    vector_params: 矢量化参数（simplifyTolerance、minArea）
     '''
     try:
-        # 初始化 SAM 模型
-        sam = SamGeo(
-            model_type="vit_h",
-            automatic=False,
-            sam_kwargs=None,
-        )
-        
-        # 直接在内存中读取图像
-        response = requests.get(url)
-        image_array = np.asarray(bytearray(response.content), dtype=np.uint8)
-        image = cv2.imdecode(image_array, cv2.IMREAD_COLOR)
-        
-        # 直接设置图像数组
-        sam.set_image(image)
-        
-        # 从 dimensions 提取图像宽高
-        try:
-            img_width, img_height = map(int, dimensions.split('x'))
-        except ValueError:
-            img_width, img_height = 1024, 1024
-            
+        img_width, img_height = parse_dimensions(dimensions)
+
         # 转换样本数据格式
-        point_coords = []
-        point_labels = []
         print('ai_service.py-point_segment_img-samples',samples)
-        # 检查samples是否为ee.FeatureCollection
-        # 获取FeatureCollection的坐标
-        for layer_name, layer_data in samples.items():
-            points = get_dataset(layer_name)
-            if isinstance(points,ee.FeatureCollection):
-                features = points.getInfo()['features']
-                for feature in features:
-                    coords = feature['geometry']['coordinates']
-                    # 转换地理坐标到图像坐标
-                    img_x = int((coords[0] - image_bounds[0]) / (image_bounds[2] - image_bounds[0]) * img_width)
-                    img_y = int((image_bounds[3] - coords[1]) / (image_bounds[3] - image_bounds[1]) * img_height)
-                    point_coords.append([img_x, img_y])
-                    point_labels.append(1)  # 1 表示前景点
-        # 原有的处理逻辑
-            else:
-                for feature in layer_data['features']:
-                    coords = feature['coordinates']
-                    img_x = int((coords[0] - image_bounds[0]) / (image_bounds[2] - image_bounds[0]) * img_width)
-                    img_y = int((image_bounds[3] - coords[1]) / (image_bounds[3] - image_bounds[1]) * img_height)
-                    point_coords.append([img_x, img_y])
-                    point_labels.append(1)  # 1 表示前景点
-        
-        point_coords = np.array(point_coords)
-        point_labels = np.array(point_labels)
-        
+        point_coords = points_to_pixels(collect_sample_points(samples), image_bounds, img_width, img_height)
+        point_labels = np.ones(len(point_coords), dtype=int)  # 1 表示前景点
+
         print('Image coordinates:', point_coords)
         print('Point labels:', point_labels)
-            
-        # 执行分割预测
-        masks, scores, logits = sam.predictor.predict(
-            point_coords=point_coords,
-            point_labels=point_labels
-        )
-        
+
+        # 提交推理任务：嵌入缓存未命中时才获取缩略图
+        mask = segment_points(
+            [{'point_coords': point_coords, 'point_labels': point_labels, 'cache_key': cache_key}],
+            lambda indices: [load_image()],
+            affinity=cache_key[0] if cache_key else None
+        )[0]
+
         # 将掩码转换为地理坐标
-        coordinates = []
-        if masks is not None and len(masks) > 0:
-            # 获取图像边界
-            min_x, min_y, max_x, max_y = image_bounds
-            
-            # 找到得分最高的掩码
-            best_mask_idx = np.argmax(scores)
-            mask = masks[best_mask_idx]
-            
-            # 使用 OpenCV 找到掩码的轮廓
-            contours, _ = cv2.findContours(
-                mask.astype(np.uint8), 
-                cv2.RETR_EXTERNAL, 
-                cv2.CHAIN_APPROX_SIMPLE
-            )
-            
-            # 转换每个轮廓为地理坐标
-            for contour in contours:
-                geo_coords = []
-                for point in contour:
-                    x, y = point[0]
-                    geo_x = float(min_x + (x / img_width) * (max_x - min_x))
-                    geo_y = float(max_y - (y / img_height) * (max_y - min_y))
-                    geo_coords.append([geo_x, geo_y])
-                
-                # 确保多边形闭合
-                if geo_coords[0] != geo_coords[-1]:
-                    geo_coords.append(geo_coords[0])
-                    
-                coordinates.append(geo_coords)
-        
-        return coordinates
-        
+        if mask is None:
+            return []
+        vector_params = vector_params or {}
+        return masks_to_polygons([mask], image_bounds, img_width, img_height,
+                                 vector_params.get('simplifyTolerance'), vector_params.get('minArea'))
+
+    except QueueFullError:
+        raise
     except Exception as e:
         print(f"Error in point_segment_img: {str(e)}")
         traceback.print_exc()
         return None
 
-def point_single_layer(layer_id, datasets, datasetsNames, samples, vis_params):
+def point_single_layer(layer_id, datasets, datasetsNames, samples, vis_params, params=None):
     """处理单个点提示分割的函数"""
     try:
         image = datasets[layer_id]
@@ -306,51 +674,43 @@ def point_single_layer(layer_id, datasets, datasetsNames, samples, vis_params):
         layer_min = layer_vis.get('min', 0)
         layer_max = layer_vis.get('max', 255)
         
-        # 获取图像边界
-        bounds = image.geometry().bounds().getInfo()['coordinates'][0]
-        print('ai_service-point_segment-bounds', bounds)
-
-        image_bounds = [
-            bounds[0][0],  # min_x
-            bounds[0][1],  # min_y
-            bounds[2][0],  # max_x
-            bounds[2][1]   # max_y
-        ]
-
-        # 获取缩略图URL
-        dimensions = '1024x1024'
-        url = image.getThumbURL({
-            'region': image.geometry(),
-            'min': layer_min,
-            'max': layer_max,
-            'dimensions': dimensions
-        })
+        # 获取图像边界（来自图层元数据）
+        image_bounds = layer_bbox(layer_id, image)
+        print('ai_service-point_segment-bounds', image_bounds)
 
-        print(f"Generated URL for layer {layer_id}: {url}")
-        coordinates = point_segment_img(url, image_bounds, samples, dimensions)
+        layer_params = (params or {}).get(layer_id, {})
+        if layer_params.get('tiled'):
+            # 分块模式：只处理包含提示点的块
+            coordinates = point_segment_tiled(image, image_bounds, samples, layer_id, layer_min, layer_max,
+                                              float(layer_params.get('tileResolution', 10)), layer_params)
+        else:
+            # 缩略图只在嵌入缓存未命中时获取
+            dimensions = '1024x1024'
+            cache_key = (layer_id, layer_min, layer_max, dimensions)
+            thumb_params = {
+                'region': image.geometry(),
+                'min': layer_min,
+                'max': layer_max,
+                'dimensions': dimensions
+            }
+            coordinates = point_segment_img(
+                lambda: load_thumbnail(image, thumb_params, cache_key),
+                image_bounds, samples, dimensions, cache_key, layer_params
+            )
 
         if coordinates is None:
             return None
 
-        # 将坐标转换为 FeatureCollection，添加验证
-        features = []
-        for coords in coordinates:
-            # 验证坐标点数量
-            if len(coords) >= 4:  # 确保至少有4个点
-                try:
-                    feature = ee.Feature(ee.Geometry.Polygon([coords]))
-                    features.append(feature)
-                except Exception as e:
-                    print(f"Error creating polygon: {str(e)}")
-                    continue
+        # 将坐标组装为一个 GeoJSON FeatureCollection
+        geojson = polygons_to_geojson(coordinates)
         
         # 确保至少有一个有效的多边形
-        if not features:
+        if not geojson['features']:
             print("No valid polygons found")
             return None
             
-        feature_collection = ee.FeatureCollection(features)
-        id = f'sam_prediction_{layer_id}_{int(time.time())}'
+        feature_collection = ee.FeatureCollection(geojson)
+        id = new_layer_id(f'sam_prediction_{layer_id}')
         name = f'{image_name}_SAM_point_prediction'
         
         save_dataset(id,feature_collection,name)
@@ -362,7 +722,7 @@ def point_single_layer(layer_id, datasets, datasetsNames, samples, vis_params):
         }
         
         # 获取瓦片URL
-        map_id = feature_collection.getMapId(ee_style_params)
+        map_id = cached_get_map_id(feature_collection, ee_style_params)
 
         return {
             'layer_id': id,
@@ -376,6 +736,8 @@ def point_single_layer(layer_id, datasets, datasetsNames, samples, vis_params):
                 'fillOpacity': 0.5
             }
         }
+    except QueueFullError:
+        raise
     except Exception as e:
         print(f"Error processing layer {layer_id}: {str(e)}")
         return None
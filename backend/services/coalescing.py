@@ -0,0 +1,63 @@
+import json
+import threading
+from functools import wraps
+from flask import request, make_response, Response
+from .eval_cache import SingleFlight
+from .workspace import current_workspace
+from .metrics import register_metrics
+
+_flight = SingleFlight()
+_lock = threading.Lock()
+# 各路由的合并统计：executed 为实际执行次数，coalesced 为等待并共享结果的请求数
+_stats = {}
+
+
+def _count(endpoint, field):
+    with _lock:
+        stats = _stats.setdefault(endpoint, {'executed': 0, 'coalesced': 0})
+        stats[field] += 1
+
+
+def request_key():
+    '''
+    规范化的请求键：路由、方法、查询参数、按键排序的 JSON 请求体和当前工作区
+    '''
+    body = request.get_json(silent=True)
+    if body is None:
+        body = request.get_data(as_text=True)
+    return json.dumps([
+        request.path,
+        request.method,
+        sorted(request.args.items(multi=True)),
+        body,
+        current_workspace().id
+    ], sort_keys=True, default=str)
+
+
+def coalesce_requests(view):
+    '''
+    视图装饰器：同时到达的相同请求只执行一次，其余请求等待并共享同一个响应
+    只用于不修改状态的查询接口
+    '''
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        def run():
+            # 响应对象不能在请求间共享，只共享响应内容
+            response = make_response(view(*args, **kwargs))
+            return response.get_data(), response.status_code, list(response.headers.items())
+
+        (data, status, headers), shared = _flight.do(request_key(), run)
+        _count(request.endpoint, 'coalesced' if shared else 'executed')
+        return Response(data, status=status, headers=headers)
+
+    return wrapper
+
+
+def get_stats():
+    with _lock:
+        stats = {endpoint: dict(counts) for endpoint, counts in _stats.items()}
+    stats['in_flight'] = _flight.in_flight()
+    return stats
+
+
+register_metrics('request_coalescing', get_stats)
@@ -1,5 +1,11 @@
+import copy
 import datetime
+import threading
 import ee
+from .metrics import register_metrics
+from .eval_cache import EvalCache, eval_cache, cached_get_info
+from .ee_concurrency import ee_call
+from .ee_retry import is_retryable, CircuitOpenError
 
 
 def date_sequence(start, end, unit, date_format="YYYY-MM-dd", step=1):
@@ -53,4 +59,106 @@ def date_sequence(start, end, unit, date_format="YYYY-MM-dd", step=1):
             lambda d: start_date.advance(d, unit).format(date_format)
         )
 
-    return date_seq
\ No newline at end of file
+    return date_seq
+
+
+# 批量求值统计：调用次数、实际往返次数、节省的往返次数、整体失败后逐个求值的次数
+_batch_lock = threading.Lock()
+_batch_stats = {'batches': 0, 'values': 0, 'round_trips': 0, 'round_trips_saved': 0, 'fallbacks': 0}
+
+
+def _count_batch(**counts):
+    with _batch_lock:
+        for key, value in counts.items():
+            _batch_stats[key] += value
+
+
+register_metrics('ee_batch', lambda: dict(_batch_stats))
+
+
+def evaluate_batch(values, errors=None, kind='info', lane='interactive'):
+    """Evaluates several Earth Engine values in one round trip.
+
+    Values already in the evaluation cache are taken from it. The remaining
+    computed objects are packed into a single ee.Dictionary and resolved
+    with one getInfo(). If that request fails, each value is evaluated on its
+    own so one bad value does not fail the others, unless the failure is a
+    transient Earth Engine error that already exhausted its retries, in which
+    case every value fails without further requests.
+
+    Args:
+        values (dict): Names mapped to ee.ComputedObject instances. Plain
+            Python values are returned unchanged.
+        errors (dict, optional): If given, collects the exception of each
+            failed key and that key resolves to None. If omitted, the first
+            failure is raised.
+        kind (str, optional): Evaluation cache kind, which sets how long the
+            results are kept. Defaults to 'info'.
+        lane (str, optional): Earth Engine concurrency lane, 'interactive'
+            or 'aggregation' for reductions. Defaults to 'interactive'.
+
+    Returns:
+        dict: The resolved values under the same names.
+    """
+    results = {}
+    pending = {}
+    cache_keys = {}
+    for key, value in values.items():
+        if not isinstance(value, ee.ComputedObject):
+            results[key] = value
+            continue
+        cache_keys[key] = EvalCache.make_key(kind, value)
+        found, cached = eval_cache.lookup(kind, cache_keys[key])
+        if found:
+            results[key] = copy.deepcopy(cached)
+        else:
+            pending[key] = value
+
+    if not pending:
+        return results
+
+    _count_batch(batches=1, values=len(pending))
+    if len(pending) == 1:
+        key, value = next(iter(pending.items()))
+        _count_batch(round_trips=1)
+        try:
+            results[key] = cached_get_info(value, kind, lane)
+        except Exception as e:
+            if errors is None:
+                raise
+            errors[key] = e
+            results[key] = None
+        return results
+
+    try:
+        resolved = ee_call(lane, ee.Dictionary(pending).getInfo)
+        _count_batch(round_trips=1, round_trips_saved=len(pending) - 1)
+        for key, value in resolved.items():
+            eval_cache.store(kind, cache_keys[key], copy.deepcopy(value))
+        results.update(resolved)
+        return results
+    except Exception as e:
+        _count_batch(round_trips=1)
+        if is_retryable(e) or isinstance(e, CircuitOpenError):
+            # Earth Engine 暂时不可用：逐个求值只会加重负载
+            if errors is None:
+                raise
+            for key in pending:
+                errors[key] = e
+                results[key] = None
+            return results
+        print(f"Common.py - batch evaluation failed, evaluating {len(pending)} values separately: {str(e)}")
+        _count_batch(fallbacks=1)
+
+    # 整体求值失败：逐个求值，隔离出错的键
+    failures = errors if errors is not None else {}
+    for key, value in pending.items():
+        _count_batch(round_trips=1)
+        try:
+            results[key] = cached_get_info(value, kind, lane)
+        except Exception as e:
+            failures[key] = e
+            results[key] = None
+    if errors is None and failures:
+        raise next(iter(failures.values()))
+    return results
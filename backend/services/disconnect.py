@@ -0,0 +1,33 @@
+import select
+import socket
+from flask import request, has_request_context
+
+# WSGI 服务器在 environ 中提供的客户端连接（开发服务器 / gunicorn）
+SOCKET_KEYS = ('werkzeug.socket', 'gunicorn.socket')
+
+
+def disconnect_checker():
+    '''
+    返回检查当前请求的客户端是否已断开的无参函数，可在工作线程中调用
+    服务器不提供连接对象时始终返回 False
+    '''
+    if not has_request_context():
+        return lambda: False
+    sock = next((request.environ[key] for key in SOCKET_KEYS if request.environ.get(key) is not None), None)
+    if sock is None:
+        return lambda: False
+
+    def disconnected():
+        try:
+            # 对端关闭连接后套接字可读且读到 0 字节；先用 select 检查是否可读，避免阻塞
+            # （Windows 没有 MSG_DONTWAIT，只能用 select 加普通的 MSG_PEEK）
+            readable, _, _ = select.select([sock], [], [], 0)
+            if not readable:
+                return False
+            return sock.recv(1, socket.MSG_PEEK) == b''
+        except BlockingIOError:
+            return False
+        except (OSError, ValueError):
+            return True
+
+    return disconnected
@@ -0,0 +1,142 @@
+import os
+import re
+import time
+import threading
+from contextlib import contextmanager
+from .metrics import register_metrics
+from .ee_retry import with_retry
+
+# Earth Engine 并发上限（AIMD 自适应）：初始值和最大值，interactive 为 getMapId、像素值等轻量请求，aggregation 为 reduceRegion、sample 等统计
+INTERACTIVE_LIMIT = int(os.environ.get('VGEE_EE_INTERACTIVE_LIMIT', 8))
+INTERACTIVE_MAX = int(os.environ.get('VGEE_EE_INTERACTIVE_MAX', 32))
+AGGREGATION_LIMIT = int(os.environ.get('VGEE_EE_AGGREGATION_LIMIT', 4))
+AGGREGATION_MAX = int(os.environ.get('VGEE_EE_AGGREGATION_MAX', 16))
+# 延迟超过平均延迟的该倍数时视为变慢，不再提高上限
+LATENCY_TOLERANCE = float(os.environ.get('VGEE_EE_LATENCY_TOLERANCE', 2.0))
+# 配额错误时上限乘以该系数
+BACKOFF_FACTOR = 0.5
+
+# Earth Engine 配额、限流错误信息中的关键字
+QUOTA_ERROR_MARKERS = (
+    'too many concurrent aggregations',
+    'too many requests',
+    'quota exceeded',
+    'rate limit',
+)
+QUOTA_STATUS = re.compile(r'\b429\b')
+
+
+def is_quota_error(error):
+    '''
+    是否为 Earth Engine 配额或限流错误
+    '''
+    message = str(error).lower()
+    return any(marker in message for marker in QUOTA_ERROR_MARKERS) or bool(QUOTA_STATUS.search(message))
+
+
+class AdaptiveLimiter:
+    """
+    AIMD 并发控制：调用成功且延迟平稳时上限缓慢增加（每个窗口 +1），遇到配额错误时上限减半
+
+    Args:
+        name: 名称（指标分组）
+        initial: 初始上限
+        maximum: 上限的最大值
+        minimum: 上限的最小值
+    """
+
+    def __init__(self, name, initial, maximum, minimum=1):
+        self.name = name
+        self.minimum = minimum
+        self.maximum = max(maximum, minimum)
+        self.limit = float(min(max(initial, minimum), self.maximum))
+        self._cond = threading.Condition()
+        self.active = 0
+        self.waiting = 0
+        self.latency = None          # 成功调用延迟的指数移动平均（秒）
+        self._last_decrease = 0.0
+        self._stats = {'calls': 0, 'increases': 0, 'decreases': 0, 'quota_errors': 0, 'wait_seconds': 0.0}
+
+    def _acquire(self):
+        start = time.time()
+        with self._cond:
+            self.waiting += 1
+            try:
+                while self.active >= int(self.limit):
+                    self._cond.wait()
+            finally:
+                self.waiting -= 1
+            self.active += 1
+            self._stats['calls'] += 1
+            self._stats['wait_seconds'] += time.time() - start
+
+    def _release(self, latency, error):
+        with self._cond:
+            self.active -= 1
+            if error is not None and is_quota_error(error):
+                self._stats['quota_errors'] += 1
+                # 同一批并发调用的多个配额错误只减一次：距上次减小不足一个平均延迟时跳过
+                now = time.time()
+                if now - self._last_decrease >= (self.latency or 1.0):
+                    self.limit = max(self.minimum, self.limit * BACKOFF_FACTOR)
+                    self._last_decrease = now
+                    self._stats['decreases'] += 1
+            elif error is None:
+                stable = self.latency is None or latency <= self.latency * LATENCY_TOLERANCE
+                self.latency = latency if self.latency is None else self.latency * 0.9 + latency * 0.1
+                # 上限已被用满时才增加，空闲时不会无限增长
+                if stable and self.active + 1 >= int(self.limit) and self.limit < self.maximum:
+                    before = int(self.limit)
+                    self.limit = min(self.maximum, self.limit + 1.0 / self.limit)
+                    if int(self.limit) > before:
+                        self._stats['increases'] += 1
+            self._cond.notify_all()
+
+    @contextmanager
+    def slot(self):
+        '''
+        在并发上限内执行一次 Earth Engine 调用
+        '''
+        self._acquire()
+        start = time.time()
+        error = None
+        try:
+            yield
+        except Exception as e:
+            error = e
+            raise
+        finally:
+            self._release(time.time() - start, error)
+
+    def get_stats(self):
+        with self._cond:
+            stats = {
+                'limit': int(self.limit),
+                'min': self.minimum,
+                'max': self.maximum,
+                'active': self.active,
+                'waiting': self.waiting,
+                'latency': round(self.latency, 3) if self.latency is not None else None
+            }
+            stats.update(self._stats)
+        stats['wait_seconds'] = round(stats['wait_seconds'], 3)
+        return stats
+
+
+limiters = {
+    'interactive': AdaptiveLimiter('interactive', INTERACTIVE_LIMIT, INTERACTIVE_MAX),
+    'aggregation': AdaptiveLimiter('aggregation', AGGREGATION_LIMIT, AGGREGATION_MAX)
+}
+register_metrics('ee_concurrency', lambda: {name: limiter.get_stats() for name, limiter in limiters.items()})
+
+
+def ee_call(lane, func, *args, **kwargs):
+    '''
+    在指定通道的并发上限内调用 func（'interactive' 或 'aggregation'）
+    暂时性错误按 ee_retry 的策略重试，退避等待期间不占用并发名额
+    '''
+    def attempt():
+        with limiters[lane].slot():
+            return func(*args, **kwargs)
+
+    return with_retry(attempt)
@@ -0,0 +1,236 @@
+import os
+import re
+import time
+import random
+import threading
+import contextvars
+from .metrics import register_metrics
+
+# Earth Engine 调用的重试策略：最多尝试次数、退避基数和上限（秒）、每个请求可用的重试次数
+RETRY_ATTEMPTS = int(os.environ.get('VGEE_EE_RETRY_ATTEMPTS', 4))
+RETRY_BASE = float(os.environ.get('VGEE_EE_RETRY_BASE', 0.5))
+RETRY_CAP = float(os.environ.get('VGEE_EE_RETRY_CAP', 8))
+RETRY_BUDGET = int(os.environ.get('VGEE_EE_RETRY_BUDGET', 20))
+# 熔断：连续失败次数达到阈值后在冷却时间（秒）内直接失败
+BREAKER_THRESHOLD = int(os.environ.get('VGEE_EE_BREAKER_THRESHOLD', 10))
+BREAKER_COOLDOWN = float(os.environ.get('VGEE_EE_BREAKER_COOLDOWN', 30))
+
+# 服务不可用错误信息中的关键字：服务端错误、网络中断，只有这类错误计入熔断
+OUTAGE_MARKERS = (
+    'internal error',
+    'backend error',
+    'service unavailable',
+    'connection reset',
+    'connection aborted',
+    'temporarily unavailable',
+)
+OUTAGE_STATUS = re.compile(r'\b(500|502|503|504)\b')
+# 其他可重试错误的关键字：限流（由 ee_concurrency 的 AIMD 并发控制处理）、计算超时
+RETRYABLE_MARKERS = OUTAGE_MARKERS + (
+    'too many concurrent aggregations',
+    'too many requests',
+    'rate limit',
+    'computation timed out',
+    'deadline exceeded',
+)
+RETRYABLE_STATUS = re.compile(r'\b(429|500|502|503|504)\b')
+
+
+class CircuitOpenError(Exception):
+    """
+    Earth Engine 连续失败、熔断期间直接失败，不再发起请求
+    """
+
+    def __init__(self, retry_after):
+        super().__init__(f"Earth Engine is unavailable, retry after {retry_after:.0f}s")
+        self.retry_after = retry_after
+
+
+def is_retryable(error):
+    '''
+    错误是否为暂时性错误（重试可能成功）；参数错误、表达式错误等其他错误直接失败
+    '''
+    if isinstance(error, CircuitOpenError):
+        return False
+    if isinstance(error, (ConnectionError, TimeoutError)):
+        return True
+    message = str(error).lower()
+    return any(marker in message for marker in RETRYABLE_MARKERS) or bool(RETRYABLE_STATUS.search(message))
+
+
+def is_outage(error):
+    '''
+    错误是否表示 Earth Engine 服务不可用（服务端错误、网络中断）
+    限流、计算超时等错误说明服务仍在响应，不计入熔断
+    '''
+    if isinstance(error, (ConnectionError, TimeoutError)):
+        return True
+    message = str(error).lower()
+    return any(marker in message for marker in OUTAGE_MARKERS) or bool(OUTAGE_STATUS.search(message))
+
+
+def backoff_delay(attempt):
+    '''
+    第 attempt 次重试前的等待时间：指数增长、有上限，并在 [0, 上限] 内随机（full jitter）
+    '''
+    return random.uniform(0, min(RETRY_CAP, RETRY_BASE * (2 ** attempt)))
+
+
+class RetryBudget:
+    """
+    单个请求可用的重试次数，请求内所有线程共享
+    """
+
+    def __init__(self, retries):
+        self._lock = threading.Lock()
+        self.remaining = retries
+
+    def take(self):
+        with self._lock:
+            if self.remaining <= 0:
+                return False
+            self.remaining -= 1
+            return True
+
+
+class CircuitBreaker:
+    """
+    熔断器：连续的服务不可用错误（见 is_outage）达到阈值后打开，冷却时间内所有调用直接失败；
+    冷却结束后放行一次试探调用，成功则关闭，失败则重新打开
+
+    Args:
+        threshold: 打开熔断的连续失败次数
+        cooldown: 冷却时间（秒）
+    """
+
+    def __init__(self, threshold, cooldown):
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self._lock = threading.Lock()
+        self.failures = 0
+        self.opened_at = None
+        self._probing = False
+        self.opens = 0
+
+    def before_call(self):
+        with self._lock:
+            if self.opened_at is None:
+                return
+            remaining = self.opened_at + self.cooldown - time.time()
+            if remaining > 0 or self._probing:
+                raise CircuitOpenError(max(remaining, 1))
+            # 冷却结束：只放行一个试探调用
+            self._probing = True
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+            self._probing = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            # 试探调用失败，或关闭状态下连续失败达到阈值：打开熔断
+            if self._probing or (self.opened_at is None and self.failures >= self.threshold):
+                self.opened_at = time.time()
+                self._probing = False
+                self.opens += 1
+
+    def state(self):
+        with self._lock:
+            if self.opened_at is None:
+                return 'closed'
+            if self._probing or time.time() >= self.opened_at + self.cooldown:
+                return 'half-open'
+            return 'open'
+
+
+breaker = CircuitBreaker(BREAKER_THRESHOLD, BREAKER_COOLDOWN)
+_current_budget = contextvars.ContextVar('ee_retry_budget', default=None)
+_stats_lock = threading.Lock()
+_stats = {'retries': 0, 'recovered': 0, 'exhausted': 0, 'budget_exhausted': 0, 'fatal': 0, 'rejected': 0}
+
+
+def _count(field):
+    with _stats_lock:
+        _stats[field] += 1
+
+
+def start_retry_budget(retries=RETRY_BUDGET):
+    '''
+    请求开始时创建本请求的重试预算，返回用于 end_retry_budget 的令牌
+    '''
+    return _current_budget.set(RetryBudget(retries))
+
+
+def end_retry_budget(token):
+    '''
+    请求结束时移除重试预算
+    '''
+    if token is None:
+        return
+    try:
+        _current_budget.reset(token)
+    except ValueError:
+        _current_budget.set(None)
+
+
+def with_retry(func):
+    '''
+    调用 func()，暂时性错误按指数退避加随机抖动重试
+    重试次数受单次调用的最多尝试次数和当前请求的重试预算限制；熔断打开时直接抛出 CircuitOpenError
+    '''
+    attempt = 0
+    while True:
+        try:
+            breaker.before_call()
+        except CircuitOpenError:
+            _count('rejected')
+            raise
+
+        try:
+            result = func()
+        except Exception as e:
+            if not is_retryable(e):
+                # 请求本身的错误不代表 Earth Engine 不可用
+                breaker.record_success()
+                _count('fatal')
+                raise
+            if is_outage(e):
+                breaker.record_failure()
+            else:
+                # 限流、计算超时说明服务仍在响应：不计入熔断，试探调用也视为成功
+                breaker.record_success()
+            attempt += 1
+            if attempt >= RETRY_ATTEMPTS:
+                _count('exhausted')
+                raise
+            budget = _current_budget.get()
+            if budget is not None and not budget.take():
+                _count('budget_exhausted')
+                raise
+            _count('retries')
+            delay = backoff_delay(attempt)
+            print(f"Ee_retry.py - retrying in {delay:.2f}s (attempt {attempt + 1}/{RETRY_ATTEMPTS}): {str(e)}")
+            time.sleep(delay)
+            continue
+
+        breaker.record_success()
+        if attempt:
+            _count('recovered')
+        return result
+
+
+def get_stats():
+    with _stats_lock:
+        stats = dict(_stats)
+    stats.update({
+        'breaker': breaker.state(),
+        'consecutive_failures': breaker.failures,
+        'breaker_opens': breaker.opens
+    })
+    return stats
+
+
+register_metrics('ee_retry', get_stats)
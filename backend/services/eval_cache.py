@@ -0,0 +1,231 @@
+import os
+import ee
+import json
+import copy
+import time
+import hashlib
+import threading
+from collections import OrderedDict
+from .metrics import register_metrics
+from .ee_concurrency import ee_call
+
+# 求值缓存配置：缓存总大小上限（MB），各类结果的过期时间（秒，0 表示不过期）
+EVAL_CACHE_MB = float(os.environ.get('VGEE_EVAL_CACHE_MB', 64))
+EVAL_TTLS = {
+    'metadata': float(os.environ.get('VGEE_EVAL_METADATA_TTL', 6 * 3600)),   # 波段、范围等图层元数据，资产可能在同一ID下重新上传
+    'info': float(os.environ.get('VGEE_EVAL_INFO_TTL', 3600)),           # 一般 getInfo 结果（统计值等）
+    'map_id': float(os.environ.get('VGEE_EVAL_MAP_ID_TTL', 1800)),       # getMapId 结果，服务器端会过期
+    'dataset': float(os.environ.get('VGEE_EVAL_DATASET_TTL', 86400)),    # 数据集目录信息
+}
+MAP_ID_SIZE = 1024   # getMapId 结果中含不可序列化的对象，按固定大小计
+
+
+class SingleFlight:
+    """
+    合并并发的相同请求：同一个键同时只执行一次，其他调用方等待并共享结果或异常
+    """
+
+    class _Call:
+        __slots__ = ('event', 'result', 'error')
+
+        def __init__(self):
+            self.event = threading.Event()
+            self.result = None
+            self.error = None
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}
+
+    def do(self, key, func):
+        '''
+        执行 func 或等待正在执行的相同调用，返回 (结果, 是否共享了其他调用的结果)
+        '''
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = self._Call()
+
+        if not leader:
+            call.event.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result, True
+
+        try:
+            call.result = func()
+            return call.result, False
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.event.set()
+
+    def in_flight(self):
+        with self._lock:
+            return len(self._calls)
+
+
+class EvalCache:
+    """
+    Earth Engine 求值结果缓存
+
+    - 键为序列化后的表达式图（ee.serializer）和调用参数的摘要，相同的计算只求值一次
+    - 按字节数限制总大小，超出时淘汰最久未使用的结果；每类结果有自己的过期时间
+    - 并发的相同求值合并为一次请求
+
+    Args:
+        max_bytes: 缓存总大小上限（字节）
+        ttls: 各类结果的过期时间（秒），0 表示不过期
+    """
+
+    def __init__(self, max_bytes, ttls):
+        self.max_bytes = max_bytes
+        self.ttls = ttls
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()   # 键 -> (值, 大小, 过期时间)
+        self._bytes = 0
+        self._flight = SingleFlight()
+        self._stats = {kind: {'hits': 0, 'misses': 0, 'shared': 0, 'errors': 0} for kind in ttls}
+        self.evictions = 0
+
+    @staticmethod
+    def make_key(kind, *parts):
+        '''
+        由结果类型和参数生成缓存键；Earth Engine 对象按序列化后的表达式图计算
+        '''
+        digest = hashlib.blake2b(digest_size=20)
+        digest.update(kind.encode('utf-8'))
+        for part in parts:
+            if isinstance(part, ee.ComputedObject):
+                part = ee.serializer.encode(part)
+            digest.update(json.dumps(part, sort_keys=True, default=str).encode('utf-8'))
+        return digest.hexdigest()
+
+    def _lookup(self, key):
+        with self._lock:
+            item = self._entries.get(key)
+            if item is None:
+                return False, None
+            value, size, expires = item
+            if expires and expires < time.time():
+                del self._entries[key]
+                self._bytes -= size
+                return False, None
+            self._entries.move_to_end(key)
+            return True, value
+
+    def _store(self, kind, key, value, size):
+        if self.max_bytes and size > self.max_bytes:
+            return
+        ttl = self.ttls.get(kind, 0)
+        expires = time.time() + ttl if ttl else 0
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._bytes -= old[1]
+            self._entries[key] = (value, size, expires)
+            self._bytes += size
+            while self.max_bytes and self._bytes > self.max_bytes and self._entries:
+                _, (_, old_size, _) = self._entries.popitem(last=False)
+                self._bytes -= old_size
+                self.evictions += 1
+
+    def _count(self, kind, field):
+        with self._lock:
+            self._stats.setdefault(kind, {'hits': 0, 'misses': 0, 'shared': 0, 'errors': 0})[field] += 1
+
+    def get_or_compute(self, kind, key, compute, size_of=None):
+        '''
+        获取缓存结果，未命中时调用 compute() 计算并缓存；None 结果不缓存
+        '''
+        found, value = self._lookup(key)
+        if found:
+            self._count(kind, 'hits')
+            return value
+
+        def load():
+            # 等待期间可能已被其他请求写入
+            found, value = self._lookup(key)
+            if found:
+                return value
+            value = compute()
+            if value is not None:
+                size = size_of(value) if size_of else len(json.dumps(value, default=str))
+                self._store(kind, key, value, size)
+            return value
+
+        try:
+            value, shared = self._flight.do(key, load)
+        except Exception:
+            self._count(kind, 'errors')
+            raise
+        self._count(kind, 'shared' if shared else 'misses')
+        return value
+
+    def lookup(self, kind, key):
+        '''
+        只查缓存不计算，返回 (是否命中, 结果)；用于批量求值时挑出需要请求的值
+        '''
+        found, value = self._lookup(key)
+        if found:
+            self._count(kind, 'hits')
+        return found, value
+
+    def store(self, kind, key, value):
+        '''
+        写入在缓存之外求得的结果（如批量求值），None 结果不缓存
+        '''
+        self._count(kind, 'misses')
+        if value is not None:
+            self._store(kind, key, value, len(json.dumps(value, default=str)))
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def get_stats(self):
+        with self._lock:
+            return {
+                'entries': len(self._entries),
+                'bytes': self._bytes,
+                'max_bytes': self.max_bytes,
+                'evictions': self.evictions,
+                'in_flight': self._flight.in_flight(),
+                'ttls': dict(self.ttls),
+                'kinds': copy.deepcopy(self._stats)
+            }
+
+
+eval_cache = EvalCache(int(EVAL_CACHE_MB * 1024 * 1024), EVAL_TTLS)
+register_metrics('eval_cache', eval_cache.get_stats)
+
+
+def cached_get_info(obj, kind='info', lane='interactive'):
+    '''
+    带缓存的 getInfo，返回结果的副本，调用方可以修改
+    lane: 未命中时请求所用的并发通道，统计类计算使用 'aggregation'
+    '''
+    key = EvalCache.make_key(kind, obj)
+    return copy.deepcopy(eval_cache.get_or_compute(kind, key, lambda: ee_call(lane, obj.getInfo)))
+
+
+def cached_get_map_id(image, vis_params=None):
+    '''
+    带缓存的 getMapId：相同的表达式和可视化参数在过期前复用同一个瓦片地址
+    '''
+    key = EvalCache.make_key('map_id', image, vis_params or {})
+    return eval_cache.get_or_compute('map_id', key, lambda: ee_call('interactive', image.getMapId, vis_params),
+                                     size_of=lambda _: MAP_ID_SIZE)
+
+
+def cached_call(kind, key_parts, func):
+    '''
+    缓存任意函数的结果（如数据集目录查询），key_parts 为可 JSON 序列化的参数
+    '''
+    key = EvalCache.make_key(kind, *key_parts)
+    return copy.deepcopy(eval_cache.get_or_compute(kind, key, func))
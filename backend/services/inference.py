@@ -0,0 +1,343 @@
+from samgeo import SamGeo
+from samgeo.text_sam import LangSAM
+from .model_pool import ModelPool
+from .metrics import register_metrics
+import threading
+from collections import OrderedDict
+import os
+import numpy as np
+import torch
+from PIL import Image
+
+# 模型推理：只依赖模型和数组，可在 Web 进程或推理工作进程中运行
+# 本模块导入 torch 和 samgeo，开销较大，只在首次推理或预加载时导入
+print('CUDA available', torch.cuda.is_available())
+print("CUDA version:", torch.version.cuda)
+
+# 模型池配置：每种模型最多常驻的实例数，以及等待空闲实例的超时时间
+MODEL_POOL_SIZE = int(os.environ.get('VGEE_MODEL_POOL_SIZE', 1))
+MODEL_LEASE_TIMEOUT = float(os.environ.get('VGEE_MODEL_LEASE_TIMEOUT', 0)) or None
+
+# CPU 推理配置
+SAM_MODEL_TYPE = os.environ.get('VGEE_SAM_MODEL_TYPE', 'vit_h')             # 编码器：vit_h / vit_l / vit_b
+SAM_QUANTIZE = os.environ.get('VGEE_SAM_QUANTIZE') == '1'                   # 线性层 int8 动态量化（仅 CPU）
+TORCH_THREADS = int(os.environ.get('VGEE_TORCH_THREADS', 0))                # 算子内线程数，0 表示自动
+TORCH_INTEROP_THREADS = int(os.environ.get('VGEE_TORCH_INTEROP_THREADS', 1))
+RESERVED_CORES = int(os.environ.get('VGEE_RESERVED_CORES', 1))              # 留给 Web 进程的核数
+
+_torch_configured = False
+_torch_lock = threading.Lock()
+
+def configure_torch_threads(threads=None, interop_threads=None):
+    '''
+    设置本进程的 torch 线程数，只在首次加载模型时生效
+    自动模式下将保留 RESERVED_CORES 个核后的剩余核平分给各推理进程
+    '''
+    global _torch_configured
+    with _torch_lock:
+        if _torch_configured:
+            return
+        _torch_configured = True
+
+        if threads is None:
+            threads = TORCH_THREADS
+        if threads <= 0:
+            workers = max(1, int(os.environ.get('VGEE_INFERENCE_WORKERS', 0)))
+            threads = max(1, ((os.cpu_count() or 2) - RESERVED_CORES) // workers)
+        torch.set_num_threads(threads)
+
+        interop_threads = TORCH_INTEROP_THREADS if interop_threads is None else interop_threads
+        try:
+            torch.set_num_interop_threads(interop_threads)
+        except RuntimeError:
+            # 已经开始并行计算后不能再修改
+            pass
+        print(f"Inference.py - torch threads: {torch.get_num_threads()}, "
+              f"interop threads: {torch.get_num_interop_threads()}")
+
+def quantize_sam(model):
+    '''
+    对 SamGeo / LangSAM 中 SAM 网络的线性层做 int8 动态量化（原地），GPU 上跳过
+    '''
+    if not str(getattr(model, 'device', 'cpu')).startswith('cpu'):
+        print("Inference.py - quantization skipped on non-CPU device")
+        return model
+    predictor = getattr(model, 'predictor', None) or getattr(model, 'sam', None)
+    network = getattr(predictor, 'model', None)
+    if network is None:
+        print(f"Inference.py - no SAM network found on {type(model).__name__}, quantization skipped")
+        return model
+    torch.quantization.quantize_dynamic(network, {torch.nn.Linear}, dtype=torch.qint8, inplace=True)
+    return model
+
+def load_sam(model_type=None, quantize=None):
+    '''
+    按 CPU 推理配置加载点提示分割用的 SamGeo
+    '''
+    configure_torch_threads()
+    model = SamGeo(model_type=model_type or SAM_MODEL_TYPE, automatic=False, sam_kwargs=None)
+    quantize = SAM_QUANTIZE if quantize is None else quantize
+    if quantize:
+        quantize_sam(model)
+    return model
+
+def load_lang_sam(model_type=None, quantize=None):
+    '''
+    按 CPU 推理配置加载文本提示分割用的 LangSAM
+    '''
+    configure_torch_threads()
+    model = LangSAM(model_type=model_type or SAM_MODEL_TYPE)
+    quantize = SAM_QUANTIZE if quantize is None else quantize
+    if quantize:
+        quantize_sam(model)
+    return model
+
+lang_sam_pool = ModelPool('LangSAM', load_lang_sam, MODEL_POOL_SIZE, MODEL_LEASE_TIMEOUT)
+sam_pool = ModelPool('SAM', load_sam, MODEL_POOL_SIZE, MODEL_LEASE_TIMEOUT)
+
+register_metrics('model_pool', lambda: {
+    'lang_sam': lang_sam_pool.get_stats(),
+    'sam': sam_pool.get_stats(),
+    'profile': {
+        'model_type': SAM_MODEL_TYPE,
+        'quantize': SAM_QUANTIZE,
+        'threads': torch.get_num_threads(),
+        'interop_threads': torch.get_num_interop_threads()
+    }
+})
+
+class EmbeddingMiss(Exception):
+    """未提供图像且嵌入缓存未命中"""
+
+class EmbeddingCache:
+    """
+    SAM 图像嵌入缓存：按字节数限制的 LRU
+    键为 (图层ID, 显示最小值, 显示最大值, 缩略图尺寸)，同一图层上追加或移动提示点时
+    直接复用嵌入，只运行轻量的掩码解码器
+    """
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()  # key -> (embedding, nbytes)
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @staticmethod
+    def capture(predictor):
+        '''
+        从 SamPredictor 中取出当前图像的嵌入
+        '''
+        features = predictor.features
+        return {
+            'features': features,
+            'original_size': predictor.original_size,
+            'input_size': predictor.input_size,
+            'nbytes': features.element_size() * features.nelement()
+        }
+
+    @staticmethod
+    def restore(predictor, embedding):
+        '''
+        将缓存的嵌入写回 SamPredictor，跳过图像编码器
+        '''
+        predictor.reset_image()
+        predictor.features = embedding['features']
+        predictor.original_size = embedding['original_size']
+        predictor.input_size = embedding['input_size']
+        predictor.is_image_set = True
+
+    def contains(self, key):
+        with self._lock:
+            return key in self._entries
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, key, embedding):
+        nbytes = embedding['nbytes']
+        if nbytes > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._entries:
+                self._bytes -= self._entries.pop(key)[1]
+            self._entries[key] = (embedding, nbytes)
+            self._bytes += nbytes
+            # 超出字节上限时淘汰最久未使用的嵌入
+            while self._bytes > self.max_bytes and self._entries:
+                _, (_, evicted_bytes) = self._entries.popitem(last=False)
+                self._bytes -= evicted_bytes
+                self.evictions += 1
+
+    def invalidate_layer(self, layer_id):
+        '''
+        图层变更时移除该图层的所有嵌入
+        '''
+        with self._lock:
+            for key in [k for k in self._entries if k[0] == layer_id]:
+                self._bytes -= self._entries.pop(key)[1]
+
+    def get_stats(self):
+        with self._lock:
+            return {
+                'entries': len(self._entries),
+                'bytes': self._bytes,
+                'max_bytes': self.max_bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions
+            }
+
+
+# SAM 嵌入缓存，默认最多占用 256MB
+embedding_cache = EmbeddingCache(int(os.environ.get('VGEE_EMBEDDING_CACHE_MB', 256)) * 1024 * 1024)
+register_metrics('embedding_cache', embedding_cache.get_stats)
+
+def warmup_models():
+    '''
+    依次加载所有模型，单个模型失败不影响其他模型
+    '''
+    for pool in (lang_sam_pool, sam_pool):
+        try:
+            pool.warmup()
+        except Exception as e:
+            print(f"Error preloading model {pool.name}: {str(e)}")
+
+def match_prompt(phrase, prompts):
+    '''
+    将 GroundingDINO 返回的短语映射回提示序号，无法对应时返回 -1
+    '''
+    if len(prompts) == 1:
+        return 0
+    phrase = (phrase or '').lower().strip()
+    if not phrase:
+        return -1
+    normalized = [p.lower().strip() for p in prompts]
+    if phrase in normalized:
+        return normalized.index(phrase)
+    # 短语可能只包含提示的一部分，或同时包含相邻提示的词
+    for i, prompt in enumerate(normalized):
+        if prompt in phrase or phrase in prompt:
+            return i
+    return -1
+
+def predict_text_masks(sam, image, prompts, threshold):
+    '''
+    使用已租借的 LangSAM 模型执行文本提示分割
+    多个提示合并为一个描述（"house . road . water"），只运行一次 GroundingDINO 和一次 SAM 图像编码
+    Args:
+        image: 缩略图 RGB 数组
+        prompts: 提示列表
+    Returns:
+        list: [(提示序号, 掩膜数组), ...]
+    '''
+    if isinstance(image, np.ndarray):
+        image = Image.fromarray(image)
+    # 模型实例在请求间复用：没有检测到目标时 predict 提前返回、不更新这些属性，先清空以免返回上一次的结果
+    sam.masks = sam.boxes = sam.phrases = None
+    results = sam.predict(
+        image=image,
+        text_prompt=' . '.join(prompts),
+        box_threshold=threshold,
+        text_threshold=threshold,
+        return_results=True
+    )
+    if not results:
+        return []
+    masks, boxes, phrases = results[0], results[1], results[2]
+    if masks is None or boxes is None or len(boxes) == 0:
+        return []
+    phrases = phrases or [''] * len(masks)
+    return [
+        (match_prompt(phrase, prompts), mask.cpu().numpy())
+        for phrase, mask in zip(phrases, masks)
+    ]
+
+def predict_point_mask(sam, image, point_coords, point_labels, cache_key=None):
+    '''
+    使用已租借的 SAM 模型执行点提示分割，返回得分最高的掩膜
+    image 为 None 且未命中嵌入缓存时抛出 EmbeddingMiss，由调用方补充图像后重试
+    '''
+    embedding = embedding_cache.get(cache_key) if cache_key is not None else None
+    if embedding is not None:
+        # 命中缓存：只运行掩码解码器
+        EmbeddingCache.restore(sam.predictor, embedding)
+    else:
+        if image is None:
+            raise EmbeddingMiss(cache_key)
+        sam.set_image(image)
+        if cache_key is not None:
+            embedding_cache.put(cache_key, EmbeddingCache.capture(sam.predictor))
+
+    masks, scores, logits = sam.predictor.predict(
+        point_coords=point_coords,
+        point_labels=point_labels
+    )
+    if masks is None or len(masks) == 0:
+        return None
+
+    # 找到得分最高的掩码
+    return masks[np.argmax(scores)]
+
+def run_inference(kind, images, params):
+    '''
+    在当前进程中执行一批推理，每批只租借一次模型
+    Args:
+        kind: 'text' 文本提示分割，'point' 点提示分割
+        images: RGB 数组列表，点提示分割中可为 None（依赖嵌入缓存）
+        params: text: {'prompts', 'threshold'}
+                point: {'items': [{'point_coords', 'point_labels', 'cache_key'}, ...]}，与 images 一一对应
+    Returns:
+        list: 每张图像一个结果字典
+              text: {'masks': (N, H, W) uint8 数组, 'classes': (N,) 提示序号数组}
+              point: {'mask': (H, W) uint8 数组}，无结果时为 {}，缓存未命中时为 {'miss': True}
+    '''
+    with torch.inference_mode():
+        return _run_inference(kind, images, params)
+
+def _run_inference(kind, images, params):
+    results = []
+    if kind == 'text':
+        with lang_sam_pool.lease() as sam:
+            for image in images:
+                detections = [
+                    (index, mask) for index, mask in
+                    predict_text_masks(sam, image, params['prompts'], params['threshold'])
+                    if index >= 0
+                ]
+                if detections:
+                    results.append({
+                        'masks': np.stack([mask for _, mask in detections]).astype(np.uint8),
+                        'classes': np.array([index for index, _ in detections], dtype=np.int32)
+                    })
+                else:
+                    results.append({
+                        'masks': np.zeros((0,) + image.shape[:2], dtype=np.uint8),
+                        'classes': np.zeros(0, dtype=np.int32)
+                    })
+    elif kind == 'point':
+        with sam_pool.lease() as sam:
+            for image, item in zip(images, params['items']):
+                try:
+                    mask = predict_point_mask(
+                        sam, image,
+                        np.asarray(item['point_coords']),
+                        np.asarray(item['point_labels']),
+                        item.get('cache_key')
+                    )
+                except EmbeddingMiss:
+                    results.append({'miss': True})
+                    continue
+                results.append({} if mask is None else {'mask': mask.astype(np.uint8)})
+    else:
+        raise ValueError(f"Unknown inference kind: {kind}")
+    return results
@@ -0,0 +1,162 @@
+import os
+import math
+import time
+import threading
+from collections import deque
+from contextlib import contextmanager
+from .metrics import register_metrics
+
+# 推理调度配置：每种模型同时执行的推理数、排队上限、排队超时时间（秒）
+INFERENCE_MAX_IN_FLIGHT = int(os.environ.get('VGEE_INFERENCE_MAX_IN_FLIGHT', 2))
+INFERENCE_MAX_QUEUE = int(os.environ.get('VGEE_INFERENCE_MAX_QUEUE', 8))
+INFERENCE_QUEUE_TIMEOUT = float(os.environ.get('VGEE_INFERENCE_QUEUE_TIMEOUT', 120))
+
+
+class QueueFullError(Exception):
+    """
+    推理队列已满或排队超时，路由应返回 503 并带上 Retry-After
+    """
+
+    def __init__(self, message, retry_after):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class InferenceScheduler:
+    """
+    推理调度器：限制同一模型同时执行的推理数，超出的推理按到达顺序排队，
+    每个排队的推理有自己的截止时间，队列满时立即拒绝；名额在每次模型调用时获取（见 submit_inference），
+    多图层请求的各图层分别排队
+
+    Args:
+        name: 模型类型名称，用于日志和指标
+        max_in_flight: 最多同时执行的推理数
+        max_queue: 最多排队的推理数
+        queue_timeout: 排队等待的最长时间（秒）
+    """
+
+    def __init__(self, name, max_in_flight, max_queue, queue_timeout):
+        self.name = name
+        self.max_in_flight = max(1, int(max_in_flight))
+        self.max_queue = max(0, int(max_queue))
+        self.queue_timeout = queue_timeout
+
+        self._cond = threading.Condition()
+        self._queue = deque()   # 排队中的请求凭据，队首优先
+        self._in_flight = 0
+
+        # 统计信息
+        self.admitted = 0
+        self.rejected = 0
+        self.timeouts = 0
+        self._queue_max = 0
+        self._wait_total = 0.0
+        self._wait_max = 0.0
+        self._service_total = 0.0
+        self._completed = 0
+
+    def _retry_after(self):
+        '''
+        按平均执行时间估算队列清空需要的秒数
+        '''
+        service_avg = self._service_total / self._completed if self._completed else 10.0
+        return max(1, math.ceil(service_avg * (len(self._queue) + 1) / self.max_in_flight))
+
+    @contextmanager
+    def slot(self, timeout=None):
+        '''
+        获取一个执行名额，退出时自动释放
+        Args:
+            timeout: 排队超时时间（秒），默认使用调度器的 queue_timeout
+        '''
+        timeout = self.queue_timeout if timeout is None else timeout
+        start = time.perf_counter()
+        deadline = start + timeout
+
+        with self._cond:
+            if self._in_flight >= self.max_in_flight or self._queue:
+                if len(self._queue) >= self.max_queue:
+                    self.rejected += 1
+                    raise QueueFullError(f"{self.name} inference queue is full", self._retry_after())
+
+                ticket = object()
+                self._queue.append(ticket)
+                self._queue_max = max(self._queue_max, len(self._queue))
+                try:
+                    # 只有排在队首且有空闲名额时才能执行，保证先到先得
+                    while self._queue[0] is not ticket or self._in_flight >= self.max_in_flight:
+                        remaining = deadline - time.perf_counter()
+                        if remaining <= 0:
+                            self.timeouts += 1
+                            raise QueueFullError(f"{self.name} inference queue wait timed out",
+                                                 self._retry_after())
+                        self._cond.wait(remaining)
+                finally:
+                    self._queue.remove(ticket)
+                    self._cond.notify_all()
+
+            self._in_flight += 1
+            wait_time = time.perf_counter() - start
+            self.admitted += 1
+            self._wait_total += wait_time
+            self._wait_max = max(self._wait_max, wait_time)
+
+        if wait_time > 0.001:
+            print(f"Inference_scheduler.py - {self.name} admitted after {wait_time:.3f}s in queue")
+
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._in_flight -= 1
+                self._service_total += time.perf_counter() - started
+                self._completed += 1
+                self._cond.notify_all()
+
+    def get_stats(self):
+        '''
+        获取调度器统计信息
+        '''
+        with self._cond:
+            return {
+                'max_in_flight': self.max_in_flight,
+                'max_queue': self.max_queue,
+                'in_flight': self._in_flight,
+                'queue_depth': len(self._queue),
+                'queue_depth_max': self._queue_max,
+                'admitted': self.admitted,
+                'rejected': self.rejected,
+                'timeouts': self.timeouts,
+                'wait_avg': round(self._wait_total / self.admitted, 4) if self.admitted else 0.0,
+                'wait_max': round(self._wait_max, 4),
+                'service_avg': round(self._service_total / self._completed, 4) if self._completed else 0.0
+            }
+
+
+def _scheduler(name):
+    prefix = f'VGEE_{name.upper()}_'
+    return InferenceScheduler(
+        name,
+        int(os.environ.get(prefix + 'MAX_IN_FLIGHT', INFERENCE_MAX_IN_FLIGHT)),
+        int(os.environ.get(prefix + 'MAX_QUEUE', INFERENCE_MAX_QUEUE)),
+        float(os.environ.get(prefix + 'QUEUE_TIMEOUT', INFERENCE_QUEUE_TIMEOUT))
+    )
+
+
+# 每种模型一个调度器：text 对应 LangSAM，point 对应 SAM
+schedulers = {
+    'text': _scheduler('text'),
+    'point': _scheduler('point')
+}
+
+register_metrics('inference_scheduler', lambda: {
+    name: scheduler.get_stats() for name, scheduler in schedulers.items()
+})
+
+
+def inference_slot(kind, timeout=None):
+    '''
+    获取指定模型类型的执行名额
+    '''
+    return schedulers[kind].slot(timeout)
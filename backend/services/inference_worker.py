@@ -0,0 +1,453 @@
+import os
+import sys
+import time
+import atexit
+import queue
+import itertools
+import threading
+import traceback
+import multiprocessing as mp
+from multiprocessing import shared_memory
+from concurrent.futures import Future, TimeoutError as FutureTimeoutError
+import numpy as np
+from .metrics import register_metrics
+from .inference_scheduler import inference_slot
+
+# 推理工作进程配置：进程数（0 表示在 Web 进程内推理）、单个任务超时时间（秒）
+INFERENCE_WORKERS = int(os.environ.get('VGEE_INFERENCE_WORKERS', 0))
+INFERENCE_TIMEOUT = float(os.environ.get('VGEE_INFERENCE_TIMEOUT', 600)) or None
+
+SHARED_TAG = '__shm__'
+
+
+def _share(array):
+    '''
+    将数组写入新建的共享内存块，返回 (共享内存, 描述符)
+    描述符只包含名称、形状和类型，随任务消息传递，数组本身不经过 pickle
+    '''
+    array = np.ascontiguousarray(array)
+    shm = shared_memory.SharedMemory(create=True, size=max(array.nbytes, 1))
+    np.ndarray(array.shape, dtype=array.dtype, buffer=shm.buf)[...] = array
+    return shm, (SHARED_TAG, shm.name, array.shape, array.dtype.str)
+
+
+def _is_shared(value):
+    return isinstance(value, tuple) and len(value) == 4 and value[0] == SHARED_TAG
+
+
+def _read_shared(desc, unlink=False):
+    '''
+    从共享内存块读取数组到本进程内存，读取后立即解除映射
+    '''
+    _, name, shape, dtype = desc
+    shm = shared_memory.SharedMemory(name=name)
+    try:
+        return np.ndarray(shape, dtype=dtype, buffer=shm.buf).copy()
+    finally:
+        shm.close()
+        if unlink:
+            shm.unlink()
+
+
+def _release_shared(desc):
+    '''
+    释放无人读取的共享内存块（如任务已超时）
+    '''
+    try:
+        shm = shared_memory.SharedMemory(name=desc[1])
+        shm.close()
+        shm.unlink()
+    except FileNotFoundError:
+        pass
+
+
+def _encode_results(results):
+    '''
+    将结果中的数组写入共享内存，返回 (可传递的结果, 共享内存列表)
+    '''
+    encoded, handles = [], []
+    for result in results:
+        item = {}
+        for key, value in result.items():
+            if isinstance(value, np.ndarray):
+                shm, value = _share(value)
+                handles.append(shm)
+            item[key] = value
+        encoded.append(item)
+    return encoded, handles
+
+
+def _worker_main(worker_id, jobs, replies):
+    '''
+    推理工作进程主循环：模型只在本进程中加载，Web 进程不再承担推理的 GIL 和内存开销
+    '''
+    start = time.perf_counter()
+    from . import inference
+    import_time = time.perf_counter() - start
+
+    print(f"Inference_worker.py - worker {worker_id} started (pid {os.getpid()})")
+    replies.put({'event': 'ready', 'worker': worker_id, 'import_time': import_time})
+    while True:
+        job = jobs.get()
+        if job is None:
+            break
+        if job['kind'] == 'invalidate':
+            inference.embedding_cache.invalidate_layer(job['layer_id'])
+            continue
+        if job['kind'] == 'warmup':
+            inference.warmup_models()
+            replies.put({'event': 'warm', 'worker': worker_id})
+            continue
+
+        reply = {'id': job['id']}
+        handles = []
+        try:
+            images = [None if desc is None else _read_shared(desc) for desc in job['images']]
+            reply['results'], handles = _encode_results(
+                inference.run_inference(job['kind'], images, job['params'])
+            )
+        except Exception as e:
+            traceback.print_exc()
+            reply['error'] = f"{type(e).__name__}: {str(e)}"
+        replies.put(reply)
+        # 共享内存块由 Web 进程读取后释放，这里只解除本进程的映射
+        for shm in handles:
+            shm.close()
+
+
+class InferenceWorkerPool:
+    """
+    推理工作进程池：任务消息经队列传递，图像和掩膜经共享内存传递
+
+    Args:
+        size: 工作进程数量
+        timeout: 单个任务的超时时间（秒），None 表示一直等待
+    """
+
+    def __init__(self, size, timeout=None):
+        self.size = max(1, int(size))
+        self.timeout = timeout
+
+        self._ctx = mp.get_context('spawn')
+        self._replies = self._ctx.Queue()
+        self._workers = [None] * self.size   # (进程, 任务队列)
+        self._pending = {}                    # 任务ID -> (工作进程序号, Future)
+        self._lock = threading.Lock()
+        self._ids = itertools.count()
+        self._closed = False
+        self._states = ['starting'] * self.size   # 各工作进程状态：starting / ready / warm
+        self._import_times = [None] * self.size
+
+        # 统计信息
+        self.submitted = 0
+        self.completed = 0
+        self.failed = 0
+        self.timeouts = 0
+        self.restarts = 0
+        self._latency_total = 0.0
+
+        with self._lock:
+            for index in range(self.size):
+                self._start_worker(index)
+        threading.Thread(target=self._collect, name='inference-replies', daemon=True).start()
+
+    def _start_worker(self, index):
+        jobs = self._ctx.Queue()
+        process = self._ctx.Process(
+            target=_worker_main,
+            args=(index, jobs, self._replies),
+            name=f'inference-worker-{index}',
+            daemon=True
+        )
+        process.start()
+        self._workers[index] = (process, jobs)
+        self._states[index] = 'starting'
+
+    def _pick_worker(self, affinity):
+        '''
+        有亲和键（如图层ID）时固定分配到同一进程以复用其嵌入缓存，否则选择任务最少的进程
+        '''
+        if affinity is not None:
+            return hash(affinity) % self.size
+        load = [0] * self.size
+        for index, _ in self._pending.values():
+            load[index] += 1
+        return load.index(min(load))
+
+    def submit(self, kind, images, params, affinity=None):
+        '''
+        提交一批推理任务并等待结果，参数和返回值与 inference.run_inference 相同
+        '''
+        shared, descs = [], []
+        try:
+            for image in images:
+                if image is None:
+                    descs.append(None)
+                    continue
+                shm, desc = _share(image)
+                shared.append(shm)
+                descs.append(desc)
+
+            future = Future()
+            start = time.perf_counter()
+            with self._lock:
+                job_id = next(self._ids)
+                index = self._pick_worker(affinity)
+                self._pending[job_id] = (index, future)
+                self.submitted += 1
+                jobs = self._workers[index][1]
+            jobs.put({'id': job_id, 'kind': kind, 'images': descs, 'params': params})
+
+            try:
+                reply = future.result(self.timeout)
+            except FutureTimeoutError:
+                with self._lock:
+                    timed_out = self._pending.pop(job_id, None) is not None
+                    self.timeouts += timed_out
+                if timed_out:
+                    raise TimeoutError(f"Inference job {job_id} timed out")
+                # 结果恰好在超时时到达
+                reply = future.result()
+        finally:
+            # 工作进程已读取完输入，释放输入共享内存
+            for shm in shared:
+                shm.close()
+                shm.unlink()
+
+        with self._lock:
+            self._latency_total += time.perf_counter() - start
+            if 'error' in reply:
+                self.failed += 1
+            else:
+                self.completed += 1
+        if 'error' in reply:
+            raise RuntimeError(f"Inference worker failed: {reply['error']}")
+
+        return [
+            {key: _read_shared(value, unlink=True) if _is_shared(value) else value
+             for key, value in result.items()}
+            for result in reply['results']
+        ]
+
+    def broadcast(self, message):
+        '''
+        向所有工作进程发送控制消息（失效嵌入、预加载模型）
+        '''
+        with self._lock:
+            queues = [jobs for _, jobs in self._workers]
+        for jobs in queues:
+            jobs.put(message)
+
+    def _collect(self):
+        '''
+        后台线程：接收工作进程的结果并唤醒对应的请求，同时检查进程存活
+        '''
+        while not self._closed:
+            try:
+                reply = self._replies.get(timeout=1)
+            except queue.Empty:
+                reply = None
+            self._check_workers()
+            if reply is None:
+                continue
+            if 'event' in reply:
+                # 工作进程状态事件
+                with self._lock:
+                    self._states[reply['worker']] = reply['event']
+                    if reply['event'] == 'ready':
+                        self._import_times[reply['worker']] = round(reply['import_time'], 3)
+                continue
+
+            with self._lock:
+                entry = self._pending.pop(reply['id'], None)
+            if entry is None:
+                # 请求已超时，释放结果占用的共享内存
+                for result in reply.get('results', []):
+                    for value in result.values():
+                        if _is_shared(value):
+                            _release_shared(value)
+                continue
+            entry[1].set_result(reply)
+
+    def _check_workers(self):
+        '''
+        重启意外退出的工作进程，并让其未完成的任务立即失败
+        '''
+        with self._lock:
+            if self._closed:
+                return
+            lost = []
+            for index, (process, _) in enumerate(self._workers):
+                if process.is_alive():
+                    continue
+                print(f"Inference_worker.py - worker {index} exited with code {process.exitcode}, restarting")
+                for job_id in [j for j, (i, _) in self._pending.items() if i == index]:
+                    lost.append((self._pending.pop(job_id)[1], process.exitcode))
+                self.restarts += 1
+                self._start_worker(index)
+        for future, exitcode in lost:
+            future.set_result({'error': f"worker exited with code {exitcode}"})
+
+    def shutdown(self):
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+            workers = list(self._workers)
+        for process, jobs in workers:
+            jobs.put(None)
+        for process, _ in workers:
+            process.join(timeout=5)
+            if process.is_alive():
+                process.terminate()
+
+    def get_status(self):
+        '''
+        获取工作进程就绪状态
+        '''
+        with self._lock:
+            return [
+                {'state': state, 'import_time': import_time}
+                for state, import_time in zip(self._states, self._import_times)
+            ]
+
+    def get_stats(self):
+        with self._lock:
+            finished = self.completed + self.failed
+            return {
+                'size': self.size,
+                'alive': sum(1 for process, _ in self._workers if process.is_alive()),
+                'in_flight': len(self._pending),
+                'submitted': self.submitted,
+                'completed': self.completed,
+                'failed': self.failed,
+                'timeouts': self.timeouts,
+                'restarts': self.restarts,
+                'latency_avg': round(self._latency_total / finished, 4) if finished else 0.0
+            }
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_worker_pool():
+    '''
+    获取推理工作进程池，未启用（VGEE_INFERENCE_WORKERS=0）时返回 None
+    '''
+    global _pool
+    if INFERENCE_WORKERS <= 0:
+        return None
+    with _pool_lock:
+        if _pool is None:
+            _pool = InferenceWorkerPool(INFERENCE_WORKERS, INFERENCE_TIMEOUT)
+            atexit.register(_pool.shutdown)
+            register_metrics('inference_worker', _pool.get_stats)
+    return _pool
+
+
+# 本进程内推理栈（torch、samgeo）的加载状态：cold / loading / ready / error
+_stack = {'state': 'cold', 'import_time': None, 'error': None}
+_stack_lock = threading.Lock()
+
+
+def load_inference_module():
+    '''
+    在本进程导入推理模块（torch、samgeo 等），记录加载耗时和状态
+    '''
+    with _stack_lock:
+        if _stack['state'] != 'ready':
+            _stack['state'] = 'loading'
+            start = time.perf_counter()
+            try:
+                from . import inference
+            except Exception as e:
+                _stack.update(state='error', error=str(e))
+                raise
+            _stack.update(state='ready', import_time=round(time.perf_counter() - start, 3), error=None)
+            print(f"Inference_worker.py - inference stack loaded in {_stack['import_time']}s")
+    return sys.modules[f'{__package__}.inference']
+
+
+def submit_inference(kind, images, params, affinity=None):
+    '''
+    执行一批推理：启用工作进程时提交到工作进程，否则在当前进程中运行
+    每批推理单独获取该模型的执行名额，多图层请求的各图层与其他请求一起排队
+    '''
+    with inference_slot(kind):
+        pool = get_worker_pool()
+        if pool is None:
+            return load_inference_module().run_inference(kind, images, params)
+        return pool.submit(kind, images, params, affinity)
+
+
+def invalidate_layer(layer_id):
+    '''
+    图层变更监听器：失效所有进程中该图层的嵌入缓存
+    '''
+    if _pool is not None:
+        _pool.broadcast({'kind': 'invalidate', 'layer_id': layer_id})
+    inference = sys.modules.get(f'{__package__}.inference')
+    if inference is not None:
+        inference.embedding_cache.invalidate_layer(layer_id)
+
+
+def preload_inference(models=False):
+    '''
+    在后台预加载推理栈，避免首个请求承担导入时间；models 为 True 时同时加载模型权重
+    启用工作进程时由各工作进程自行导入，Web 进程不导入 torch
+    '''
+    pool = get_worker_pool()
+    if pool is not None:
+        if models:
+            pool.broadcast({'kind': 'warmup'})
+        return
+
+    def _load():
+        try:
+            inference = load_inference_module()
+        except Exception as e:
+            print(f"Error preloading inference stack: {str(e)}")
+            return
+        if models:
+            inference.warmup_models()
+
+    threading.Thread(target=_load, name='inference-preload', daemon=True).start()
+
+
+def get_inference_status():
+    '''
+    获取推理栈就绪状态，供 /ai/status 使用
+    '''
+    if INFERENCE_WORKERS > 0:
+        workers = _pool.get_status() if _pool is not None else []
+        states = {worker['state'] for worker in workers}
+        if not workers:
+            state = 'cold'
+        elif states == {'warm'}:
+            state = 'warm'
+        elif states <= {'ready', 'warm'}:
+            state = 'ready'
+        else:
+            state = 'loading'
+        return {
+            'mode': 'workers',
+            'state': state,
+            'ready': state in ('ready', 'warm'),
+            'workers': workers
+        }
+
+    status = {
+        'mode': 'local',
+        'state': _stack['state'],
+        'ready': _stack['state'] == 'ready',
+        'import_time': _stack['import_time'],
+        'error': _stack['error']
+    }
+    inference = sys.modules.get(f'{__package__}.inference')
+    if status['ready'] and inference is not None:
+        status['models'] = {
+            'lang_sam': inference.lang_sam_pool.get_stats()['loaded'] > 0,
+            'sam': inference.sam_pool.get_stats()['loaded'] > 0
+        }
+    return status
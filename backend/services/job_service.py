@@ -0,0 +1,287 @@
+import os
+import time
+import uuid
+import threading
+import contextvars
+from collections import OrderedDict
+from functools import wraps
+from flask import request, jsonify, make_response, current_app
+from tools.parallel_processor import get_executor
+from .workspace import WORKSPACE_HEADER, current_workspace, activate_workspace, release_workspace
+from .ee_retry import start_retry_budget, end_retry_budget
+from .disconnect import disconnect_checker
+from .metrics import register_metrics
+
+# 后台任务配置：结束后结果保留时间（秒）、同时存在的未结束任务数上限
+JOB_TTL = float(os.environ.get('VGEE_JOB_TTL', 3600))
+MAX_PENDING_JOBS = int(os.environ.get('VGEE_MAX_PENDING_JOBS', 100))
+# 后台任务中并行处理的整体超时（秒），0 表示不限，由任务取消停止
+JOB_TIMEOUT = float(os.environ.get('VGEE_JOB_TIMEOUT', 0))
+
+FINISHED_STATES = ('succeeded', 'failed', 'cancelled')
+
+# 当前线程正在执行的后台任务，供并行处理上报进度和检查取消
+_current_job = contextvars.ContextVar('current_job', default=None)
+
+
+class JobLimitError(Exception):
+    """
+    未结束的后台任务过多
+    """
+    pass
+
+
+class Job:
+    """
+    后台任务：状态为 queued / running / succeeded / failed / cancelled
+
+    Args:
+        kind: 任务类型（工具名称）
+        workspace_id: 提交任务的工作区，只有该工作区可以查询和取消
+    """
+
+    def __init__(self, kind, workspace_id):
+        self.id = uuid.uuid4().hex
+        self.kind = kind
+        self.workspace_id = workspace_id
+        self.status = 'queued'
+        self.progress = {'done': 0, 'total': 0}
+        self.result = None          # 工具接口的 JSON 响应
+        self.http_status = None     # 工具接口的 HTTP 状态码
+        self.error = None
+        self.created = time.time()
+        self.started = None
+        self.finished = None
+        self.version = 0            # 每次状态变化递增，用于推送更新
+        self._cancel = threading.Event()
+        self._changed = threading.Condition()
+
+    def update(self, **fields):
+        with self._changed:
+            for name, value in fields.items():
+                setattr(self, name, value)
+            self.version += 1
+            self._changed.notify_all()
+
+    def wait_for_change(self, version, timeout):
+        '''
+        等待状态变化（版本号不同于 version）或超时，返回当前版本号
+        '''
+        with self._changed:
+            if self.version == version:
+                self._changed.wait(timeout)
+            return self.version
+
+    def report_progress(self, done, total, outcome=None):
+        '''
+        ParallelProcessor.map 的进度回调
+        '''
+        self.update(progress={'done': done, 'total': total})
+
+    def cancel(self):
+        '''
+        请求取消：排队中的任务直接结束，运行中的任务在并行处理的下一次检查时停止剩余工作
+        '''
+        self._cancel.set()
+        with self._changed:
+            if self.status == 'queued':
+                self.update(status='cancelled', finished=time.time())
+
+    def cancelled(self):
+        return self._cancel.is_set()
+
+    def is_finished(self):
+        return self.status in FINISHED_STATES
+
+    def to_dict(self, include_result=True):
+        info = {
+            'job_id': self.id,
+            'kind': self.kind,
+            'status': self.status,
+            'progress': dict(self.progress),
+            'error': self.error,
+            'created': self.created,
+            'started': self.started,
+            'finished': self.finished
+        }
+        if include_result:
+            info['result'] = self.result
+            info['http_status'] = self.http_status
+        return info
+
+
+class JobManager:
+    """
+    后台任务管理：任务在共享线程池的 jobs 通道中执行，结束后结果保留 ttl 秒
+
+    Args:
+        ttl: 结束后结果的保留时间（秒）
+        max_pending: 同时排队或运行的任务数上限
+    """
+
+    def __init__(self, ttl, max_pending):
+        self.ttl = ttl
+        self.max_pending = max_pending
+        self._lock = threading.Lock()
+        self._jobs = OrderedDict()
+        self.submitted = 0
+
+    def _sweep(self):
+        now = time.time()
+        for job_id, job in list(self._jobs.items()):
+            if job.is_finished() and job.finished and now - job.finished > self.ttl:
+                del self._jobs[job_id]
+
+    def submit(self, kind, workspace_id, run):
+        '''
+        提交任务，run(job) 在后台线程中执行并返回 (HTTP 状态码, JSON 响应)
+        '''
+        job = Job(kind, workspace_id)
+        with self._lock:
+            self._sweep()
+            pending = sum(1 for existing in self._jobs.values() if not existing.is_finished())
+            if pending >= self.max_pending:
+                raise JobLimitError(f"Too many pending jobs ({pending}), please retry later")
+            self._jobs[job.id] = job
+            self.submitted += 1
+        # 在全新的上下文中执行，不继承提交请求的上下文
+        get_executor('jobs').submit(contextvars.Context().run, self._execute, job, run)
+        return job
+
+    def _execute(self, job, run):
+        if job.cancelled():
+            return
+        job.update(status='running', started=time.time())
+        try:
+            http_status, body = run(job)
+            if job.cancelled():
+                status = 'cancelled'
+            else:
+                status = 'succeeded' if http_status < 400 else 'failed'
+            error = (body or {}).get('message') if status == 'failed' else None
+            job.update(status=status, result=body, http_status=http_status, error=error, finished=time.time())
+        except Exception as e:
+            print(f"Job_service.py - Job {job.id} ({job.kind}) failed: {str(e)}")
+            job.update(status='failed', error=str(e), finished=time.time())
+
+    def get(self, job_id, workspace_id):
+        '''
+        获取任务，不存在、已过期或属于其他工作区时返回 None
+        '''
+        with self._lock:
+            self._sweep()
+            job = self._jobs.get(job_id)
+        if job is None or job.workspace_id != workspace_id:
+            return None
+        return job
+
+    def list(self, workspace_id):
+        with self._lock:
+            self._sweep()
+            return [job for job in self._jobs.values() if job.workspace_id == workspace_id]
+
+    def get_stats(self):
+        with self._lock:
+            statuses = {}
+            for job in self._jobs.values():
+                statuses[job.status] = statuses.get(job.status, 0) + 1
+            return {
+                'jobs': len(self._jobs),
+                'submitted': self.submitted,
+                'max_pending': self.max_pending,
+                'ttl': self.ttl,
+                'statuses': statuses
+            }
+
+
+job_manager = JobManager(JOB_TTL, MAX_PENDING_JOBS)
+register_metrics('jobs', job_manager.get_stats)
+
+
+def current_job():
+    '''
+    当前线程正在执行的后台任务，同步请求中为 None
+    '''
+    return _current_job.get()
+
+
+def cancel_checker():
+    '''
+    并行处理的取消检查：后台任务被取消，或同步请求的客户端已断开
+    '''
+    job = current_job()
+    if job is not None:
+        return job.cancelled
+    return disconnect_checker()
+
+
+def progress_reporter():
+    '''
+    并行处理的进度回调：后台任务中上报进度，同步请求中为 None
+    '''
+    job = current_job()
+    return job.report_progress if job is not None else None
+
+
+def wants_async():
+    '''
+    客户端是否要求异步执行：?async=1 或 Prefer: respond-async 请求头
+    '''
+    if request.args.get('async', '').lower() in ('1', 'true'):
+        return True
+    return 'respond-async' in request.headers.get('Prefer', '').lower()
+
+
+def _request_runner(view, args, kwargs):
+    '''
+    保存当前请求的内容，返回在后台线程中以相同请求重新执行视图的函数
+    '''
+    app = current_app._get_current_object()
+    path = request.path
+    method = request.method
+    query_string = request.query_string
+    body = request.get_data()
+    headers = {'Content-Type': request.content_type or 'application/json'}
+    workspace_id = current_workspace().id
+    headers[WORKSPACE_HEADER] = workspace_id
+
+    def run(job):
+        with app.test_request_context(path, method=method, query_string=query_string, data=body, headers=headers):
+            # 任务运行期间占用工作区，避免被淘汰
+            workspace_token = activate_workspace(workspace_id)
+            budget_token = start_retry_budget()
+            job_token = _current_job.set(job)
+            try:
+                response = make_response(view(*args, **kwargs))
+                return response.status_code, response.get_json(silent=True)
+            finally:
+                _current_job.reset(job_token)
+                end_retry_budget(budget_token)
+                release_workspace(workspace_token)
+
+    return run
+
+
+def job_route(kind):
+    '''
+    视图装饰器：请求要求异步执行时立即返回任务ID（202），视图在后台执行；否则照常同步执行
+    '''
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            if not wants_async():
+                return view(*args, **kwargs)
+            try:
+                job = job_manager.submit(kind, current_workspace().id, _request_runner(view, args, kwargs))
+            except JobLimitError as e:
+                return jsonify({'success': False, 'message': str(e)}), 429
+            return jsonify({
+                'success': True,
+                'job_id': job.id,
+                'status': job.status,
+                'statusUrl': f'/jobs/{job.id}'
+            }), 202
+
+        return wrapper
+
+    return decorator
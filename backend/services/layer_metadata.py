@@ -0,0 +1,76 @@
+import ee
+from .eval_cache import cached_get_info
+
+# 描述图层数据本身的元数据字段；数据集被替换时这些字段随之失效
+DESCRIPTION_KEYS = ('kind', 'bands', 'band_types', 'bounds', 'crs', 'scale')
+
+
+def metadata_expression(dataset):
+    '''
+    构建图层元数据的服务器端表达式，一次 getInfo 即可取回全部字段
+    栅格：波段名称、波段类型、范围、默认投影和分辨率；矢量：范围
+    '''
+    if isinstance(dataset, (ee.FeatureCollection, ee.Feature, ee.Geometry)):
+        return ee.Dictionary({
+            'kind': 'vector',
+            'bounds': dataset.geometry().bounds().coordinates().get(0)
+        })
+
+    if isinstance(dataset, ee.ImageCollection):
+        footprint = dataset.geometry()
+        image = ee.Image(dataset.first())
+    else:
+        image = ee.Image(dataset)
+        footprint = image.geometry()
+
+    bands = image.bandNames()
+    # 没有波段的影像无法取投影，退回到默认投影
+    projection = ee.Image(ee.Algorithms.If(bands.size().gt(0), image.select(0), ee.Image(0))).projection()
+    return ee.Dictionary({
+        'kind': 'raster',
+        'bands': bands,
+        'band_types': image.bandTypes(),
+        'bounds': footprint.bounds().coordinates().get(0),
+        'crs': projection.crs(),
+        'scale': projection.nominalScale()
+    })
+
+
+def normalize_metadata(info):
+    '''
+    精简 getInfo 的结果：波段类型只保留精度（int/float/double）
+    '''
+    if 'band_types' in info:
+        info['band_types'] = {band: (pixel_type or {}).get('precision')
+                              for band, pixel_type in (info['band_types'] or {}).items()}
+    return info
+
+
+def describe(dataset):
+    '''
+    计算图层元数据（一次往返），同一表达式的元数据只计算一次
+    '''
+    return normalize_metadata(cached_get_info(metadata_expression(dataset), 'metadata'))
+
+
+def derive_metadata(source_meta, bands):
+    '''
+    工具输出的波段已知时，由源图层的元数据在本地推导结果图层的元数据，不访问服务器
+    范围、投影和分辨率沿用源图层；源图层元数据不完整时返回 None
+    '''
+    if not source_meta or 'bounds' not in source_meta or bands is None:
+        return None
+    band_types = source_meta.get('band_types') or {}
+    meta = {key: source_meta[key] for key in DESCRIPTION_KEYS if key in source_meta}
+    meta['bands'] = list(bands)
+    meta['band_types'] = {band: band_types.get(band) for band in bands}
+    return meta
+
+
+def bounds_to_bbox(bounds):
+    '''
+    范围多边形的外环坐标转换为 [min_x, min_y, max_x, max_y]
+    '''
+    xs = [point[0] for point in bounds]
+    ys = [point[1] for point in bounds]
+    return [min(xs), min(ys), max(xs), max(ys)]
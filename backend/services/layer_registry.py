@@ -0,0 +1,345 @@
+import ee
+import json
+import time
+import threading
+from collections import OrderedDict
+from collections.abc import Mapping
+from contextlib import contextmanager
+
+def encode_dataset(dataset):
+    '''
+    将 Earth Engine 对象序列化为 JSON 字符串
+    '''
+    return json.dumps(ee.serializer.encode(dataset))
+
+def decode_dataset(expr):
+    '''
+    从 JSON 字符串还原 Earth Engine 对象
+    '''
+    return ee.deserializer.decode(json.loads(expr))
+
+def try_encode(dataset):
+    '''
+    序列化失败（如非 Earth Engine 对象）时返回 None
+    '''
+    try:
+        return encode_dataset(dataset)
+    except Exception:
+        return None
+
+class LayerEntry:
+    """
+    注册表中的一个图层及其元数据
+    dataset 为 None 时表示从快照恢复、尚未反序列化的图层，首次读取时由 expr 还原
+    """
+    __slots__ = ('dataset', 'expr', 'name', 'created', 'last_access', 'size_estimate', 'pins', 'meta')
+
+    def __init__(self, dataset, name, size_estimate=0, meta=None, expr=None):
+        now = time.time()
+        self.dataset = dataset
+        self.expr = expr
+        self.name = name
+        self.created = now
+        self.last_access = now
+        self.size_estimate = size_estimate
+        self.pins = 0
+        self.meta = meta or {}
+
+class LayerRegistry:
+    """
+    线程安全的图层注册表
+
+    - 图层按显示顺序保存，调整顺序为 O(1)
+    - 另按最近访问顺序维护 LRU，超出图层数或总大小上限、或闲置超时的图层被淘汰
+    - 正在使用的图层可以被固定（pin），固定期间不会被淘汰
+    - 读取方通过只读视图访问，视图的 items() 等返回快照，遍历时不受并发修改影响
+    - 保存序列化后的表达式，用于快照；从快照恢复的图层在首次读取时才反序列化
+
+    Args:
+        max_layers: 最多保存的图层数，0 表示不限制
+        ttl: 图层闲置过期时间（秒），0 表示不过期
+        max_bytes: 图层表达式总大小上限（字节），0 表示不限制
+    """
+
+    def __init__(self, max_layers=0, ttl=0, max_bytes=0):
+        self.max_layers = max_layers
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+
+        self._lock = threading.RLock()
+        self._entries = OrderedDict()   # 显示顺序
+        self._lru = OrderedDict()       # 访问顺序，最久未访问的在前
+        self._bytes = 0
+        self.evictions = 0
+        self.revision = 0   # 每次修改递增，快照据此判断是否需要重新写入
+
+    persistent = False
+
+    def _dataset(self, entry):
+        if entry.dataset is None and entry.expr is not None:
+            entry.dataset = decode_dataset(entry.expr)
+        return entry.dataset
+
+    def get(self, layer_id, default=None):
+        '''
+        获取图层数据集并刷新访问时间
+        '''
+        with self._lock:
+            entry = self._entries.get(layer_id)
+            if entry is None:
+                return default
+            entry.last_access = time.time()
+            self._lru.move_to_end(layer_id)
+            return self._dataset(entry)
+
+    def get_name(self, layer_id, default=None):
+        with self._lock:
+            entry = self._entries.get(layer_id)
+            return default if entry is None else entry.name
+
+    def get_entry(self, layer_id):
+        with self._lock:
+            entry = self._entries.get(layer_id)
+            if entry is not None:
+                self._dataset(entry)
+            return entry
+
+    def contains(self, layer_id):
+        with self._lock:
+            return layer_id in self._entries
+
+    def keys(self):
+        with self._lock:
+            return list(self._entries)
+
+    def items(self, field='dataset'):
+        '''
+        返回 [(图层ID, 数据集或名称), ...] 快照
+        '''
+        with self._lock:
+            if field == 'dataset':
+                return [(layer_id, self._dataset(entry)) for layer_id, entry in self._entries.items()]
+            return [(layer_id, getattr(entry, field)) for layer_id, entry in self._entries.items()]
+
+    def __len__(self):
+        with self._lock:
+            return len(self._entries)
+
+    def save(self, layer_id, dataset, name, meta=None):
+        '''
+        保存图层，返回被替换或淘汰的图层ID列表（由调用方通知监听者）
+        '''
+        expr = try_encode(dataset)
+        size = len(expr) if expr else 0
+        with self._lock:
+            self.revision += 1
+            changed = []
+            old = self._entries.get(layer_id)
+            if old is not None:
+                if old.dataset is not dataset:
+                    changed.append(layer_id)
+                replaced = old.expr != expr if expr is not None else old.dataset is not dataset
+                self._bytes -= old.size_estimate
+                entry = old
+                entry.dataset = dataset
+                entry.expr = expr
+                entry.name = name
+                entry.size_estimate = size
+                entry.last_access = time.time()
+                if meta is not None:
+                    entry.meta = meta
+                elif replaced:
+                    # 数据集已替换，旧的波段、范围等元数据不再适用
+                    entry.meta = {}
+            else:
+                entry = LayerEntry(dataset, name, size, meta, expr)
+                self._entries[layer_id] = entry
+            self._lru[layer_id] = entry
+            self._lru.move_to_end(layer_id)
+            self._bytes += size
+            changed.extend(self._evict(keep=layer_id))
+            return changed
+
+    def rename(self, layer_id, name):
+        with self._lock:
+            entry = self._entries.get(layer_id)
+            if entry is not None:
+                entry.name = name
+                self.revision += 1
+
+    def update_meta(self, layer_id, meta):
+        '''
+        合并图层元数据，返回是否存在
+        '''
+        with self._lock:
+            entry = self._entries.get(layer_id)
+            if entry is None:
+                return False
+            entry.meta = dict(entry.meta, **meta)
+            self.revision += 1
+            return True
+
+    def remove(self, layer_id):
+        '''
+        移除图层，返回是否存在
+        '''
+        with self._lock:
+            entry = self._entries.pop(layer_id, None)
+            if entry is None:
+                return False
+            del self._lru[layer_id]
+            self._bytes -= entry.size_estimate
+            self.revision += 1
+            return True
+
+    def reorder(self, layer_ids):
+        '''
+        按给定顺序排列图层，未列出的图层被移除，返回被移除的图层ID列表
+        '''
+        with self._lock:
+            listed = [layer_id for layer_id in layer_ids if layer_id in self._entries]
+            listed_set = set(listed)
+            removed = [layer_id for layer_id in self._entries if layer_id not in listed_set]
+            for layer_id in removed:
+                self.remove(layer_id)
+            for layer_id in listed:
+                self._entries.move_to_end(layer_id)
+            self.revision += 1
+            return removed
+
+    @contextmanager
+    def pinned(self, layer_ids):
+        '''
+        在上下文中固定图层，防止长时间运行的操作期间图层被淘汰
+        '''
+        with self._lock:
+            entries = [self._entries[layer_id] for layer_id in layer_ids if layer_id in self._entries]
+            for entry in entries:
+                entry.pins += 1
+        try:
+            yield
+        finally:
+            with self._lock:
+                for entry in entries:
+                    entry.pins -= 1
+
+    def _over_limit(self):
+        return ((self.max_layers and len(self._entries) > self.max_layers) or
+                (self.max_bytes and self._bytes > self.max_bytes))
+
+    def _evict(self, keep=None):
+        '''
+        淘汰过期图层，再按 LRU 淘汰直到满足上限；固定的图层和刚保存的图层不淘汰
+        '''
+        evicted = []
+        if self.ttl:
+            expire_before = time.time() - self.ttl
+            for layer_id, entry in list(self._lru.items()):
+                if entry.last_access >= expire_before:
+                    break
+                if entry.pins == 0 and layer_id != keep:
+                    evicted.append(layer_id)
+            for layer_id in evicted:
+                self.remove(layer_id)
+
+        if self._over_limit():
+            for layer_id, entry in list(self._lru.items()):
+                if not self._over_limit():
+                    break
+                if entry.pins == 0 and layer_id != keep:
+                    self.remove(layer_id)
+                    evicted.append(layer_id)
+
+        if evicted:
+            self.evictions += len(evicted)
+            print(f"Map_service.py - evicted layers: {evicted}")
+        return evicted
+
+    def export(self):
+        '''
+        导出所有图层（按显示顺序）用于快照，无法序列化的图层被跳过
+        '''
+        with self._lock:
+            return [{
+                'id': layer_id,
+                'name': entry.name,
+                'expr': entry.expr,
+                'meta': entry.meta,
+                'created': entry.created
+            } for layer_id, entry in self._entries.items() if entry.expr is not None]
+
+    def restore(self, layers):
+        '''
+        从快照恢复图层，只保存表达式，首次读取时再反序列化
+        '''
+        with self._lock:
+            for layer in layers:
+                entry = LayerEntry(None, layer['name'], len(layer['expr']), layer.get('meta'), layer['expr'])
+                entry.created = layer.get('created', entry.created)
+                self._entries[layer['id']] = entry
+                self._lru[layer['id']] = entry
+                self._bytes += entry.size_estimate
+
+    def discard(self, idle_timeout=0):
+        '''
+        工作区被淘汰时调用，释放所有图层
+        '''
+        with self._lock:
+            self._entries.clear()
+            self._lru.clear()
+            self._bytes = 0
+
+    def get_stats(self):
+        with self._lock:
+            return {
+                'backend': 'memory',
+                'layers': len(self._entries),
+                'bytes': self._bytes,
+                'max_layers': self.max_layers,
+                'max_bytes': self.max_bytes,
+                'ttl': self.ttl,
+                'pinned': sum(1 for entry in self._entries.values() if entry.pins),
+                'evictions': self.evictions
+            }
+
+class LayerView(Mapping):
+    """
+    注册表的只读字典视图：datasets[layer_id]、layer_id in datasets、datasets.items() 等用法保持不变
+    resolve 为无参函数，每次访问时返回当前使用的注册表（如当前请求所属工作区的注册表）
+    """
+
+    def __init__(self, resolve, field):
+        self._resolve = resolve
+        self._field = field
+
+    @property
+    def _registry(self):
+        return self._resolve()
+
+    def __getitem__(self, layer_id):
+        missing = object()
+        if self._field == 'dataset':
+            value = self._registry.get(layer_id, missing)
+        else:
+            value = self._registry.get_name(layer_id, missing)
+        if value is missing:
+            raise KeyError(layer_id)
+        return value
+
+    def __contains__(self, layer_id):
+        return self._registry.contains(layer_id)
+
+    def __iter__(self):
+        return iter(self._registry.keys())
+
+    def __len__(self):
+        return len(self._registry)
+
+    def items(self):
+        return self._registry.items(self._field)
+
+    def values(self):
+        return [value for _, value in self._registry.items(self._field)]
+
+    def __repr__(self):
+        return f"LayerView({self._registry.keys()})"
@@ -1,11 +1,15 @@
 import ee
+from .eval_cache import cached_get_map_id, cached_get_info
 
 index = 0
-def  get_layer_info_service(image, satellite):
-    """获取图层信息服务"""
+def  get_layer_info_service(image, satellite, band_names=None):
+    """获取图层信息服务
+    band_names: 图层元数据中的波段名称（可选），已知时不再向服务器查询
+    """
     try:
         global index
-        band_names = image.bandNames().getInfo()
+        if band_names is None:
+            band_names = cached_get_info(image.bandNames(), 'metadata')
             
         return {
             'success': True,
@@ -52,7 +56,7 @@ def update_vis_params_service(data, current_dataset):
             }
         
         print(f"Layer_service.py - Selected bands for visualization: {vis_params['bands']}")
-        map_id = img.getMapId(vis_params)
+        map_id = cached_get_map_id(img, vis_params)
         return {
             'tileUrl': map_id['tile_fetcher'].url_format
         }
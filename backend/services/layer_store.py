@@ -0,0 +1,480 @@
+import json
+import time
+import hashlib
+import sqlite3
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+from .layer_registry import LayerEntry, encode_dataset, decode_dataset
+
+# 读取图层时，距上次写入访问时间超过该秒数才更新数据库，避免每次读取都产生写操作
+TOUCH_INTERVAL = 10
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS layers (
+    workspace TEXT NOT NULL,
+    layer_id TEXT NOT NULL,
+    name TEXT,
+    expr TEXT NOT NULL,
+    version TEXT NOT NULL,
+    position INTEGER NOT NULL,
+    created REAL NOT NULL,
+    last_access REAL NOT NULL,
+    size INTEGER NOT NULL,
+    meta TEXT,
+    PRIMARY KEY (workspace, layer_id)
+);
+CREATE INDEX IF NOT EXISTS layers_position ON layers (workspace, position);
+CREATE INDEX IF NOT EXISTS layers_access ON layers (workspace, last_access);
+CREATE TABLE IF NOT EXISTS workspace_state (
+    workspace TEXT NOT NULL,
+    name TEXT NOT NULL,
+    value TEXT NOT NULL,
+    updated REAL NOT NULL,
+    PRIMARY KEY (workspace, name)
+);
+'''
+
+_connections = threading.local()
+_initialized = set()
+_init_lock = threading.Lock()
+
+
+def connect(path, schema=SCHEMA):
+    '''
+    获取当前线程到数据库的连接（每个线程一个连接，首次使用时建表并开启 WAL）
+    schema: 建表语句，默认为图层表
+    '''
+    conns = getattr(_connections, 'conns', None)
+    if conns is None:
+        conns = _connections.conns = {}
+    conn = conns.get(path)
+    if conn is None:
+        conn = sqlite3.connect(path, timeout=30, isolation_level=None, check_same_thread=False)
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('PRAGMA synchronous=NORMAL')
+        with _init_lock:
+            if path not in _initialized:
+                conn.executescript(schema)
+                _initialized.add(path)
+        conns[path] = conn
+    return conn
+
+
+@contextmanager
+def transaction(conn):
+    '''
+    写事务：BEGIN IMMEDIATE 立即获取写锁，避免多个进程同时升级读锁时死锁
+    '''
+    conn.execute('BEGIN IMMEDIATE')
+    try:
+        yield conn
+    except BaseException:
+        conn.execute('ROLLBACK')
+        raise
+    conn.execute('COMMIT')
+
+
+def expr_digest(expr):
+    '''
+    表达式摘要，作为图层版本号：内容相同的表达式版本相同，进程内缓存可以继续使用
+    '''
+    return hashlib.blake2b(expr.encode('utf-8'), digest_size=16).hexdigest()
+
+
+class SqliteLayerRegistry:
+    """
+    基于 SQLite（WAL 模式）的图层注册表，多个进程（如 gunicorn -w N）共享同一工作区的图层
+
+    - 每个图层保存序列化后的 Earth Engine 表达式（ee.serializer）、名称、显示顺序和元数据
+    - 进程内用 LRU 缓存反序列化后的对象，按表达式摘要校验，其他进程替换图层后自动失效
+    - 与 LayerRegistry 接口一致；固定（pin）只在本进程内生效
+
+    Args:
+        path: 数据库文件路径
+        workspace_id: 工作区ID，不同工作区的图层互相隔离
+        max_layers: 最多保存的图层数，0 表示不限制
+        ttl: 图层闲置过期时间（秒），0 表示不过期
+        max_bytes: 图层表达式总大小上限（字节），0 表示不限制
+        cache_size: 进程内缓存的反序列化对象数
+    """
+
+    def __init__(self, path, workspace_id, max_layers=0, ttl=0, max_bytes=0, cache_size=64):
+        self.path = path
+        self.workspace_id = workspace_id
+        self.max_layers = max_layers
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.cache_size = cache_size
+
+        self._lock = threading.RLock()
+        self._cache = OrderedDict()   # 图层ID -> (版本号, 数据集)
+        self._pins = {}
+        self.evictions = 0
+        self.hits = 0
+        self.misses = 0
+
+    # 图层已保存在数据库中，快照不需要包含图层；revision 固定为 0
+    persistent = True
+    revision = 0
+
+    def _conn(self):
+        return connect(self.path)
+
+    def _cache_put(self, layer_id, version, dataset):
+        with self._lock:
+            self._cache[layer_id] = (version, dataset)
+            self._cache.move_to_end(layer_id)
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+
+    def _cache_drop(self, layer_id):
+        with self._lock:
+            self._cache.pop(layer_id, None)
+
+    def get(self, layer_id, default=None):
+        '''
+        获取图层数据集：版本号与缓存一致时直接返回缓存对象，否则从数据库反序列化
+        '''
+        conn = self._conn()
+        row = conn.execute(
+            'SELECT version, last_access FROM layers WHERE workspace = ? AND layer_id = ?',
+            (self.workspace_id, layer_id)
+        ).fetchone()
+        if row is None:
+            self._cache_drop(layer_id)
+            return default
+        version, last_access = row
+
+        with self._lock:
+            cached = self._cache.get(layer_id)
+            if cached is not None and cached[0] == version:
+                self._cache.move_to_end(layer_id)
+                self.hits += 1
+                dataset = cached[1]
+            else:
+                self.misses += 1
+                dataset = None
+
+        if dataset is None:
+            expr_row = conn.execute(
+                'SELECT expr, version FROM layers WHERE workspace = ? AND layer_id = ?',
+                (self.workspace_id, layer_id)
+            ).fetchone()
+            if expr_row is None:
+                self._cache_drop(layer_id)
+                return default
+            dataset = decode_dataset(expr_row[0])
+            self._cache_put(layer_id, expr_row[1], dataset)
+            if cached is not None:
+                # 图层已被其他进程替换，通知本进程的缓存失效
+                self._notify_changed(layer_id)
+
+        now = time.time()
+        if now - last_access > TOUCH_INTERVAL:
+            conn.execute(
+                'UPDATE layers SET last_access = ? WHERE workspace = ? AND layer_id = ?',
+                (now, self.workspace_id, layer_id)
+            )
+        return dataset
+
+    def get_name(self, layer_id, default=None):
+        row = self._conn().execute(
+            'SELECT name FROM layers WHERE workspace = ? AND layer_id = ?',
+            (self.workspace_id, layer_id)
+        ).fetchone()
+        return default if row is None else row[0]
+
+    def get_entry(self, layer_id):
+        row = self._conn().execute(
+            'SELECT name, created, last_access, size, meta FROM layers WHERE workspace = ? AND layer_id = ?',
+            (self.workspace_id, layer_id)
+        ).fetchone()
+        if row is None:
+            return None
+        name, created, last_access, size, meta = row
+        entry = LayerEntry(self.get(layer_id), name, size, json.loads(meta) if meta else None)
+        entry.created = created
+        entry.last_access = last_access
+        entry.pins = self._pins.get(layer_id, 0)
+        return entry
+
+    def contains(self, layer_id):
+        return self._conn().execute(
+            'SELECT 1 FROM layers WHERE workspace = ? AND layer_id = ?',
+            (self.workspace_id, layer_id)
+        ).fetchone() is not None
+
+    def keys(self):
+        return [row[0] for row in self._conn().execute(
+            'SELECT layer_id FROM layers WHERE workspace = ? ORDER BY position', (self.workspace_id,)
+        )]
+
+    def items(self, field='dataset'):
+        '''
+        返回 [(图层ID, 数据集或名称), ...] 快照
+        '''
+        if field == 'name':
+            return list(self._conn().execute(
+                'SELECT layer_id, name FROM layers WHERE workspace = ? ORDER BY position', (self.workspace_id,)
+            ))
+        missing = object()
+        items = [(layer_id, self.get(layer_id, missing)) for layer_id in self.keys()]
+        return [(layer_id, dataset) for layer_id, dataset in items if dataset is not missing]
+
+    def __len__(self):
+        return self._conn().execute(
+            'SELECT COUNT(*) FROM layers WHERE workspace = ?', (self.workspace_id,)
+        ).fetchone()[0]
+
+    def save(self, layer_id, dataset, name, meta=None):
+        '''
+        保存图层，返回被替换或淘汰的图层ID列表（由调用方通知监听者）
+        '''
+        expr = encode_dataset(dataset)
+        version = expr_digest(expr)
+        meta_json = json.dumps(meta) if meta is not None else None
+        now = time.time()
+        changed = []
+        with transaction(self._conn()) as conn:
+            row = conn.execute(
+                'SELECT version, meta FROM layers WHERE workspace = ? AND layer_id = ?',
+                (self.workspace_id, layer_id)
+            ).fetchone()
+            if row is not None:
+                if row[0] != version:
+                    changed.append(layer_id)
+                    # 数据集已替换，旧的波段、范围等元数据不再适用
+                    old_meta = None
+                else:
+                    old_meta = row[1]
+                conn.execute(
+                    'UPDATE layers SET name = ?, expr = ?, version = ?, last_access = ?, size = ?, '
+                    'meta = ? WHERE workspace = ? AND layer_id = ?',
+                    (name, expr, version, now, len(expr), meta_json if meta is not None else old_meta,
+                     self.workspace_id, layer_id)
+                )
+            else:
+                position = conn.execute(
+                    'SELECT COALESCE(MAX(position), 0) + 1 FROM layers WHERE workspace = ?', (self.workspace_id,)
+                ).fetchone()[0]
+                conn.execute(
+                    'INSERT INTO layers (workspace, layer_id, name, expr, version, position, created, '
+                    'last_access, size, meta) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                    (self.workspace_id, layer_id, name, expr, version, position, now, now, len(expr), meta_json)
+                )
+            evicted = self._evict(conn, keep=layer_id)
+
+        for evicted_id in evicted:
+            self._cache_drop(evicted_id)
+        self._cache_put(layer_id, version, dataset)
+        return changed + evicted
+
+    def rename(self, layer_id, name):
+        self._conn().execute(
+            'UPDATE layers SET name = ? WHERE workspace = ? AND layer_id = ?',
+            (name, self.workspace_id, layer_id)
+        )
+
+    def update_meta(self, layer_id, meta):
+        '''
+        合并图层元数据，返回是否存在
+        '''
+        with transaction(self._conn()) as conn:
+            row = conn.execute(
+                'SELECT meta FROM layers WHERE workspace = ? AND layer_id = ?', (self.workspace_id, layer_id)
+            ).fetchone()
+            if row is None:
+                return False
+            merged = dict(json.loads(row[0]) if row[0] else {}, **meta)
+            conn.execute(
+                'UPDATE layers SET meta = ? WHERE workspace = ? AND layer_id = ?',
+                (json.dumps(merged), self.workspace_id, layer_id)
+            )
+            return True
+
+    def remove(self, layer_id):
+        '''
+        移除图层，返回是否存在
+        '''
+        cursor = self._conn().execute(
+            'DELETE FROM layers WHERE workspace = ? AND layer_id = ?', (self.workspace_id, layer_id)
+        )
+        self._cache_drop(layer_id)
+        return cursor.rowcount > 0
+
+    def reorder(self, layer_ids):
+        '''
+        按给定顺序排列图层，未列出的图层被移除，返回被移除的图层ID列表
+        '''
+        with transaction(self._conn()) as conn:
+            existing = [row[0] for row in conn.execute(
+                'SELECT layer_id FROM layers WHERE workspace = ? ORDER BY position', (self.workspace_id,)
+            )]
+            existing_set = set(existing)
+            listed = [layer_id for layer_id in dict.fromkeys(layer_ids) if layer_id in existing_set]
+            listed_set = set(listed)
+            removed = [layer_id for layer_id in existing if layer_id not in listed_set]
+            conn.executemany(
+                'DELETE FROM layers WHERE workspace = ? AND layer_id = ?',
+                [(self.workspace_id, layer_id) for layer_id in removed]
+            )
+            conn.executemany(
+                'UPDATE layers SET position = ? WHERE workspace = ? AND layer_id = ?',
+                [(position, self.workspace_id, layer_id) for position, layer_id in enumerate(listed, 1)]
+            )
+        for layer_id in removed:
+            self._cache_drop(layer_id)
+        return removed
+
+    @contextmanager
+    def pinned(self, layer_ids):
+        '''
+        在上下文中固定图层，防止本进程的淘汰操作移除正在使用的图层
+        '''
+        layer_ids = list(layer_ids)
+        with self._lock:
+            for layer_id in layer_ids:
+                self._pins[layer_id] = self._pins.get(layer_id, 0) + 1
+        try:
+            yield
+        finally:
+            with self._lock:
+                for layer_id in layer_ids:
+                    self._pins[layer_id] -= 1
+                    if not self._pins[layer_id]:
+                        del self._pins[layer_id]
+
+    def _evict(self, conn, keep=None):
+        '''
+        在写事务中淘汰过期图层，再按最久未访问淘汰直到满足上限；固定的图层和刚保存的图层不淘汰
+        '''
+        with self._lock:
+            protected = set(self._pins)
+        protected.add(keep)
+
+        evicted = []
+        if self.ttl:
+            expired = conn.execute(
+                'SELECT layer_id FROM layers WHERE workspace = ? AND last_access < ?',
+                (self.workspace_id, time.time() - self.ttl)
+            ).fetchall()
+            evicted.extend(row[0] for row in expired if row[0] not in protected)
+
+        count, total = conn.execute(
+            'SELECT COUNT(*), COALESCE(SUM(size), 0) FROM layers WHERE workspace = ?', (self.workspace_id,)
+        ).fetchone()
+        if (self.max_layers and count > self.max_layers) or (self.max_bytes and total > self.max_bytes):
+            evicted_set = set(evicted)
+            for layer_id, size in conn.execute(
+                'SELECT layer_id, size FROM layers WHERE workspace = ? ORDER BY last_access', (self.workspace_id,)
+            ).fetchall():
+                if layer_id in evicted_set:
+                    count -= 1
+                    total -= size
+                    continue
+                if not ((self.max_layers and count > self.max_layers) or
+                        (self.max_bytes and total > self.max_bytes)):
+                    break
+                if layer_id not in protected:
+                    evicted.append(layer_id)
+                    count -= 1
+                    total -= size
+
+        if evicted:
+            conn.executemany(
+                'DELETE FROM layers WHERE workspace = ? AND layer_id = ?',
+                [(self.workspace_id, layer_id) for layer_id in evicted]
+            )
+            self.evictions += len(evicted)
+            print(f"Layer_store.py - evicted layers: {evicted}")
+        return evicted
+
+    def _notify_changed(self, layer_id):
+        # 延迟导入，避免与 map_service 循环导入
+        from .map_service import notify_layer_changed
+        notify_layer_changed(layer_id)
+
+    def export(self):
+        return []
+
+    def restore(self, layers):
+        pass
+
+    def discard(self, idle_timeout=0):
+        '''
+        工作区在本进程被淘汰时调用：清空进程内缓存；
+        若该工作区在所有进程中都已闲置超过 idle_timeout，同时删除数据库中的图层
+        '''
+        with self._lock:
+            self._cache.clear()
+        if idle_timeout:
+            with transaction(self._conn()) as conn:
+                last_access = conn.execute(
+                    'SELECT MAX(last_access) FROM layers WHERE workspace = ?', (self.workspace_id,)
+                ).fetchone()[0]
+                if last_access is not None and time.time() - last_access > idle_timeout:
+                    conn.execute('DELETE FROM layers WHERE workspace = ?', (self.workspace_id,))
+
+    def get_stats(self):
+        count, total = self._conn().execute(
+            'SELECT COUNT(*), COALESCE(SUM(size), 0) FROM layers WHERE workspace = ?', (self.workspace_id,)
+        ).fetchone()
+        with self._lock:
+            return {
+                'backend': 'sqlite',
+                'layers': count,
+                'bytes': total,
+                'max_layers': self.max_layers,
+                'max_bytes': self.max_bytes,
+                'ttl': self.ttl,
+                'pinned': len(self._pins),
+                'evictions': self.evictions,
+                'cache_size': len(self._cache),
+                'cache_hits': self.hits,
+                'cache_misses': self.misses
+            }
+
+
+class SqliteWorkspaceState:
+    """
+    保存在 SQLite 中的工作区状态（样本、研究区域），与 SqliteLayerRegistry 共用数据库，多个进程共享
+
+    Args:
+        path: 数据库文件路径
+        workspace_id: 工作区ID
+    """
+
+    def __init__(self, path, workspace_id):
+        self.path = path
+        self.workspace_id = workspace_id
+
+    # 状态已保存在数据库中，快照不需要包含
+    persistent = True
+
+    def _load(self, conn, name, default):
+        row = conn.execute(
+            'SELECT value FROM workspace_state WHERE workspace = ? AND name = ?',
+            (self.workspace_id, name)
+        ).fetchone()
+        return json.loads(row[0]) if row is not None else default
+
+    def load(self, name, default):
+        '''
+        读取状态的副本，不存在时返回 default
+        '''
+        return self._load(connect(self.path), name, default)
+
+    @contextmanager
+    def edit(self, name, default):
+        '''
+        在写事务中读取最新的状态并交给调用方修改，正常退出时写回；
+        其他进程的修改在事务之间串行，不会互相覆盖，出错时不写入
+        '''
+        with transaction(connect(self.path)) as conn:
+            value = self._load(conn, name, default)
+            yield value
+            conn.execute(
+                'INSERT OR REPLACE INTO workspace_state (workspace, name, value, updated) VALUES (?, ?, ?, ?)',
+                (self.workspace_id, name, json.dumps(value, ensure_ascii=False), time.time())
+            )
@@ -1,41 +1,151 @@
 import ee
+import os
 import time
+import threading
 from scripts.fetch_satellite_dates import fetch_dataset_details
+from .layer_registry import LayerView
+from .layer_metadata import describe, metadata_expression, normalize_metadata
+from .common import evaluate_batch
+from .eval_cache import cached_get_map_id, cached_get_info, cached_call
+from .workspace import current_workspace, register_workspace_listener
 
-# 使用字典存储每个图层的 dataset
-datasets = {}
-datasetsNames  ={}
-index = 0
+# 图层变更监听函数列表，图层被替换或移除时调用 listener(layer_id)
+layer_listeners = []
+
+def register_layer_listener(listener):
+    '''
+    注册图层变更监听函数
+    '''
+    layer_listeners.append(listener)
+
+def notify_layer_changed(layer_id):
+    '''
+    通知所有监听者图层已变更
+    '''
+    for listener in layer_listeners:
+        try:
+            listener(layer_id)
+        except Exception as e:
+            print(f"Map_service.py - Error notifying layer listener: {str(e)}")
+
+def _on_workspace_evicted(workspace):
+    '''
+    工作区被淘汰时通知其所有图层已移除
+    '''
+    for layer_id in workspace.registry.keys():
+        notify_layer_changed(layer_id)
+
+register_workspace_listener(_on_workspace_evicted)
+
+# 图层ID分配：同一秒内、多个线程或多个进程（共享 SQLite 注册表时）创建的图层也不会重复
+_layer_id_lock = threading.Lock()
+_layer_id_counter = 0
+_layer_id_time = 0
+
+def new_layer_id(prefix):
+    '''
+    生成唯一的图层ID：{prefix}_{秒级时间戳}_{进程ID}-{序号}
+    序号在进程内单调递增，进程ID区分不同的工作进程；两者以 '-' 分隔，避免不同进程拼出相同的ID
+    进程ID在调用时获取，应用在 fork 之前导入（如 gunicorn --preload）时各工作进程也不会相同
+    '''
+    global _layer_id_counter, _layer_id_time
+    with _layer_id_lock:
+        # 系统时间回拨时沿用上一次的时间戳，保证ID单调
+        _layer_id_time = max(_layer_id_time, int(time.time()))
+        _layer_id_counter += 1
+        return f"{prefix}_{_layer_id_time}_{os.getpid():x}-{_layer_id_counter:x}"
+
+def current_registry():
+    '''
+    获取当前请求所属工作区的图层注册表
+    '''
+    return current_workspace().registry
+
+# 当前工作区图层的只读视图
+datasets = LayerView(current_registry, 'dataset')
+datasetsNames = LayerView(current_registry, 'name')
 
 def get_dataset(layer_id):
     '''
     获取图层对应的数据集
     '''
     print(f"Map_service.py - get_dataset-layer_id: {layer_id}")
-    print(f"Map_service.py - get_dataset-datasets: {datasets}")
-    return datasets.get(layer_id)
+    return current_registry().get(layer_id)
 
 def get_all_datasets():
     '''
-    获取所有图层
+    获取所有图层（只读视图）
     '''
     return datasets,datasetsNames
 
-def save_dataset(layer_id, dataset, layer_name):
+def save_dataset(layer_id, dataset, layer_name, meta=None):
     '''
     保存图层
+    meta: 可选的图层元数据（可视化参数、统计值等），随图层一起保存在快照中
+    '''
+    for changed_id in current_registry().save(layer_id, dataset, layer_name, meta):
+        notify_layer_changed(changed_id)
+
+def rename_dataset(layer_id, layer_name):
     '''
-    datasets[layer_id] = dataset
-    datasetsNames[layer_id] = layer_name
+    重命名图层，不影响数据集
+    '''
+    current_registry().rename(layer_id, layer_name)
 
 def remove_dataset(layer_id):
     '''
     移除图层
     '''
-    if layer_id in datasets:
-        del datasets[layer_id]
-        del datasetsNames[layer_id]
-        print(f"Map_service.py - remove_dataset-datasets: {datasets}")
+    if current_registry().remove(layer_id):
+        notify_layer_changed(layer_id)
+        print(f"Map_service.py - remove_dataset-datasets: {current_registry().keys()}")
+
+def pin_layers(layer_ids):
+    '''
+    固定图层直到上下文结束
+    '''
+    return current_registry().pinned(layer_ids)
+
+def get_layer_metadata(layer_id):
+    '''
+    获取图层元数据：波段名称、波段类型、范围、默认投影和分辨率
+    首次访问时一次计算并保存在注册表中，之后直接从内存返回；图层不存在时返回 None
+    '''
+    registry = current_registry()
+    entry = registry.get_entry(layer_id)
+    if entry is None:
+        return None
+    if 'bounds' in entry.meta:
+        return entry.meta
+    description = describe(entry.dataset)
+    registry.update_meta(layer_id, description)
+    return dict(entry.meta, **description)
+
+def is_vector_layer(layer_id):
+    '''
+    图层是否为矢量图层：优先使用已保存的元数据，尚未计算元数据时按数据集类型判断，不发起请求
+    '''
+    entry = current_registry().get_entry(layer_id)
+    if entry is None:
+        return False
+    kind = entry.meta.get('kind')
+    if kind:
+        return kind == 'vector'
+    return isinstance(entry.dataset, (ee.FeatureCollection, ee.Feature, ee.Geometry))
+
+
+def get_band_names(layer_id):
+    '''
+    获取图层的波段名称，矢量图层或图层不存在时返回 None
+    '''
+    return (get_layer_metadata(layer_id) or {}).get('bands')
+
+
+def get_dataset_details(collection_id):
+    '''
+    获取数据集目录信息（标题、时间范围、波段等），结果缓存，不存在的数据集返回 None
+    '''
+    return cached_call('dataset', (collection_id,), lambda: fetch_dataset_details(collection_id))
 
 
 def compute_image_stats(dataset, bands,region=None):
@@ -96,10 +206,10 @@ def get_map_data_service(satellite, start_date, end_date, cloud_cover, region=No
     """获取地图数据服务"""
     try:
         # 移除全局 index 变量，直接使用时间戳作为唯一标识
-        layer_id = f"layer-{int(time.time())}-{satellite}"
+        layer_id = new_layer_id(f"layer-{satellite}")
         
         # 获取数据集信息
-        dataset_info = fetch_dataset_details(satellite)
+        dataset_info = get_dataset_details(satellite)
         if not dataset_info:
             raise ValueError(f"Unsupported satellite type: {satellite}")
 
@@ -112,9 +222,10 @@ def get_map_data_service(satellite, start_date, end_date, cloud_cover, region=No
                 collection = collection.filterDate(start_date, end_date)
             
             # 检查并应用云覆盖过滤
-            if 'CLOUD_COVER' in collection.first().propertyNames().getInfo():
+            property_names = cached_get_info(collection.first().propertyNames())
+            if 'CLOUD_COVER' in property_names:
                 collection = collection.filter(ee.Filter.lt('CLOUD_COVER', cloud_cover))
-            elif 'CLOUDY_PIXEL_PERCENTAGE' in collection.first().propertyNames().getInfo():
+            elif 'CLOUDY_PIXEL_PERCENTAGE' in property_names:
                 collection = collection.filter(ee.Filter.lt('CLOUDY_PIXEL_PERCENTAGE', cloud_cover))
             else:
                 print("No cloud cover attribute found for filtering.")
@@ -157,10 +268,17 @@ def get_map_data_service(satellite, start_date, end_date, cloud_cover, region=No
 
         # 计算统计值
         stats = compute_image_stats(dataset, vis_params['bands'], region)
+        meta = {'satellite': satellite}
 
-        # 如果计算成功，使用计算值
+        # 如果计算成功，使用计算值；图层元数据随统计值一次求值，元数据失败不影响统计值
         if stats:
-            stats_dict = stats.getInfo()
+            errors = {}
+            values = evaluate_batch({'stats': stats, 'meta': metadata_expression(dataset)}, errors, lane='aggregation')
+            if 'stats' in errors:
+                raise errors['stats']
+            if 'meta' not in errors:
+                meta.update(normalize_metadata(values['meta']))
+            stats_dict = values['stats']
             img_min = stats_dict.get('global_min')
             img_max = stats_dict.get('global_max')
 
@@ -173,10 +291,11 @@ def get_map_data_service(satellite, start_date, end_date, cloud_cover, region=No
 
         # 存储数据集
         layer_name = f"{dataset_info['title']} ({start_date} to {end_date})"
-        save_dataset(layer_id, dataset, layerName or layer_name)
+        meta['visParams'] = vis_params
+        save_dataset(layer_id, dataset, layerName or layer_name, meta)
 
         # 获取地图ID
-        map_id = dataset.getMapId(vis_params)
+        map_id = cached_get_map_id(dataset, vis_params)
 
         return {
             'center': [20, 0],
@@ -214,24 +333,13 @@ def update_layer_order(layers):
         layers: 包含图层ID和索引的列表
     '''
     try:
-        # 创建临时字典存储数据集
-        temp_datasets = {}
-        temp_names = {}
-        
-        # 按新的顺序重新组织数据集
-        for layer in sorted(layers, key=lambda x: x['index'], reverse=True):
-            layer_id = layer['id']
-            if layer_id in datasets:
-                temp_datasets[layer_id] = datasets[layer_id]
-                temp_names[layer_id] = datasetsNames[layer_id]
-        
-        datasets.clear()
-        datasetsNames.clear()
-        datasets.update(temp_datasets)
-        datasetsNames.update(temp_names)
+        # 按新的顺序重新排列图层，未列出的图层被移除
+        ordered = [layer['id'] for layer in sorted(layers, key=lambda x: x['index'], reverse=True)]
+        for layer_id in current_registry().reorder(ordered):
+            notify_layer_changed(layer_id)
         
         return True, '图层顺序更新成功'
         
     except Exception as e:
         print(f"Error updating layer order: {str(e)}")
-        return False, str(e)        
+        return False, str(e)
@@ -0,0 +1,33 @@
+import threading
+
+# 各模块注册的指标提供函数：名称 -> 返回 dict 的函数
+_providers = {}
+_lock = threading.Lock()
+
+
+def register_metrics(name, provider):
+    '''
+    注册指标提供函数
+    Args:
+        name: 指标分组名称
+        provider: 无参函数，返回该分组的指标字典
+    '''
+    with _lock:
+        _providers[name] = provider
+
+
+def collect_metrics():
+    '''
+    收集所有已注册的指标
+    '''
+    with _lock:
+        providers = dict(_providers)
+
+    metrics = {}
+    for name, provider in providers.items():
+        try:
+            metrics[name] = provider()
+        except Exception as e:
+            print(f"Metrics.py - Error collecting metrics {name}: {str(e)}")
+            metrics[name] = {'error': str(e)}
+    return metrics
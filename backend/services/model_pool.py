@@ -0,0 +1,123 @@
+import threading
+import time
+from contextlib import contextmanager
+
+
+class ModelPool:
+    """
+    模型池：每个模型实例只加载一次，常驻内存，按需租借给请求
+
+    Args:
+        name: 模型池名称，用于日志和指标
+        factory: 无参函数，返回一个新的模型实例
+        size: 最多同时存在的模型实例数量
+        lease_timeout: 等待空闲实例的超时时间（秒），None 表示一直等待
+    """
+
+    def __init__(self, name, factory, size=1, lease_timeout=None):
+        self.name = name
+        self.factory = factory
+        self.size = max(1, int(size))
+        self.lease_timeout = lease_timeout
+
+        self._cond = threading.Condition()
+        self._idle = []      # 空闲的模型实例
+        self._created = 0    # 已创建（或正在加载）的实例数
+        self._in_use = 0
+
+        # 统计信息
+        self._load_times = []
+        self._lease_count = 0
+        self._lease_wait_total = 0.0
+        self._lease_wait_max = 0.0
+
+    def _load(self):
+        '''
+        加载一个新的模型实例
+        '''
+        start = time.perf_counter()
+        model = self.factory()
+        load_time = time.perf_counter() - start
+        with self._cond:
+            self._load_times.append(load_time)
+        print(f"Model_pool.py - {self.name} loaded in {load_time:.2f}s "
+              f"({self._created}/{self.size})")
+        return model
+
+    @contextmanager
+    def lease(self, timeout=None):
+        '''
+        租借一个模型实例，使用完毕后自动归还
+        Args:
+            timeout: 等待超时时间（秒），默认使用池的 lease_timeout
+        '''
+        timeout = self.lease_timeout if timeout is None else timeout
+        start = time.perf_counter()
+        deadline = None if timeout is None else start + timeout
+        model = None
+        need_load = False
+
+        with self._cond:
+            while True:
+                if self._idle:
+                    model = self._idle.pop()
+                    break
+                if self._created < self.size:
+                    # 还有名额，由当前请求负责加载新实例
+                    self._created += 1
+                    need_load = True
+                    break
+                remaining = None if deadline is None else deadline - time.perf_counter()
+                if remaining is not None and remaining <= 0:
+                    raise TimeoutError(f"Timed out waiting for model {self.name}")
+                self._cond.wait(remaining)
+            self._in_use += 1
+
+        if need_load:
+            try:
+                model = self._load()
+            except Exception:
+                # 加载失败时释放名额，让其他请求可以重试
+                with self._cond:
+                    self._created -= 1
+                    self._in_use -= 1
+                    self._cond.notify()
+                raise
+
+        wait_time = time.perf_counter() - start
+        with self._cond:
+            self._lease_count += 1
+            self._lease_wait_total += wait_time
+            self._lease_wait_max = max(self._lease_wait_max, wait_time)
+        print(f"Model_pool.py - {self.name} leased after {wait_time:.3f}s")
+
+        try:
+            yield model
+        finally:
+            with self._cond:
+                self._idle.append(model)
+                self._in_use -= 1
+                self._cond.notify()
+
+    def warmup(self):
+        '''
+        预加载一个模型实例
+        '''
+        with self.lease():
+            pass
+
+    def get_stats(self):
+        '''
+        获取模型池统计信息
+        '''
+        with self._cond:
+            return {
+                'size': self.size,
+                'loaded': len(self._load_times),
+                'idle': len(self._idle),
+                'in_use': self._in_use,
+                'load_times': [round(t, 3) for t in self._load_times],
+                'lease_count': self._lease_count,
+                'lease_wait_avg': round(self._lease_wait_total / self._lease_count, 4) if self._lease_count else 0.0,
+                'lease_wait_max': round(self._lease_wait_max, 4)
+            }
@@ -0,0 +1,193 @@
+import os
+import ee
+import json
+import time
+import threading
+from .layer_store import connect, transaction, TOUCH_INTERVAL
+from .eval_cache import EvalCache
+from .common import evaluate_batch
+from .metrics import register_metrics
+from .map_service import register_layer_listener
+
+# 统计结果磁盘缓存：数据库路径、大小上限（MB，0 表示不缓存）和有效期（秒，0 表示不过期）
+REDUCE_CACHE_PATH = os.environ.get('VGEE_REDUCE_CACHE_DB', os.path.join(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'data', 'reduce_cache.db'))
+REDUCE_CACHE_MB = float(os.environ.get('VGEE_REDUCE_CACHE_MB', 256))
+REDUCE_CACHE_TTL = float(os.environ.get('VGEE_REDUCE_CACHE_TTL', 24 * 3600))
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS reductions (
+    key TEXT PRIMARY KEY,
+    layer_id TEXT,
+    value TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    created REAL NOT NULL,
+    last_access REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS reductions_layer ON reductions (layer_id);
+CREATE INDEX IF NOT EXISTS reductions_access ON reductions (last_access);
+CREATE INDEX IF NOT EXISTS reductions_created ON reductions (created);
+'''
+
+
+class ReduceCache:
+    """
+    全范围统计（reduceRegion、直方图等）结果的磁盘缓存
+
+    - 保存在 SQLite（WAL 模式）中，重启后仍然有效，多个工作进程共享
+    - 键为整个统计表达式的摘要，影像表达式、reducer、分辨率和区域任一变化都会得到新的键
+    - 结果记录所属图层，图层被替换或移除时删除其结果；超出大小上限时淘汰最久未使用的结果
+    - 键无法反映底层数据的变化（如截止到“今天”的影像集合、同一ID下被覆盖的资产），结果超过有效期后重新计算
+
+    Args:
+        path: 数据库文件路径
+        max_bytes: 缓存总大小上限（字节），0 表示不缓存
+        ttl: 结果有效期（秒，从计算时起），0 表示不过期
+    """
+
+    def __init__(self, path, max_bytes, ttl=0):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._stats = {'hits': 0, 'misses': 0, 'expired': 0, 'stores': 0, 'evictions': 0, 'invalidations': 0}
+
+    def _conn(self):
+        return connect(self.path, SCHEMA)
+
+    def _count(self, field, value=1):
+        with self._lock:
+            self._stats[field] += value
+
+    def get(self, key):
+        '''
+        查找统计结果，返回 (是否命中, 结果)
+        '''
+        if not self.max_bytes:
+            return False, None
+        conn = self._conn()
+        row = conn.execute('SELECT value, created, last_access FROM reductions WHERE key = ?', (key,)).fetchone()
+        if row is None:
+            self._count('misses')
+            return False, None
+        now = time.time()
+        if self.ttl and now - row[1] > self.ttl:
+            conn.execute('DELETE FROM reductions WHERE key = ?', (key,))
+            self._count('expired')
+            self._count('misses')
+            return False, None
+        self._count('hits')
+        if now - row[2] > TOUCH_INTERVAL:
+            conn.execute('UPDATE reductions SET last_access = ? WHERE key = ?', (now, key))
+        return True, json.loads(row[0])
+
+    def put(self, key, value, layer_id=None):
+        '''
+        保存统计结果，layer_id 为结果所属的图层（图层变更时失效）
+        '''
+        if not self.max_bytes or value is None:
+            return
+        data = json.dumps(value)
+        size = len(data)
+        if size > self.max_bytes:
+            return
+        now = time.time()
+        conn = self._conn()
+        with transaction(conn):
+            conn.execute('INSERT OR REPLACE INTO reductions VALUES (?, ?, ?, ?, ?, ?)',
+                         (key, layer_id, data, size, now, now))
+            evicted = self._evict(conn)
+        self._count('stores')
+        if evicted:
+            self._count('evictions', evicted)
+
+    def _evict(self, conn):
+        '''
+        删除过期的结果，超出大小上限时再按最近访问时间淘汰，返回删除的条数
+        '''
+        evicted = 0
+        if self.ttl:
+            evicted += conn.execute('DELETE FROM reductions WHERE created < ?',
+                                    (time.time() - self.ttl,)).rowcount
+        total = conn.execute('SELECT COALESCE(SUM(size), 0) FROM reductions').fetchone()[0]
+        while total > self.max_bytes:
+            rows = conn.execute('SELECT key, size FROM reductions ORDER BY last_access LIMIT 64').fetchall()
+            if not rows:
+                break
+            for key, size in rows:
+                if total <= self.max_bytes:
+                    break
+                conn.execute('DELETE FROM reductions WHERE key = ?', (key,))
+                total -= size
+                evicted += 1
+        return evicted
+
+    def invalidate_layer(self, layer_id):
+        '''
+        删除图层的所有统计结果
+        '''
+        if not self.max_bytes:
+            return
+        conn = self._conn()
+        removed = conn.execute('DELETE FROM reductions WHERE layer_id = ?', (layer_id,)).rowcount
+        if removed:
+            self._count('invalidations', removed)
+
+    def get_stats(self):
+        stats = {'path': self.path, 'max_bytes': self.max_bytes, 'ttl': self.ttl}
+        with self._lock:
+            stats.update(self._stats)
+        if self.max_bytes:
+            entries, size = self._conn().execute(
+                'SELECT COUNT(*), COALESCE(SUM(size), 0) FROM reductions').fetchone()
+            stats.update({'entries': entries, 'bytes': size})
+        return stats
+
+
+if REDUCE_CACHE_MB:
+    os.makedirs(os.path.dirname(REDUCE_CACHE_PATH), exist_ok=True)
+reduce_cache = ReduceCache(REDUCE_CACHE_PATH, int(REDUCE_CACHE_MB * 1024 * 1024), REDUCE_CACHE_TTL)
+register_metrics('reduce_cache', reduce_cache.get_stats)
+
+
+def _on_layer_changed(layer_id):
+    reduce_cache.invalidate_layer(layer_id)
+
+register_layer_listener(_on_layer_changed)
+
+
+def evaluate_reductions(values, layer_id=None, errors=None):
+    '''
+    求值统计结果：已缓存的直接返回，其余一次批量求值后写入磁盘缓存
+    values: 名称 -> 统计表达式（如 reduceRegion 的结果）
+    layer_id: 统计所属的图层（可选），图层被替换或移除时其缓存结果失效；
+              各项统计属于不同图层时传入 名称 -> 图层ID 的字典
+    errors: 同 evaluate_batch，收集各个名称的异常，省略时直接抛出第一个异常
+    '''
+    results = {}
+    pending = {}
+    keys = {}
+    for name, value in values.items():
+        if not isinstance(value, ee.ComputedObject):
+            results[name] = value
+            continue
+        keys[name] = EvalCache.make_key('reduction', value)
+        found, cached = reduce_cache.get(keys[name])
+        if found:
+            results[name] = cached
+        else:
+            pending[name] = value
+
+    if pending:
+        failures = {}
+        resolved = evaluate_batch(pending, failures, lane='aggregation')
+        for name, value in resolved.items():
+            if name not in failures:
+                owner = layer_id.get(name) if isinstance(layer_id, dict) else layer_id
+                reduce_cache.put(keys[name], value, owner)
+        results.update(resolved)
+        if failures:
+            if errors is None:
+                raise next(iter(failures.values()))
+            errors.update(failures)
+    return results
@@ -1,8 +1,10 @@
 import ee
 from typing import List, Dict, Any, Union
+from .workspace import current_workspace, QuotaExceededError
 
-# 存储样本数据的字典
-samples_dict = {}
+def _samples() -> Dict[str, Dict[str, Any]]:
+    # 样本数据保存在当前请求的工作区中，返回副本；修改使用 edit_samples
+    return current_workspace().samples
 
 def add_sample_service(
     layer_id: str,
@@ -34,7 +36,11 @@ def add_sample_service(
         }
         
         # 存储样本数据
-        samples_dict[layer_id] = sample_data
+        workspace = current_workspace()
+        with workspace.edit_samples() as samples:
+            if layer_id not in samples:
+                workspace.check_quota('samples', len(samples) + 1)
+            samples[layer_id] = sample_data
         
         print(f"Sample_service.py - Added sample for layer {layer_id}: {sample_data}")
         
@@ -43,6 +49,8 @@ def add_sample_service(
             'message': f'Successfully added sample for class {class_name}'
         }
         
+    except QuotaExceededError:
+        raise
     except Exception as e:
         print(f"Sample_service.py - Error in add_sample_service: {str(e)}")
         raise Exception(f"Failed to add sample: {str(e)}")
@@ -58,10 +66,11 @@ def remove_sample_service(layer_id: str) -> Dict[str, Union[bool, str]]:
         包含操作结果的字典
     """
     try:
-        if layer_id in samples_dict:
+        with current_workspace().edit_samples() as samples:
             # 移除样本数据
             # pop() 方法会从字典中移除指定键的项并返回其值
-            removed_sample = samples_dict.pop(layer_id)
+            removed_sample = samples.pop(layer_id, None)
+        if removed_sample is not None:
             print(f"Sample_service.py - Removed sample for layer {layer_id}")
             
             return {
@@ -83,6 +92,6 @@ def get_all_samples() -> Dict[str, Dict[str, Any]]:
     获取所有样本数据
     
     Returns:
-        所有样本数据的字典
+        所有样本数据的字典（副本）
     """
-    return samples_dict 
\ No newline at end of file
+    return _samples()
\ No newline at end of file
@@ -0,0 +1,103 @@
+import os
+import json
+import time
+
+# 快照配置：保存目录、保留天数（超过未更新的快照在启动时删除）
+SNAPSHOT_DIR = os.environ.get('VGEE_SNAPSHOT_DIR', os.path.join(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'data', 'snapshots'))
+SNAPSHOT_RETENTION_DAYS = float(os.environ.get('VGEE_SNAPSHOT_RETENTION_DAYS', 7))
+
+SNAPSHOT_VERSION = 1
+
+
+def snapshot_path(workspace_id):
+    # 工作区ID已限定为 [A-Za-z0-9_-]，可以直接作为文件名
+    return os.path.join(SNAPSHOT_DIR, f'{workspace_id}.json')
+
+
+def write_snapshot(workspace):
+    '''
+    将工作区的图层表达式、元数据、样本和研究区域写入快照文件
+    先写临时文件再替换，写入过程中崩溃不会损坏已有快照
+    样本和研究区域在工作区状态的锁内复制，请求线程同时修改时不会写入不完整的状态
+    '''
+    state = {
+        'version': SNAPSHOT_VERSION,
+        'workspace': workspace.id,
+        'saved': time.time(),
+        'layers': workspace.registry.export()
+    }
+    # 共享数据库中的样本和研究区域不写入快照，避免各进程的快照互相覆盖
+    if not workspace.state.persistent:
+        state['samples'] = workspace.samples
+        state['study_areas'] = workspace.study_areas
+    os.makedirs(SNAPSHOT_DIR, exist_ok=True)
+    path = snapshot_path(workspace.id)
+    tmp_path = f'{path}.{os.getpid()}.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(state, f, ensure_ascii=False)
+    os.replace(tmp_path, path)
+    return len(state['layers'])
+
+
+def read_snapshot(workspace_id):
+    '''
+    读取工作区快照，不存在或格式不兼容时返回 None
+    '''
+    path = snapshot_path(workspace_id)
+    if not os.path.exists(path):
+        return None
+    try:
+        with open(path, encoding='utf-8') as f:
+            state = json.load(f)
+    except (OSError, ValueError) as e:
+        print(f"Snapshot.py - Error reading snapshot {path}: {str(e)}")
+        return None
+    if state.get('version') != SNAPSHOT_VERSION:
+        print(f"Snapshot.py - Ignoring snapshot {path} with version {state.get('version')}")
+        return None
+    return state
+
+
+def restore_snapshot(workspace):
+    '''
+    从快照恢复工作区：图层只恢复表达式，首次使用时才反序列化，不调用 getInfo
+    返回是否恢复成功
+    '''
+    start = time.perf_counter()
+    state = read_snapshot(workspace.id)
+    if state is None:
+        return False
+    if not workspace.registry.persistent:
+        workspace.registry.restore(state.get('layers', []))
+    if not workspace.state.persistent:
+        with workspace.edit_samples() as samples:
+            samples.update(state.get('samples', {}))
+        with workspace.edit_study_areas() as study_areas:
+            study_areas.extend(state.get('study_areas', []))
+    print(f"Snapshot.py - restored workspace {workspace.id}: {len(state.get('layers', []))} layers, "
+          f"{len(state.get('samples', {}))} samples, {len(state.get('study_areas', []))} study areas "
+          f"in {(time.perf_counter() - start) * 1000:.1f}ms")
+    return True
+
+
+def prune_snapshots(retention_days=SNAPSHOT_RETENTION_DAYS):
+    '''
+    删除超过保留期未更新的快照和残留的临时文件
+    '''
+    if not retention_days or not os.path.isdir(SNAPSHOT_DIR):
+        return 0
+    now = time.time()
+    expire_before = now - retention_days * 86400
+    removed = 0
+    for name in os.listdir(SNAPSHOT_DIR):
+        path = os.path.join(SNAPSHOT_DIR, name)
+        try:
+            mtime = os.path.getmtime(path)
+            # 临时文件可能正在被其他进程写入，一小时后仍存在才视为残留
+            if mtime < expire_before or (name.endswith('.tmp') and mtime < now - 3600):
+                os.remove(path)
+                removed += 1
+        except OSError:
+            pass
+    return removed
@@ -0,0 +1,133 @@
+import os
+import threading
+from collections import OrderedDict
+import numpy as np
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from .map_service import register_layer_listener
+from .ee_concurrency import ee_call
+from .metrics import register_metrics
+
+# 缩略图下载配置
+THUMBNAIL_CONNECT_TIMEOUT = float(os.environ.get('VGEE_THUMBNAIL_CONNECT_TIMEOUT', 10))
+THUMBNAIL_READ_TIMEOUT = float(os.environ.get('VGEE_THUMBNAIL_READ_TIMEOUT', 120))
+THUMBNAIL_RETRIES = int(os.environ.get('VGEE_THUMBNAIL_RETRIES', 3))
+THUMBNAIL_CACHE_MB = int(os.environ.get('VGEE_THUMBNAIL_CACHE_MB', 64))
+
+
+def _build_session():
+    '''
+    创建带连接池、重试的 HTTP 会话
+    '''
+    retry = Retry(
+        total=THUMBNAIL_RETRIES,
+        backoff_factor=0.5,
+        status_forcelist=[429, 500, 502, 503, 504],
+        allowed_methods=['GET']
+    )
+    adapter = HTTPAdapter(pool_connections=4, pool_maxsize=16, max_retries=retry)
+    session = requests.Session()
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    return session
+
+
+_session = _build_session()
+
+
+class ThumbnailCache:
+    """
+    缩略图字节缓存：按字节数限制的 LRU，保存压缩后的 PNG 字节
+    键的第一个元素为图层ID，图层变更时按图层失效
+    """
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        with self._lock:
+            content = self._entries.get(key)
+            if content is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return content
+
+    def put(self, key, content):
+        if len(content) > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._entries:
+                self._bytes -= len(self._entries.pop(key))
+            self._entries[key] = content
+            self._bytes += len(content)
+            while self._bytes > self.max_bytes and self._entries:
+                _, evicted = self._entries.popitem(last=False)
+                self._bytes -= len(evicted)
+
+    def invalidate_layer(self, layer_id):
+        with self._lock:
+            for key in [k for k in self._entries if k[0] == layer_id]:
+                self._bytes -= len(self._entries.pop(key))
+
+    def get_stats(self):
+        with self._lock:
+            return {
+                'entries': len(self._entries),
+                'bytes': self._bytes,
+                'max_bytes': self.max_bytes,
+                'hits': self.hits,
+                'misses': self.misses
+            }
+
+
+thumbnail_cache = ThumbnailCache(THUMBNAIL_CACHE_MB * 1024 * 1024)
+register_layer_listener(thumbnail_cache.invalidate_layer)
+register_metrics('thumbnail_cache', thumbnail_cache.get_stats)
+
+
+def download(url):
+    '''
+    使用共享会话下载内容
+    '''
+    response = _session.get(url, timeout=(THUMBNAIL_CONNECT_TIMEOUT, THUMBNAIL_READ_TIMEOUT))
+    response.raise_for_status()
+    return response.content
+
+
+def decode_image(content):
+    '''
+    将图像字节直接解码为 RGB 数组
+    '''
+    import cv2
+
+    image = cv2.imdecode(np.frombuffer(content, dtype=np.uint8), cv2.IMREAD_COLOR)
+    if image is None:
+        raise ValueError("Failed to decode thumbnail")
+    return cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
+
+
+def load_thumbnail(image, thumb_params, cache_key=None):
+    '''
+    获取 ee.Image 的缩略图并解码为 RGB 数组，不落盘
+    Args:
+        image: ee.Image
+        thumb_params: getThumbURL 参数
+        cache_key: 缓存键 (图层ID, ...)，命中时跳过 getThumbURL 和下载
+    '''
+    content = thumbnail_cache.get(cache_key) if cache_key is not None else None
+    if content is None:
+        # 与 getMapId 相同，经由限流和重试调用
+        url = ee_call('interactive', image.getThumbURL, thumb_params)
+        print(f"Thumbnail.py - Generated URL: {url}")
+        content = download(url)
+        if cache_key is not None:
+            thumbnail_cache.put(cache_key, content)
+    return decode_image(content)
@@ -0,0 +1,421 @@
+import os
+import re
+import time
+import copy
+import atexit
+import threading
+from contextlib import contextmanager
+from contextvars import ContextVar
+from .layer_registry import LayerRegistry
+from .layer_store import SqliteLayerRegistry, SqliteWorkspaceState
+from .metrics import register_metrics
+from .snapshot import write_snapshot, restore_snapshot, prune_snapshots
+
+# 工作区配置
+WORKSPACE_HEADER = 'X-Workspace-Id'
+DEFAULT_WORKSPACE = 'default'
+MAX_WORKSPACES = int(os.environ.get('VGEE_MAX_WORKSPACES', 100))
+WORKSPACE_IDLE_TIMEOUT = float(os.environ.get('VGEE_WORKSPACE_IDLE_TIMEOUT', 4 * 3600))   # 秒，0 表示不过期
+
+# 每个工作区的配额：最多保存的图层数、图层闲置过期时间（秒，0 表示不过期）、图层表达式总大小上限、
+# 样本图层数、研究区域数
+MAX_LAYERS = int(os.environ.get('VGEE_MAX_LAYERS', 200))
+LAYER_TTL = float(os.environ.get('VGEE_LAYER_TTL', 0))
+LAYER_MAX_MB = float(os.environ.get('VGEE_LAYER_MAX_MB', 512))
+MAX_SAMPLES = int(os.environ.get('VGEE_WORKSPACE_MAX_SAMPLES', 500))
+MAX_STUDY_AREAS = int(os.environ.get('VGEE_WORKSPACE_MAX_STUDY_AREAS', 200))
+
+# 图层注册表后端：memory 为进程内存（单进程），sqlite 为多进程共享的本地数据库（可用 gunicorn -w N 部署）
+LAYER_BACKEND = os.environ.get('VGEE_LAYER_BACKEND', 'memory')
+LAYER_DB_PATH = os.environ.get('VGEE_LAYER_DB', os.path.join(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'data', 'layers.db'))
+LAYER_CACHE_SIZE = int(os.environ.get('VGEE_LAYER_CACHE_SIZE', 64))
+
+# 工作区快照间隔（秒），0 表示不保存也不恢复快照
+SNAPSHOT_INTERVAL = float(os.environ.get('VGEE_SNAPSHOT_INTERVAL', 30))
+
+SWEEP_INTERVAL = 60
+_WORKSPACE_ID_PATTERN = re.compile(r'^[A-Za-z0-9_-]{1,64}$')
+
+
+class QuotaExceededError(Exception):
+    """
+    工作区配额已满
+    """
+
+
+def create_registry(workspace_id):
+    '''
+    按配置的后端创建工作区的图层注册表
+    '''
+    max_bytes = int(LAYER_MAX_MB * 1024 * 1024)
+    if LAYER_BACKEND == 'sqlite':
+        os.makedirs(os.path.dirname(LAYER_DB_PATH), exist_ok=True)
+        return SqliteLayerRegistry(LAYER_DB_PATH, workspace_id, MAX_LAYERS, LAYER_TTL, max_bytes, LAYER_CACHE_SIZE)
+    if LAYER_BACKEND != 'memory':
+        raise ValueError(f"Unknown layer backend: {LAYER_BACKEND}")
+    return LayerRegistry(MAX_LAYERS, LAYER_TTL, max_bytes)
+
+
+class WorkspaceState:
+    """
+    保存在进程内存中的工作区状态（样本、研究区域），读写都使用副本，修改在锁内串行
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._values = {}
+
+    persistent = False
+
+    def load(self, name, default):
+        with self._lock:
+            return copy.deepcopy(self._values.get(name, default))
+
+    @contextmanager
+    def edit(self, name, default):
+        '''
+        交给调用方修改状态的副本，正常退出时替换原值，出错时保持不变
+        '''
+        with self._lock:
+            value = copy.deepcopy(self._values.get(name, default))
+            yield value
+            self._values[name] = value
+
+
+def create_state(workspace_id):
+    '''
+    按配置的后端创建工作区状态：sqlite 后端时样本和研究区域也保存在共享数据库中
+    '''
+    if LAYER_BACKEND == 'sqlite':
+        os.makedirs(os.path.dirname(LAYER_DB_PATH), exist_ok=True)
+        return SqliteWorkspaceState(LAYER_DB_PATH, workspace_id)
+    return WorkspaceState()
+
+
+class Workspace:
+    """
+    一个客户端会话的工作区：图层注册表、样本和研究区域
+    """
+
+    def __init__(self, workspace_id):
+        self.id = workspace_id
+        self.registry = create_registry(workspace_id)
+        self.state = create_state(workspace_id)
+        self.created = time.time()
+        self.last_access = self.created
+        self.active = 0   # 正在处理的请求数，大于 0 时不会被淘汰
+        self.revision = 0   # 样本或研究区域每次修改递增
+        self.saved_revision = self.state_revision()
+        self.snapshot_lock = threading.Lock()   # 同一工作区的快照依次写入
+
+    def mark_changed(self):
+        '''
+        样本或研究区域修改后调用，快照据此判断是否需要重新写入
+        '''
+        self.revision += 1
+
+    @property
+    def samples(self):
+        '''
+        样本数据的副本：图层ID -> 样本
+        '''
+        return self.state.load('samples', {})
+
+    @property
+    def study_areas(self):
+        '''
+        研究区域列表的副本
+        '''
+        return self.state.load('study_areas', [])
+
+    @contextmanager
+    def edit_samples(self):
+        '''
+        修改样本数据，退出时保存；共享数据库中的状态不需要快照
+        '''
+        with self.state.edit('samples', {}) as samples:
+            yield samples
+        if not self.state.persistent:
+            self.mark_changed()
+
+    @contextmanager
+    def edit_study_areas(self):
+        '''
+        修改研究区域列表，退出时保存
+        '''
+        with self.state.edit('study_areas', []) as study_areas:
+            yield study_areas
+        if not self.state.persistent:
+            self.mark_changed()
+
+    def state_revision(self):
+        return self.registry.revision, self.revision
+
+    def check_quota(self, kind, count):
+        '''
+        检查样本或研究区域数量是否超出配额
+        '''
+        limit = {'samples': MAX_SAMPLES, 'study_areas': MAX_STUDY_AREAS}[kind]
+        if limit and count > limit:
+            raise QuotaExceededError(f"Workspace {kind} quota exceeded ({limit})")
+
+    def get_stats(self):
+        return {
+            'layers': len(self.registry),
+            'samples': len(self.samples),
+            'study_areas': len(self.study_areas),
+            'idle': round(time.time() - self.last_access, 1),
+            'active': self.active
+        }
+
+
+class WorkspaceManager:
+    """
+    工作区管理：按客户端令牌创建工作区，闲置超时或数量超限时淘汰最久未使用的工作区
+
+    Args:
+        max_workspaces: 最多同时存在的工作区数量
+        idle_timeout: 工作区闲置过期时间（秒），0 表示不过期
+    """
+
+    def __init__(self, max_workspaces, idle_timeout):
+        self.max_workspaces = max_workspaces
+        self.idle_timeout = idle_timeout
+        self._lock = threading.Lock()
+        self._workspaces = {}
+        self._loading = {}    # 正在创建（恢复快照）或淘汰（写入快照）的工作区ID -> 完成事件
+        self._listeners = []
+        self._last_sweep = time.time()
+        self.evictions = 0
+        self.snapshots = 0
+
+    def register_listener(self, listener):
+        '''
+        注册工作区淘汰监听函数 listener(workspace)
+        '''
+        self._listeners.append(listener)
+
+    def get(self, workspace_id, acquire=False):
+        '''
+        获取工作区，不存在时创建
+        acquire 为 True 时标记为使用中，需配合 release 使用
+        创建和恢复快照在全局锁之外进行，同一工作区的并发请求等待第一个请求完成，其他工作区的请求不受影响
+        淘汰和重新创建同一工作区依次进行：淘汰时的快照写完后才从快照恢复
+        '''
+        created = None
+        while True:
+            with self._lock:
+                workspace = self._workspaces.get(workspace_id)
+                if workspace is None and created is not None:
+                    workspace = self._workspaces[workspace_id] = created
+                    self._loading.pop(workspace_id).set()
+                    print(f"Workspace.py - created workspace {workspace_id} ({len(self._workspaces)} total)")
+                if workspace is not None:
+                    workspace.last_access = time.time()
+                    if acquire:
+                        workspace.active += 1
+                    evicted = self._sweep(keep=workspace_id)
+                    # 被淘汰的工作区写完快照之前，同一ID的新请求等待，不会恢复到旧快照
+                    for old in evicted:
+                        self._loading[old.id] = threading.Event()
+                    break
+                loading = self._loading.get(workspace_id)
+                owner = loading is None
+                if owner:
+                    loading = self._loading[workspace_id] = threading.Event()
+
+            if owner:
+                created = self._create(workspace_id, loading)
+            else:
+                loading.wait()
+
+        for old in evicted:
+            try:
+                self._notify(old)
+                # 淘汰前写入快照，客户端再次访问时从快照恢复
+                if SNAPSHOT_INTERVAL:
+                    self._snapshot(old)
+                old.registry.discard(self.idle_timeout)
+            finally:
+                with self._lock:
+                    self._loading.pop(old.id).set()
+        return workspace
+
+    def _create(self, workspace_id, loading):
+        '''
+        创建工作区并从快照恢复（不持有全局锁）；失败时唤醒等待的请求，由它们重试
+        '''
+        try:
+            workspace = Workspace(workspace_id)
+            if SNAPSHOT_INTERVAL:
+                self._restore(workspace)
+            return workspace
+        except Exception:
+            with self._lock:
+                self._loading.pop(workspace_id, None)
+            loading.set()
+            raise
+
+    def release(self, workspace):
+        with self._lock:
+            workspace.active -= 1
+            workspace.last_access = time.time()
+
+    def _sweep(self, keep):
+        '''
+        淘汰闲置超时的工作区，以及超出数量上限时最久未使用的工作区；默认工作区和使用中的工作区不淘汰
+        '''
+        now = time.time()
+        over_limit = self.max_workspaces and len(self._workspaces) > self.max_workspaces
+        if not over_limit and now - self._last_sweep < SWEEP_INTERVAL:
+            return []
+        self._last_sweep = now
+
+        candidates = sorted(
+            (ws for ws in self._workspaces.values()
+             if ws.id not in (keep, DEFAULT_WORKSPACE) and ws.active == 0),
+            key=lambda ws: ws.last_access
+        )
+        evicted = []
+        for workspace in candidates:
+            expired = self.idle_timeout and now - workspace.last_access > self.idle_timeout
+            over_limit = self.max_workspaces and len(self._workspaces) > self.max_workspaces
+            if not (expired or over_limit):
+                break
+            del self._workspaces[workspace.id]
+            evicted.append(workspace)
+
+        if evicted:
+            self.evictions += len(evicted)
+            print(f"Workspace.py - evicted workspaces: {[ws.id for ws in evicted]}")
+        return evicted
+
+    def _restore(self, workspace):
+        try:
+            if restore_snapshot(workspace):
+                workspace.saved_revision = workspace.state_revision()
+        except Exception as e:
+            print(f"Workspace.py - Error restoring workspace {workspace.id}: {str(e)}")
+
+    def _snapshot(self, workspace):
+        '''
+        工作区自上次快照后有修改时写入快照；同一工作区的快照依次写入，后写入的不会是较旧的状态
+        '''
+        with workspace.snapshot_lock:
+            revision = workspace.state_revision()
+            if revision == workspace.saved_revision:
+                return False
+            try:
+                write_snapshot(workspace)
+                workspace.saved_revision = revision
+                self.snapshots += 1
+                return True
+            except Exception as e:
+                print(f"Workspace.py - Error writing snapshot for {workspace.id}: {str(e)}")
+                return False
+
+    def snapshot_all(self):
+        '''
+        为所有有修改的工作区写入快照
+        '''
+        with self._lock:
+            workspaces = list(self._workspaces.values())
+        return sum(1 for workspace in workspaces if self._snapshot(workspace))
+
+    def _notify(self, workspace):
+        for listener in self._listeners:
+            try:
+                listener(workspace)
+            except Exception as e:
+                print(f"Workspace.py - Error notifying workspace listener: {str(e)}")
+
+    def get_stats(self):
+        with self._lock:
+            return {
+                'backend': LAYER_BACKEND,
+                'workspaces': len(self._workspaces),
+                'max_workspaces': self.max_workspaces,
+                'idle_timeout': self.idle_timeout,
+                'evictions': self.evictions,
+                'snapshots': self.snapshots,
+                'details': {ws_id: ws.get_stats() for ws_id, ws in self._workspaces.items()}
+            }
+
+
+workspace_manager = WorkspaceManager(MAX_WORKSPACES, WORKSPACE_IDLE_TIMEOUT)
+register_metrics('workspaces', workspace_manager.get_stats)
+
+# 当前请求所属的工作区，由 activate_workspace 设置；并行处理的子线程通过 contextvars 继承
+_current_workspace = ContextVar('workspace', default=None)
+
+
+def normalize_workspace_id(workspace_id):
+    '''
+    校验客户端提供的工作区ID，无效时使用默认工作区
+    '''
+    if workspace_id and _WORKSPACE_ID_PATTERN.match(workspace_id):
+        return workspace_id
+    return DEFAULT_WORKSPACE
+
+
+def activate_workspace(workspace_id):
+    '''
+    请求开始时绑定工作区，返回用于 release_workspace 的令牌
+    '''
+    workspace = workspace_manager.get(normalize_workspace_id(workspace_id), acquire=True)
+    return workspace, _current_workspace.set(workspace)
+
+
+def release_workspace(token):
+    '''
+    请求结束时解除工作区绑定
+    '''
+    if token is None:
+        return
+    workspace, context_token = token
+    workspace_manager.release(workspace)
+    try:
+        _current_workspace.reset(context_token)
+    except ValueError:
+        # 在不同的上下文中结束请求时无法重置，直接清空
+        _current_workspace.set(None)
+
+
+def current_workspace():
+    '''
+    获取当前工作区；请求上下文之外（如启动脚本）使用默认工作区
+    '''
+    workspace = _current_workspace.get()
+    if workspace is None:
+        workspace = workspace_manager.get(DEFAULT_WORKSPACE)
+    return workspace
+
+
+def start_snapshots():
+    '''
+    启动后台快照线程，并在进程退出时写入最后一次快照
+    工作区在首次访问时才从快照恢复
+    '''
+    if not SNAPSHOT_INTERVAL:
+        return None
+    removed = prune_snapshots()
+    if removed:
+        print(f"Workspace.py - pruned {removed} expired snapshots")
+
+    def run():
+        while True:
+            time.sleep(SNAPSHOT_INTERVAL)
+            workspace_manager.snapshot_all()
+
+    thread = threading.Thread(target=run, name='workspace-snapshot', daemon=True)
+    thread.start()
+    atexit.register(workspace_manager.snapshot_all)
+    return thread
+
+
+def register_workspace_listener(listener):
+    '''
+    注册工作区淘汰监听函数
+    '''
+    workspace_manager.register_listener(listener)
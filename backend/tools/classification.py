@@ -1,5 +1,6 @@
 from .base_tool import BaseTool
 from services.map_service import get_dataset
+from services.ee_concurrency import ee_call
 import ee
 
 class ClassificationTool(BaseTool):
@@ -77,7 +78,7 @@ class ClassificationTool(BaseTool):
                 training_features = training_features.merge(class_features)
                 class_index += 1
             
-            print("Debug - Total training features:", training_features.size().getInfo())  # 添加调试信息
+            print("Debug - Total training features:", ee_call('aggregation', training_features.size().getInfo))  # 添加调试信息
             
             # 获取图像波段
             bands = image.bandNames()
@@ -1,31 +1,298 @@
-from concurrent.futures import ThreadPoolExecutor, as_completed
+from concurrent.futures import ThreadPoolExecutor, CancelledError, FIRST_COMPLETED, wait
+from services.metrics import register_metrics
+import contextvars
+import threading
+import atexit
 import time
+import os
+
+# 全局共享线程池的大小：io 用于 Earth Engine 请求等等待网络的任务，cpu 用于本地计算（AI 推理、矢量化等），
+# jobs 用于后台执行的长时间任务（任务内部的并行处理仍使用 io / cpu）
+IO_WORKERS = int(os.environ.get('VGEE_IO_WORKERS', 16))
+CPU_WORKERS = int(os.environ.get('VGEE_CPU_WORKERS', os.cpu_count() or 4))
+JOB_WORKERS = int(os.environ.get('VGEE_JOB_WORKERS', 4))
+# 设置了取消检查函数时，等待任务期间检查是否取消的间隔（秒）
+CANCEL_POLL_INTERVAL = 0.5
+
+
+class SharedExecutor:
+    """
+    应用内长期存在的线程池，所有请求共用，线程总数不随并发请求数增长
+
+    Args:
+        name: 线程池名称（线程名前缀和指标名称）
+        max_workers: 最大线程数
+    """
+
+    def __init__(self, name, max_workers):
+        self.name = name
+        self.max_workers = max_workers
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix=f'vgee-{name}')
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self.queued = 0      # 已提交、等待线程的任务数
+        self.active = 0      # 正在执行的任务数
+        self.completed = 0
+        self.inline = 0      # 在本线程池的线程内再次提交、直接在当前线程执行的任务数
+
+    def _run(self, func, args, kwargs):
+        with self._lock:
+            self.queued -= 1
+            self.active += 1
+        self._local.worker = True
+        try:
+            return func(*args, **kwargs)
+        finally:
+            self._local.worker = False
+            with self._lock:
+                self.active -= 1
+                self.completed += 1
+
+    def in_worker(self):
+        '''
+        当前线程是否为本线程池的工作线程
+        '''
+        return getattr(self._local, 'worker', False)
+
+    def run_inline(self, func, *args, **kwargs):
+        '''
+        在当前线程中直接执行任务（已在本线程池的线程中时使用）
+        '''
+        with self._lock:
+            self.inline += 1
+        return func(*args, **kwargs)
+
+    def submit(self, func, *args, **kwargs):
+        with self._lock:
+            self.queued += 1
+        future = self._executor.submit(self._run, func, args, kwargs)
+        future.add_done_callback(self._on_done)
+        return future
+
+    def _on_done(self, future):
+        # 开始执行前被取消的任务不会经过 _run
+        if future.cancelled():
+            with self._lock:
+                self.queued -= 1
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False)
+
+    def get_stats(self):
+        with self._lock:
+            return {
+                'max_workers': self.max_workers,
+                'queued': self.queued,
+                'active': self.active,
+                'completed': self.completed,
+                'inline': self.inline
+            }
+
+
+executors = {
+    'io': SharedExecutor('io', IO_WORKERS),
+    'cpu': SharedExecutor('cpu', CPU_WORKERS),
+    'jobs': SharedExecutor('jobs', JOB_WORKERS)
+}
+register_metrics('executors', lambda: {name: executor.get_stats() for name, executor in executors.items()})
+
+
+@atexit.register
+def _shutdown_executors():
+    for executor in executors.values():
+        executor.shutdown()
+
+
+def get_executor(lane='io'):
+    '''
+    获取共享线程池：'io'、'cpu' 或 'jobs'
+    '''
+    return executors[lane]
+
+
+class ItemResult:
+    """
+    并行处理中单个输入的结果
+
+    Attributes:
+        index: 输入在列表中的位置
+        item: 输入（如图层ID）
+        value: 处理函数的返回值
+        error: 处理失败、超时（TimeoutError）或被取消（CancelledError）时的异常，成功时为 None
+        elapsed: 处理耗时（秒）
+    """
+    __slots__ = ('index', 'item', 'value', 'error', 'elapsed')
+
+    def __init__(self, index, item, value=None, error=None, elapsed=0.0):
+        self.index = index
+        self.item = item
+        self.value = value
+        self.error = error
+        self.elapsed = elapsed
+
+    @property
+    def ok(self):
+        return self.error is None
+
 
 class ParallelProcessor:
     @staticmethod
-    def process_layers(layer_ids, process_func, max_workers=4, **kwargs):
+    def map(items, process_func, max_workers=None, lane='io', timeout=None, item_timeout=None,
+            is_cancelled=None, on_progress=None, **kwargs):
+        """
+        并行处理列表中的每一项，按输入顺序返回每一项的结果（ItemResult），单项失败不影响其他项
+
+        超时或取消的任务无法中断，只是不再等待其结果，已在执行的任务会在后台运行结束
+
+        Args:
+            items: 要处理的输入列表（如图层ID）
+            process_func: 处理单个输入的函数 process_func(item, **kwargs)
+            max_workers: 本次调用同时执行的最大任务数（可选），默认只受共享线程池大小限制
+            lane: 使用的线程池，'io'（Earth Engine 请求）或 'cpu'（本地计算）
+            timeout: 整体超时（秒），到期时未完成的项记为 TimeoutError
+            item_timeout: 单项超时（秒），从该项开始执行时计时
+            is_cancelled: 无参函数，返回 True 时取消剩余任务（如客户端已断开），未完成的项记为 CancelledError
+            on_progress: 每完成一项调用 on_progress(已完成数, 总数, ItemResult)
+            **kwargs: 传递给 process_func 的其他参数
+
+        Returns:
+            list: 与 items 一一对应的 ItemResult 列表
+        """
+        items = list(items)
+        outcomes = [None] * len(items)
+        executor = get_executor(lane)
+        deadline = time.time() + timeout if timeout else None
+        finished = 0
+
+        def call(index, item):
+            start = time.time()
+            try:
+                return ItemResult(index, item, process_func(item, **kwargs), elapsed=time.time() - start)
+            except Exception as e:
+                return ItemResult(index, item, error=e, elapsed=time.time() - start)
+
+        def finish(outcome, log=True):
+            nonlocal finished
+            outcomes[outcome.index] = outcome
+            finished += 1
+            if log and outcome.error is not None:
+                print(f"Parallel_processor.py - Error processing {outcome.item}: {type(outcome.error).__name__}: {str(outcome.error)}")
+            if on_progress:
+                try:
+                    on_progress(finished, len(items), outcome)
+                except Exception as e:
+                    print(f"Parallel_processor.py - Error in progress callback: {str(e)}")
+
+        def abort_reason():
+            if is_cancelled and is_cancelled():
+                return CancelledError('cancelled')
+            if deadline and time.time() >= deadline:
+                return TimeoutError(f'timed out after {timeout}s')
+            return None
+
+        # 已在同一线程池的任务中：直接在当前线程依次执行，避免等待同一线程池而死锁
+        if executor.in_worker():
+            for index, item in enumerate(items):
+                reason = abort_reason()
+                if reason is not None:
+                    finish(ItemResult(index, item, error=reason))
+                else:
+                    finish(executor.run_inline(call, index, item))
+            return outcomes
+
+        # 每个任务在调用方上下文的副本中执行，子线程可以访问当前请求的工作区
+        pending = iter(enumerate(items))
+        limit = max_workers or len(items)
+        running = {}    # future -> (index, item)
+        started = {}    # index -> 开始执行的时间，由工作线程写入
+
+        def submit_next():
+            entry = next(pending, None)
+            if entry is None:
+                return False
+            index, item = entry
+
+            def task():
+                started[index] = time.time()
+                return call(index, item)
+
+            running[executor.submit(contextvars.copy_context().run, task)] = entry
+            return True
+
+        while len(running) < limit and submit_next():
+            pass
+
+        while running:
+            reason = abort_reason()
+            if reason is not None:
+                # 取消尚未开始的任务，未完成和未提交的项都记为同一原因
+                print(f"Parallel_processor.py - {type(reason).__name__}: {len(items) - finished} of {len(items)} items not completed")
+                for future, (index, item) in running.items():
+                    future.cancel()
+                    finish(ItemResult(index, item, error=reason), log=False)
+                running.clear()
+                for index, item in pending:
+                    finish(ItemResult(index, item, error=reason), log=False)
+                break
+
+            now = time.time()
+            waits = []
+            if is_cancelled:
+                waits.append(CANCEL_POLL_INTERVAL)
+            if deadline:
+                waits.append(deadline - now)
+            if item_timeout:
+                waits.extend(started[index] + item_timeout - now
+                             for index, _ in running.values() if index in started)
+                # 排队中的任务开始后才计时，定期检查
+                waits.append(item_timeout)
+            done, _ = wait(list(running), timeout=max(min(waits), 0) if waits else None,
+                           return_when=FIRST_COMPLETED)
+
+            for future in done:
+                running.pop(future)
+                finish(future.result())
+                submit_next()
+
+            if item_timeout:
+                now = time.time()
+                for future, (index, item) in list(running.items()):
+                    if index in started and now - started[index] >= item_timeout:
+                        running.pop(future)
+                        finish(ItemResult(index, item, error=TimeoutError(f'timed out after {item_timeout}s'),
+                                          elapsed=now - started[index]))
+                        submit_next()
+
+        return outcomes
+
+    @staticmethod
+    def successful(outcomes):
+        """
+        从 map 的结果中取出成功且有返回值的项
+
+        Returns:
+            tuple: (输入列表, 结果列表)，保持输入顺序
+        """
+        succeeded = [outcome for outcome in outcomes if outcome.ok and outcome.value is not None]
+        return [outcome.item for outcome in succeeded], [outcome.value for outcome in succeeded]
+
+    @staticmethod
+    def process_layers(layer_ids, process_func, max_workers=None, lane='io', **kwargs):
         """
-        通用的并行处理函数
-        
+        通用的并行处理函数，任务在全局共享线程池中执行
+
         Args:
             layer_ids: 要处理的图层ID列表
             process_func: 处理单个图层的函数
-            max_workers: 最大线程数
+            max_workers: 本次调用同时执行的最大任务数（可选），默认只受共享线程池大小限制
+            lane: 使用的线程池，'io'（Earth Engine 请求）或 'cpu'（本地计算）
             **kwargs: 传递给 process_func 的其他参数
-            
+
         Returns:
-            list: 处理结果列表
+            list: 按输入顺序排列的非 None 结果；任一图层出错时抛出其异常
         """
-        results = []
-        with ThreadPoolExecutor(max_workers=min(len(layer_ids), max_workers)) as executor:
-            future_to_layer = {
-                executor.submit(process_func, layer_id, **kwargs): layer_id 
-                for layer_id in layer_ids
-            }
-            
-            for future in as_completed(future_to_layer):
-                result = future.result()
-                if result is not None:
-                    results.append(result)
-                    
-        return results 
\ No newline at end of file
+        outcomes = ParallelProcessor.map(layer_ids, process_func, max_workers=max_workers, lane=lane, **kwargs)
+        for outcome in outcomes:
+            if outcome.error is not None:
+                raise outcome.error
+        return [outcome.value for outcome in outcomes if outcome.value is not None]
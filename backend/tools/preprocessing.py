@@ -47,49 +47,52 @@ class PreprocessingTool(BaseTool):
             raise Exception(f"Error in cloud removal: {str(e)}")
 
     @staticmethod
-    def histogram_equalization(image):
-        """直方图均衡化处理"""
-        try:
-            def equalize_band(band):
-                histogram = image.select(band).reduceRegion(
-                    reducer=ee.Reducer.histogram(maxBuckets=256),
-                    geometry=image.geometry(),
-                    scale=30,
-                    maxPixels=1e13
-                ).get(band)
+    def histogram_expression(image):
+        """波段名称和各波段直方图（一次 reduceRegion），一次求值得到
+        {'bands': 波段名称, 'histograms': {波段: {'bucketMeans', 'histogram', ...}}}"""
+        return ee.Dictionary({
+            'bands': image.bandNames(),
+            'histograms': image.reduceRegion(
+                reducer=ee.Reducer.histogram(maxBuckets=256),
+                geometry=image.geometry(),
+                scale=30,
+                maxPixels=1e13
+            )
+        })
+
+    @staticmethod
+    def histogram_equalization(image, bands, histograms):
+        """直方图均衡化处理
 
-                histogram = ee.Dictionary(histogram)
-                bucket_means = ee.Array(histogram.get('bucketMeans'))
-                counts = ee.Array(histogram.get('histogram'))
+        bands: 影像的波段名称
+        histograms: 已求值的 histogram_expression 结果中的 'histograms'，映射曲线以常数写入表达式，渲染时不再重新统计
+        """
+        try:
+            equalized_bands = []
+            for band in bands:
+                histogram = (histograms or {}).get(band) or {}
+                # 只保留有像元的分组
+                buckets = [(mean, count) for mean, count in
+                           zip(histogram.get('bucketMeans') or [], histogram.get('histogram') or []) if count > 0]
 
-                valid_counts = counts.gt(0)
-                valid_bucket_means = bucket_means.mask(valid_counts)
-                valid_counts_masked = counts.mask(valid_counts)
+                cdf = []
+                total = 0
+                for _, count in buckets:
+                    total += count
+                    cdf.append(total)
 
-                cdf = valid_counts_masked.accum(0)
-                cdf_min = cdf.get([0])
-                cdf_max = cdf.get([-1])
+                if not cdf or cdf[-1] - cdf[0] <= 0:
+                    equalized_bands.append(image.select(band))
+                    continue
 
-                has_enough_values = cdf_max.subtract(cdf_min).gt(0)
+                cdf_min, cdf_max = cdf[0], cdf[-1]
+                equalized_bands.append(image.select(band).interpolate(
+                    [mean for mean, _ in buckets],
+                    [(value - cdf_min) / (cdf_max - cdf_min) * 255 for value in cdf]
+                ))
 
-                return ee.Algorithms.If(
-                    has_enough_values,
-                    image.select(band).interpolate(
-                        valid_bucket_means.toList(),
-                        cdf.subtract(cdf_min)
-                            .divide(cdf_max.subtract(cdf_min))
-                            .multiply(255)
-                            .toList()
-                    ),
-                    image.select(band)
-                )
+            return ee.Image.cat(equalized_bands).rename(bands)
 
-            bands = image.bandNames()
-            equalized_bands = bands.map(lambda band: equalize_band(ee.String(band)))
-            equalized_image = ee.ImageCollection.fromImages(equalized_bands).toBands()
-            
-            return equalized_image.rename(bands)
-            
         except Exception as e:
             print(f"Error in histogram equalization: {str(e)}")
             raise Exception(f"Error in histogram equalization: {str(e)}")
@@ -1,5 +1,6 @@
 from .base_tool import BaseTool
 import ee
+from services.eval_cache import cached_get_info
 
 class RasterOperatorTool(BaseTool):
     @staticmethod
@@ -89,20 +90,22 @@ class RasterOperatorTool(BaseTool):
                         ).rename([band])
                         result = result.addBands(calculated)
             
-            print('Tool_routes.py - raster_calculator_all_bands-result:', result.bandNames().getInfo())
             return result
             
         except Exception as e:
             raise Exception(f"Error in all-bands calculation: {str(e)}")
 
     @staticmethod
-    def raster_calculator_single(image, expression):
-        """单波段计算"""
+    def raster_calculator_single(image, expression, band_names=None):
+        """单波段计算
+        band_names: 影像的波段名称（可选），已知时不再向服务器查询
+        """
         try:
             band_refs = {}
             
             # 获取波段名称并构建 band_refs
-            band_names = image.bandNames().getInfo()
+            if band_names is None:
+                band_names = cached_get_info(image.bandNames(), 'metadata')
             for band in band_names:
                 band_refs[band] = image.select([band])
             
@@ -1,5 +1,5 @@
 // API 路由配置
-const BASE_URL = 'http://localhost:5000'
+export const BASE_URL = 'http://localhost:5000'
 
 export const API_ROUTES = {
     // 地图相关
@@ -0,0 +1,31 @@
+import { BASE_URL } from './routes'
+
+// 工作区：每个浏览器会话（标签页）拥有独立的图层、样本和研究区域
+export const WORKSPACE_HEADER = 'X-Workspace-Id'
+const STORAGE_KEY = 'vgee-workspace-id'
+
+// 获取当前会话的工作区ID，不存在时生成一个
+export const getWorkspaceId = () => {
+    let workspaceId = sessionStorage.getItem(STORAGE_KEY)
+    if (!workspaceId) {
+        workspaceId = crypto.randomUUID
+            ? crypto.randomUUID()
+            : `${Date.now().toString(36)}-${Math.random().toString(36).slice(2, 10)}`
+        sessionStorage.setItem(STORAGE_KEY, workspaceId)
+    }
+    return workspaceId
+}
+
+// 包装 fetch：发往后端的请求自动带上工作区请求头
+export const installWorkspaceFetch = () => {
+    const originalFetch = window.fetch.bind(window)
+    window.fetch = (input, init = {}) => {
+        const url = typeof input === 'string' ? input : input?.url
+        if (!url || !url.startsWith(BASE_URL)) {
+            return originalFetch(input, init)
+        }
+        const headers = new Headers(init.headers || (typeof input === 'string' ? undefined : input.headers))
+        headers.set(WORKSPACE_HEADER, getWorkspaceId())
+        return originalFetch(input, { ...init, headers })
+    }
+}
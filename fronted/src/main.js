@@ -2,6 +2,10 @@ import { createApp } from 'vue'
 import ElementPlus from 'element-plus'
 import 'element-plus/dist/index.css'
 import App from './App.vue'
+import { installWorkspaceFetch } from './api/workspace'
+
+// 所有后端请求携带当前浏览器会话的工作区ID
+installWorkspaceFetch()
 
 const app = createApp(App)
 app.use(ElementPlus)